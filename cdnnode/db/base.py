@@ -0,0 +1,59 @@
+"""
+SQLite backend tuned for several gunicorn workers, the heartbeat thread and
+the background worker sharing one database file.
+
+Use it with ENGINE 'cdnnode.db'. Two extra OPTIONS are understood (and
+removed before the rest are passed to sqlite3.connect):
+
+  'pragmas'           {name: value} run as PRAGMA name=value on every new
+                      connection, e.g. journal_mode=WAL so readers never
+                      block the writer, and busy_timeout so a writer waits
+                      for the lock instead of failing with
+                      "database is locked".
+  'transaction_mode'  'IMMEDIATE' makes atomic() blocks take the write lock
+                      up front. With the default deferred BEGIN, two
+                      transactions that both read then write can't be
+                      resolved by waiting, and SQLite fails one at once
+                      regardless of busy_timeout.
+
+Django 5.1+ has 'transaction_mode' built in; handling it here as well keeps
+it working on 4.2.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+def apply_pragmas(conn, pragmas):
+    """Run PRAGMA name=value for each item on a DB-API sqlite3 connection."""
+    for name, value in pragmas.items():
+        if not name.replace('_', '').isalnum():
+            raise ImproperlyConfigured(f'Invalid SQLite pragma name: {name!r}')
+        conn.execute(f'PRAGMA {name}={value}')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, settings_dict, *args, **kwargs):
+        options = dict(settings_dict.get('OPTIONS') or {})
+        self.pragmas = dict(options.pop('pragmas', None) or {})
+        mode = options.pop('transaction_mode', None)
+        if mode is not None and mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f"DATABASES OPTIONS 'transaction_mode' must be one of "
+                f"{', '.join(TRANSACTION_MODES)} or None, not {mode!r}"
+            )
+        self.begin_mode = mode.upper() if mode else None
+        super().__init__({**settings_dict, 'OPTIONS': options}, *args, **kwargs)
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        apply_pragmas(conn, self.pragmas)
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.begin_mode is None:
+            self.cursor().execute('BEGIN')
+        else:
+            self.cursor().execute(f'BEGIN {self.begin_mode}')
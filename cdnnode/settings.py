@@ -26,6 +26,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'portal.telemetry.TelemetryMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -56,10 +57,27 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'cdnnode.wsgi.application'
 
+# SQLite with WAL, a busy timeout and persistent connections — see cdnnode/db/base.py
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'cdnnode.db',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Seconds a connection is reused across requests (0 = close after each)
+        'CONN_MAX_AGE': int(os.environ.get('CDN_DB_CONN_MAX_AGE', '600')),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'transaction_mode': os.environ.get('CDN_SQLITE_TRANSACTION_MODE', 'IMMEDIATE') or None,
+            'pragmas': {
+                'journal_mode': os.environ.get('CDN_SQLITE_JOURNAL_MODE', 'WAL'),
+                'synchronous': os.environ.get('CDN_SQLITE_SYNCHRONOUS', 'NORMAL'),
+                # Milliseconds a writer waits for the lock before "database is locked"
+                'busy_timeout': int(os.environ.get('CDN_SQLITE_BUSY_TIMEOUT', '5000')),
+                'mmap_size': int(os.environ.get('CDN_SQLITE_MMAP_SIZE', str(64 * 1024 * 1024))),
+                # Negative = KiB, so -8000 is about 8 MB of page cache per connection
+                'cache_size': int(os.environ.get('CDN_SQLITE_CACHE_SIZE', '-8000')),
+                'temp_store': 'MEMORY',
+            },
+        },
     }
 }
 
@@ -79,6 +97,35 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 MEDIA_URL = '/media/'
 MEDIA_ROOT = Path(os.environ.get('MEDIA_ROOT', str(BASE_DIR / 'media')))
 
+# How /media/ files reach the client: 'sendfile' (gunicorn os.sendfile),
+# 'x-accel' (fronting nginx) or 'x-sendfile' (Apache/lighttpd) — see portal/delivery.py
+CDN_MEDIA_DELIVERY = os.environ.get('CDN_MEDIA_DELIVERY', 'sendfile')
+CDN_MEDIA_ACCEL_PREFIX = os.environ.get('CDN_MEDIA_ACCEL_PREFIX', '/_media_internal/')
+# Browser cache lifetime (s) for unversioned /media/ URLs; versioned ones (?v=) are immutable
+CDN_MEDIA_MAX_AGE = int(os.environ.get('CDN_MEDIA_MAX_AGE', '300'))
+# Formats offered for resized card images besides the JPEG fallback, best first
+# (avif is smaller still but slow to encode on a Pi)
+CDN_THUMB_FORMATS = [f.strip() for f in os.environ.get('CDN_THUMB_FORMATS', 'webp').split(',') if f.strip()]
+# Largest image (pixels held in memory at once) decoded for thumbnails and colours;
+# ~3-4 bytes per pixel, so the default stays near 100-130 MB on a 1 GB Pi
+CDN_IMAGE_MAX_PIXELS = int(os.environ.get('CDN_IMAGE_MAX_PIXELS', str(32 * 1000 * 1000)))
+
+# Video posters, durations and scrub sprites (portal/video.py); skipped if ffmpeg is missing
+CDN_FFMPEG = os.environ.get('CDN_FFMPEG', 'ffmpeg')
+CDN_FFPROBE = os.environ.get('CDN_FFPROBE', 'ffprobe')
+CDN_FFMPEG_TIMEOUT = int(os.environ.get('CDN_FFMPEG_TIMEOUT', '120'))
+# Tiles in the scrub-preview sprite (one ffmpeg seek each); 0 turns sprites off
+CDN_VIDEO_SPRITE_FRAMES = int(os.environ.get('CDN_VIDEO_SPRITE_FRAMES', '60'))
+
+# HLS streams for videos, packaged on first play (portal/hls.py); needs ffmpeg
+CDN_HLS_ENABLED = os.environ.get('CDN_HLS_ENABLED', 'true').lower() == 'true'
+# Segments kept on the media drive; least recently played streams are evicted past this
+CDN_HLS_CACHE_MAX_BYTES = int(os.environ.get('CDN_HLS_CACHE_MAX_BYTES', str(20 * 1024 ** 3)))
+# ffmpeg processes packaging at once; copying is cheap, but re-encoding takes a core each
+CDN_HLS_MAX_PACKAGERS = int(os.environ.get('CDN_HLS_MAX_PACKAGERS', '2'))
+# Encoder for videos that aren't H.264 already (e.g. h264_v4l2m2m on a Pi 4)
+CDN_HLS_VIDEO_ENCODER = os.environ.get('CDN_HLS_VIDEO_ENCODER', 'libx264')
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # CDN Node identity — configure via environment variables on Pi
@@ -88,10 +135,56 @@ CDN_PLATFORM_URL = os.environ.get('CDN_PLATFORM_URL', '')
 CDN_API_KEY = os.environ.get('CDN_API_KEY', '')
 CDN_NODE_IDENTIFIER = os.environ.get('CDN_NODE_IDENTIFIER', '')
 CDN_HEARTBEAT_INTERVAL = int(os.environ.get('CDN_HEARTBEAT_INTERVAL', '60'))
+# Heartbeats kept while the platform is unreachable, and the longest retry delay (s)
+CDN_HEARTBEAT_QUEUE_SIZE = int(os.environ.get('CDN_HEARTBEAT_QUEUE_SIZE', '60'))
+CDN_HEARTBEAT_MAX_BACKOFF = int(os.environ.get('CDN_HEARTBEAT_MAX_BACKOFF', '900'))
+
+# Background job worker (manage.py run_worker) — keep low on a Pi
+CDN_WORKER_CONCURRENCY = int(os.environ.get('CDN_WORKER_CONCURRENCY', '1'))
+CDN_WORKER_POLL_INTERVAL = float(os.environ.get('CDN_WORKER_POLL_INTERVAL', '2'))
+# Seconds between incremental rescans of the storage usage index
+CDN_STORAGE_SCAN_INTERVAL = int(os.environ.get('CDN_STORAGE_SCAN_INTERVAL', '600'))
+
+# Seconds between flushes of buffered view counts to the database
+CDN_COUNTER_FLUSH_INTERVAL = int(os.environ.get('CDN_COUNTER_FLUSH_INTERVAL', '10'))
+# Seconds between rebuilds of the related-items table (portal/related.py)
+CDN_RELATED_REBUILD_INTERVAL = int(os.environ.get('CDN_RELATED_REBUILD_INTERVAL', str(6 * 3600)))
+
+# Disk usage sampler (portal/diskusage.py) — seconds between samples of each
+# path, and how long one statvfs may take before the mount is treated as hung
+CDN_DISK_USAGE_TTL = int(os.environ.get('CDN_DISK_USAGE_TTL', '30'))
+CDN_DISK_PROBE_TIMEOUT = float(os.environ.get('CDN_DISK_PROBE_TIMEOUT', '2'))
+
+# Small runtime files shared by all gunicorn workers (generation stamps, locks)
+CDN_STATE_DIR = Path(os.environ.get('CDN_STATE_DIR', str(BASE_DIR / 'state')))
+
+# Rendered pages and fragments (portal/pagecache.py) — file-based so all workers share it
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('CDN_CACHE_DIR', str(CDN_STATE_DIR / 'cache')),
+        'TIMEOUT': 600,
+        'OPTIONS': {'MAX_ENTRIES': 2000},
+    }
+}
+# Seconds an anonymous page render is reused (content changes invalidate sooner)
+CDN_PAGE_CACHE_TIMEOUT = int(os.environ.get('CDN_PAGE_CACHE_TIMEOUT', '300'))
+
+# Uploads through forms (admin) — anything bigger than this is spooled to a
+# temp file instead of being held in memory
+DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024
+FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024
+# Hash uploads as they arrive so duplicates are never written (portal/dedup.py)
+FILE_UPLOAD_HANDLERS = [
+    'portal.dedup.HashingMemoryFileUploadHandler',
+    'portal.dedup.HashingTemporaryFileUploadHandler',
+]
 
-# Large file uploads
-DATA_UPLOAD_MAX_MEMORY_SIZE = 4 * 1024 * 1024 * 1024
-FILE_UPLOAD_MAX_MEMORY_SIZE = 4 * 1024 * 1024 * 1024
+# Resumable chunked uploads (portal/uploads.py) — largest file, largest single
+# chunk (bytes), and hours before an abandoned upload is deleted
+CDN_UPLOAD_MAX_SIZE = int(os.environ.get('CDN_UPLOAD_MAX_SIZE', str(64 * 1024 * 1024 * 1024)))
+CDN_UPLOAD_MAX_CHUNK = int(os.environ.get('CDN_UPLOAD_MAX_CHUNK', str(64 * 1024 * 1024)))
+CDN_UPLOAD_EXPIRY_HOURS = int(os.environ.get('CDN_UPLOAD_EXPIRY_HOURS', '48'))
 
 # Ensure log directory exists before configuring file handler
 import os as _os
@@ -141,5 +234,10 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        'portal.jobs': {
+            'handlers': ['file', 'console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
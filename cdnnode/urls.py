@@ -1,29 +1,22 @@
 from django.contrib import admin
 from django.urls import path, include, re_path
-from django.conf import settings
-from django.views.static import serve as static_serve
+
+from portal import views as portal_views
 
 
 def _serve_media(request, path):
     """
     Serve media files from the dynamically configured media root.
-    Falls back to settings.MEDIA_ROOT so files uploaded before a storage
-    path change (e.g. before an external drive was configured) are still served.
+    Delivery (sendfile / X-Accel-Redirect / X-Sendfile) is chosen by
+    settings.CDN_MEDIA_DELIVERY — see portal.delivery.
     """
-    import os
-    from portal.storage import _get_media_root
-    primary = _get_media_root()
-    if os.path.exists(os.path.join(primary, path)):
-        return static_serve(request, path, document_root=primary)
-    fallback = str(settings.MEDIA_ROOT)
-    if fallback != primary and os.path.exists(os.path.join(fallback, path)):
-        return static_serve(request, path, document_root=fallback)
-    # Default — will return 404 with the correct media path in the error
-    return static_serve(request, path, document_root=primary)
+    from portal.delivery import serve_media
+    return serve_media(request, path)
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', portal_views.metrics, name='metrics'),
     path('', include('portal.urls', namespace='portal')),
     re_path(r'^media/(?P<path>.+)$', _serve_media),
 ]
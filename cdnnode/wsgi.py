@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cdnnode.settings')
 
 application = get_wsgi_application()
+
+from portal.apps import start_services  # noqa: E402 — needs the app registry
+
+start_services()
@@ -3,24 +3,11 @@ from django.utils.html import format_html, mark_safe
 from django import forms
 from django.http import HttpResponseRedirect
 from django.urls import reverse
-from .models import Category, ContentItem, SiteSettings, Announcement, ICON_CHOICES
+from django.db import transaction
+from django.utils.timesince import timesince
+from .models import Category, ContentItem, ContentBlob, SiteSettings, Announcement, Job, ICON_CHOICES
+from . import dedup, diskusage, pagecache, thumbs
 import os
-import shutil
-import concurrent.futures
-
-
-def _disk_usage_safe(path, timeout=2):
-    """
-    Return shutil.disk_usage(path) or None.
-    Uses a thread with a hard timeout so a stuck NFS/USB mount can never
-    block the web request indefinitely.
-    """
-    try:
-        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(shutil.disk_usage, path)
-            return future.result(timeout=timeout)
-    except Exception:
-        return None
 
 
 class ColorPickerWidget(forms.TextInput):
@@ -83,7 +70,7 @@ class CategoryAdmin(admin.ModelAdmin):
 
     def cover_preview(self, obj):
         if obj.cover_image:
-            return format_html('<img src="{}" style="width:60px;height:40px;object-fit:cover;border-radius:6px">', obj.cover_image.url)
+            return format_html('<img src="{}" style="width:60px;height:40px;object-fit:cover;border-radius:6px">', thumbs.default_url(obj.cover_image, 192))
         return format_html('<div style="width:60px;height:40px;background:#e2e8f0;border-radius:6px;display:flex;align-items:center;justify-content:center;font-size:22px">{}</div>', obj.icon)
     cover_preview.short_description = "Cover"
 
@@ -92,7 +79,7 @@ class CategoryAdmin(admin.ModelAdmin):
     icon_display.short_description = "Icon"
 
     def item_count_display(self, obj):
-        return format_html("<strong>{}</strong> items", obj.items.filter(is_active=True).count())
+        return format_html("<strong>{}</strong> items", obj.item_count)
     item_count_display.short_description = "Items"
 
     def size_display(self, obj):
@@ -113,17 +100,17 @@ class ContentItemAdmin(admin.ModelAdmin):
     list_filter = ["category", "file_type", "is_active", "uploaded_at"]
     search_fields = ["title", "description", "tags"]
     list_editable = ["is_active"]
-    readonly_fields = ["file_size", "downloads", "uploaded_at", "updated_at"]
+    readonly_fields = ["file_size", "content_hash", "downloads", "uploaded_at", "updated_at"]
     fieldsets = [
         ("Content", {"fields": ["title", "description", "category", "file", "thumbnail"]}),
         ("Details", {"fields": ["file_type", "year", "duration", "tags"]}),
-        ("Status",  {"fields": ["is_active", "file_size", "downloads", "uploaded_at", "updated_at"]}),
+        ("Status",  {"fields": ["is_active", "file_size", "content_hash", "downloads", "uploaded_at", "updated_at"]}),
     ]
-    actions = ["make_active", "make_inactive"]
+    actions = ["make_active", "make_inactive", "queue_video_previews", "queue_audio_metadata"]
 
     def thumbnail_preview(self, obj):
         if obj.thumbnail:
-            return format_html('<img src="{}" style="width:60px;height:40px;object-fit:cover;border-radius:6px">', obj.thumbnail.url)
+            return format_html('<img src="{}" style="width:60px;height:40px;object-fit:cover;border-radius:6px">', thumbs.default_url(obj.thumbnail, 192))
         icons = {"video": "🎬", "audio": "🎵", "document": "📄", "image": "🖼️", "software": "💾", "other": "📁"}
         return format_html('<div style="width:60px;height:40px;background:#e2e8f0;border-radius:6px;display:flex;align-items:center;justify-content:center;font-size:20px">{}</div>', icons.get(obj.file_type, "📁"))
     thumbnail_preview.short_description = "Preview"
@@ -135,11 +122,31 @@ class ContentItemAdmin(admin.ModelAdmin):
 
     @admin.action(description="Mark selected as active")
     def make_active(self, request, queryset):
-        queryset.update(is_active=True)
+        self._set_active(queryset, True)
 
     @admin.action(description="Mark selected as inactive")
     def make_inactive(self, request, queryset):
-        queryset.update(is_active=False)
+        self._set_active(queryset, False)
+
+    @admin.action(description="Generate video posters and previews")
+    def queue_video_previews(self, request, queryset):
+        pks = list(queryset.filter(file_type="video").values_list("pk", flat=True))
+        Job.objects.bulk_create([Job(kind="video_preview", item_id=pk) for pk in pks])
+        self.message_user(request, f"Queued {len(pks)} video preview job(s) for the background worker.")
+
+    @admin.action(description="Read audio tags (duration, year, artist/album)")
+    def queue_audio_metadata(self, request, queryset):
+        pks = list(queryset.filter(file_type="audio").values_list("pk", flat=True))
+        Job.objects.bulk_create([Job(kind="audio_metadata", item_id=pk) for pk in pks])
+        self.message_user(request, f"Queued {len(pks)} audio metadata job(s) for the background worker.")
+
+    def _set_active(self, queryset, value):
+        # Bulk update skips ContentItem.save(), so recompute the affected category totals
+        category_ids = set(queryset.values_list("category_id", flat=True))
+        with transaction.atomic():
+            queryset.update(is_active=value)
+            Category.refresh_aggregates(category_ids)
+            pagecache.bump('content')
 
 
 class DrivePickerWidget(forms.TextInput):
@@ -154,6 +161,8 @@ class DrivePickerWidget(forms.TextInput):
 
     def _detect_drives(self):
         drives = []
+        # Sampled usage (portal/diskusage.py) — a hung mount can't block the page
+        root_usage = diskusage.usage('/')
         for base in ['/mnt', '/media']:
             if not os.path.exists(base):
                 continue
@@ -162,11 +171,10 @@ class DrivePickerWidget(forms.TextInput):
                     if not entry.is_dir():
                         continue
                     try:
-                        usage = _disk_usage_safe(entry.path)
+                        usage = diskusage.usage(entry.path)
                         if usage is None:
                             continue  # mount timed out or errored — skip it
                         # Only list if it's a separate mount from root
-                        root_usage = _disk_usage_safe('/')
                         if root_usage and usage.total != root_usage.total:
                             drives.append({'path': entry.path, 'free': usage.free, 'total': usage.total})
                     except Exception:
@@ -177,7 +185,7 @@ class DrivePickerWidget(forms.TextInput):
         from django.conf import settings
         default = str(settings.MEDIA_ROOT)
         if not any(d['path'] == default for d in drives):
-            usage = _disk_usage_safe(default)
+            usage = diskusage.usage(default)
             if usage:
                 drives.insert(0, {'path': default, 'free': usage.free, 'total': usage.total, 'default': True})
         return drives
@@ -316,32 +324,21 @@ class SiteSettingsAdmin(admin.ModelAdmin):
 
     def storage_usage(self, obj):
         from portal.storage import _get_media_root
+        from portal import storage_index
         import os as _os
         path = _get_media_root()
 
-        # Count existing files in the current path (to warn if changing)
-        file_count = 0
-        total_size = 0
-        if _os.path.exists(path):
-            try:
-                for dirpath, _dirs, files in _os.walk(path):
-                    for f in files:
-                        if f.startswith('.'):
-                            continue
-                        try:
-                            fsize = _os.path.getsize(_os.path.join(dirpath, f))
-                            total_size += fsize
-                            file_count += 1
-                        except OSError:
-                            pass
-            except Exception:
-                pass
+        # Existing files in the current path (to warn if changing) — read from the
+        # storage index kept by the background worker instead of walking the drive
+        indexed = storage_index.totals(path)
+        file_count = indexed['files'] if indexed else 0
+        total_size = indexed['bytes'] if indexed else 0
 
         if not _os.path.exists(path):
             return format_html(
                 '<span style="color:#d97706">⚠️ Path does not exist yet: <strong>{}</strong> — '
                 'it will be created automatically when you save.</span>', path)
-        usage = _disk_usage_safe(path)
+        usage = diskusage.usage(path)
         if usage is None:
             return format_html('<span style="color:#999">Path not accessible (or timed out): {}</span>', path)
         used_pct = (usage.used / usage.total * 100) if usage.total else 0
@@ -368,6 +365,29 @@ class SiteSettingsAdmin(admin.ModelAdmin):
                 path,
             )
 
+        shared = dedup.stats()
+        dedup_note = ''
+        if shared['reclaimed_bytes']:
+            dedup_note = format_html(
+                '<p style="margin:4px 0 0;font-size:12px;color:#6b7280">'
+                '♻️ {} reclaimed by deduplication — {} file{} shared by several items</p>',
+                fmt(shared['reclaimed_bytes']), shared['shared'], 's' if shared['shared'] != 1 else '',
+            )
+
+        if indexed is None:
+            index_note = mark_safe(
+                '<p style="margin:4px 0 0;font-size:12px;color:#6b7280">'
+                'File count not available yet — the background worker indexes this path '
+                'shortly (or run <code>manage.py scan_storage</code>).</p>'
+            )
+        else:
+            index_note = format_html(
+                '<p style="margin:4px 0 0;font-size:12px;color:#6b7280">'
+                '{} file{} ({}) &nbsp;·&nbsp; indexed {} ago</p>',
+                file_count, 's' if file_count != 1 else '', fmt(total_size),
+                timesince(indexed['scanned_at']) if indexed['scanned_at'] else '0 minutes',
+            )
+
         return format_html(
             '<div style="max-width:500px">'
             '<p style="margin:0 0 4px;font-size:13px">📂 Path: <strong>{}</strong></p>'
@@ -376,9 +396,13 @@ class SiteSettingsAdmin(admin.ModelAdmin):
             '<p style="margin:4px 0 0;font-size:12px;color:#6b7280">'
             '{} used &nbsp;·&nbsp; {} free &nbsp;·&nbsp; {} total</p>'
             '{}'
+            '{}'
+            '{}'
             '</div>',
             path, bar_color, used_pct,
             fmt(usage.used), fmt(usage.free), fmt(usage.total),
+            index_note,
+            dedup_note,
             files_warning,
         )
     storage_usage.short_description = "Current Storage Usage"
@@ -443,14 +467,79 @@ class AnnouncementAdmin(admin.ModelAdmin):
     @admin.action(description='Mark selected as active')
     def make_active(self, request, queryset):
         queryset.update(is_active=True)
+        pagecache.bump('announcements')
 
     @admin.action(description='Mark selected as inactive')
     def make_inactive(self, request, queryset):
         queryset.update(is_active=False)
+        pagecache.bump('announcements')
 
     actions = ['make_active', 'make_inactive']
 
 
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ["status_badge", "kind", "item", "attempts", "created_at", "finished_at", "short_error"]
+    list_display_links = ["kind"]
+    list_filter = ["status", "kind"]
+    search_fields = ["kind", "item__title", "last_error"]
+    readonly_fields = ["kind", "item", "payload", "status", "attempts", "max_attempts", "last_error",
+                       "run_after", "created_at", "started_at", "finished_at"]
+    actions = ["retry"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def status_badge(self, obj):
+        colors = {"pending": "#94a3b8", "running": "#3b82f6", "done": "#10b981", "failed": "#dc2626"}
+        return format_html('<span style="background:{};color:white;padding:2px 8px;border-radius:12px;font-size:11px;font-weight:600">{}</span>', colors.get(obj.status, "#94a3b8"), obj.get_status_display())
+    status_badge.short_description = "Status"
+
+    def short_error(self, obj):
+        lines = obj.last_error.strip().splitlines()
+        return lines[-1][:120] if lines else "—"
+    short_error.short_description = "Last error"
+
+    @admin.action(description="Retry selected jobs")
+    def retry(self, request, queryset):
+        from django.utils import timezone
+        count = queryset.exclude(status=Job.RUNNING).update(
+            status=Job.PENDING, attempts=0, run_after=timezone.now(), finished_at=None,
+        )
+        self.message_user(request, f"{count} job(s) queued for retry.")
+
+
+@admin.register(ContentBlob)
+class ContentBlobAdmin(admin.ModelAdmin):
+    list_display = ["name", "size_display", "ref_count", "reclaimed_display", "created_at"]
+    search_fields = ["name", "hash"]
+    readonly_fields = ["hash", "name", "size", "ref_count", "created_at"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False  # Blobs go away with their last item
+
+    def changelist_view(self, request, extra_context=None):
+        shared = dedup.stats()
+        self.message_user(
+            request,
+            f"{shared['references']} item(s) stored in {shared['blobs']} file(s); "
+            f"{shared['reclaimed_bytes'] / 1024 ** 3:.2f} GB reclaimed by deduplication.",
+        )
+        return super().changelist_view(request, extra_context)
+
+    def size_display(self, obj):
+        return f"{obj.size / 1024 ** 2:.1f} MB"
+    size_display.short_description = "Size"
+    size_display.admin_order_field = "size"
+
+    def reclaimed_display(self, obj):
+        return f"{obj.reclaimed_bytes / 1024 ** 2:.1f} MB" if obj.ref_count > 1 else "—"
+    reclaimed_display.short_description = "Reclaimed"
+
+
 # ── Admin site branding ────────────────────────────────────────────────────────
 admin.site.site_header = "CDN Node Administration"
 admin.site.site_title  = "CDN Node Admin"
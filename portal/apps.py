@@ -6,13 +6,18 @@ class PortalConfig(AppConfig):
     name = 'portal'
 
     def ready(self):
-        import sys
-        # Skip during management commands (migrate, collectstatic, shell, etc.)
-        if any(cmd in sys.argv for cmd in ('migrate', 'collectstatic', 'shell', 'makemigrations', 'createsuperuser')):
-            return
-        from . import heartbeat
-        heartbeat.start()
-        _auto_configure_storage()
+        from . import signals  # noqa: F401 — connect model signal handlers
+
+
+def start_services():
+    """
+    Start the heartbeat and detect external drives. Called from cdnnode/wsgi.py,
+    so only processes that serve requests (gunicorn workers, runserver) run
+    them — management commands, the job worker and the test runner never do.
+    """
+    from . import heartbeat
+    heartbeat.start()
+    _auto_configure_storage()
 
 
 def _auto_configure_storage():
@@ -28,19 +33,11 @@ def _auto_configure_storage():
     and fall back to the default MEDIA_ROOT.
     """
     import os
-    import shutil
-    import concurrent.futures
     import logging
+    from portal.diskusage import usage as _usage_safe
 
     logger = logging.getLogger('portal.heartbeat')
 
-    def _usage_safe(path, timeout=2):
-        try:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as ex:
-                return ex.submit(shutil.disk_usage, path).result(timeout=timeout)
-        except Exception:
-            return None
-
     try:
         from portal.models import SiteSettings
         site = SiteSettings.get()
@@ -0,0 +1,196 @@
+"""
+Duration, year and tags for audio items, read from their embedded metadata.
+
+mutagen's "easy" interfaces give ID3 (MP3), MP4 atoms (M4A/AAC), FLAC and
+Ogg Vorbis/Opus comments the same keys, so one reader covers them all:
+
+  duration  The stream length from the file header, as format_duration().
+  year      The first four-digit year in the date tag (ID3 TDRC/TYER,
+            MP4 ©day, Vorbis DATE).
+  tags      Artist, album artist, album and genre, appended to the item's
+            existing tags (folder names from import_library, or typed by
+            hand) without repeating any of them.
+
+Values typed in by hand are kept: duration and year are only filled in
+when blank, and tags are only ever added.
+
+A new audio item gets an 'audio_metadata' job (ContentItem.save()).
+import_library reads the tracks it registers, and `manage.py
+backfill_metadata` reads the existing library. Both go through backfill(),
+which reads the files in a process pool and writes the results with
+bulk_update.
+"""
+import logging
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import mutagen
+
+logger = logging.getLogger(__name__)
+
+# Easy-interface keys whose values become tags, in this order
+TAG_KEYS = ('artist', 'albumartist', 'album', 'genre')
+DATE_KEYS = ('date', 'originaldate', 'year')
+
+TAGS_MAX_LENGTH = 500
+
+_YEAR_RE = re.compile(r'\b(\d{4})\b')
+
+
+def read(path):
+    """
+    {'duration': seconds or None, 'year': int or None, 'tags': [str, ...]}
+    for an audio file, or None if mutagen can't read it.
+    """
+    try:
+        audio = mutagen.File(path, easy=True)
+    except Exception as e:  # mutagen raises its own error per format
+        logger.info('Could not read tags from %s: %s', path, e)
+        return None
+    if audio is None:
+        return None
+
+    length = getattr(audio.info, 'length', 0)
+    meta = {'duration': length if length and length > 0 else None, 'year': None, 'tags': []}
+    tags = audio.tags or {}
+    for key in DATE_KEYS:
+        for value in _values(tags, key):
+            match = _YEAR_RE.search(value)
+            if match and 1000 <= int(match.group(1)) <= 2999:
+                meta['year'] = int(match.group(1))
+                break
+        if meta['year']:
+            break
+    for key in TAG_KEYS:
+        for value in _values(tags, key):
+            # Commas separate tags, so "Crosby, Stills & Nash" would become two
+            value = ' '.join(value.replace(',', ' ').split())
+            if value:
+                meta['tags'].append(value)
+    return meta
+
+
+def _values(tags, key):
+    try:
+        values = tags[key]
+    except (KeyError, ValueError):
+        return []
+    return [str(v) for v in (values if isinstance(values, list) else [values])]
+
+
+def merge_tags(existing, new):
+    """`existing` comma-separated tags plus `new` ones not already present, within TAGS_MAX_LENGTH."""
+    tags = [t.strip() for t in existing.split(',') if t.strip()]
+    seen = {t.casefold() for t in tags}
+    for tag in new:
+        if tag.casefold() in seen:
+            continue
+        candidate = ', '.join([*tags, tag])
+        if len(candidate) > TAGS_MAX_LENGTH:
+            continue
+        tags.append(tag)
+        seen.add(tag.casefold())
+    return ', '.join(tags)
+
+
+def apply(item, meta):
+    """Set the fields `meta` fills in on `item`; returns the names of those that changed."""
+    from portal.models import format_duration
+
+    changed = []
+    if meta['duration'] and not item.duration:
+        item.duration = format_duration(meta['duration'])
+        changed.append('duration')
+    if meta['year'] and item.year is None:
+        item.year = meta['year']
+        changed.append('year')
+    tags = merge_tags(item.tags, meta['tags'])
+    if tags != item.tags:
+        item.tags = tags
+        changed.append('tags')
+    return changed
+
+
+# ── Pipeline ──────────────────────────────────────────────────────────────────
+
+def process(item):
+    """Read one audio item's metadata and save it. Returns the fields updated."""
+    from portal import pagecache, search
+    from portal.models import ContentItem
+
+    if item.file_type != 'audio' or not item.file:
+        return []
+    meta = read(item.file.path)
+    if meta is None:
+        return []
+    changed = apply(item, meta)
+    if changed:
+        # A plain UPDATE: save() would re-run upload-side work (hashing, aggregates)
+        ContentItem.objects.filter(pk=item.pk).update(**{name: getattr(item, name) for name in changed})
+        if 'tags' in changed:
+            search.index_items([item])
+        pagecache.bump('content')
+    return changed
+
+
+def _read_task(task):
+    """Runs in a pool process: (pk, metadata or None) for one file."""
+    pk, path = task
+    return pk, read(path)
+
+
+def backfill(queryset, workers=None, batch_size=500, progress=None):
+    """
+    Read the files of the audio items in `queryset` with `workers`
+    processes and save what they contain, batch_size items per
+    bulk_update. progress(done, total) is called after each batch.
+    Returns {'items', 'updated', 'unreadable', 'seconds'}.
+    """
+    from django.db import connections, transaction
+
+    from portal import pagecache, search
+    from portal.models import ContentItem
+    from portal.storage import _get_media_root
+
+    started = time.monotonic()
+    media_root = _get_media_root()
+    items = {
+        item.pk: item
+        for item in queryset.filter(file_type='audio').exclude(file='').select_related('category')
+        .only('pk', 'file', 'duration', 'year', 'tags', 'title', 'description', 'category__name')
+    }
+    tasks = [(pk, os.path.join(media_root, item.file.name)) for pk, item in items.items()]
+    stats = {'items': len(tasks), 'updated': 0, 'unreadable': 0}
+
+    def flush(batch):
+        if not batch:
+            return
+        with transaction.atomic():
+            ContentItem.objects.bulk_update(batch, ['duration', 'year', 'tags'])
+            search.index_items(batch)
+        stats['updated'] += len(batch)
+
+    connections.close_all()  # Don't share the SQLite handle with forked workers
+    done, batch = 0, []
+    with ProcessPoolExecutor(max_workers=max(1, workers or os.cpu_count() or 1)) as pool:
+        for pk, meta in pool.map(_read_task, tasks, chunksize=32):
+            done += 1
+            if meta is None:
+                stats['unreadable'] += 1
+            elif apply(items[pk], meta):
+                batch.append(items[pk])
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+            if progress and done % batch_size == 0:
+                progress(done, len(tasks))
+    flush(batch)
+    if progress and done % batch_size:
+        progress(done, len(tasks))
+
+    if stats['updated']:
+        pagecache.bump('content')
+    stats['seconds'] = time.monotonic() - started
+    return stats
@@ -0,0 +1,154 @@
+"""
+Cache validators and conditional GET for media and the JSON API.
+
+Media
+    The portal links item files and thumbnails with a version in the query
+    string (/media/<name>?v=<version>). An item file's version is the start
+    of its content hash (portal/dedup.py) followed by a SECRET_KEY signature
+    of the name and that hash; thumbnails, category covers and their resized
+    variants are write-once (a new image always gets a new name), so their
+    version is the signature of the name alone. A versioned URL names one
+    exact content, so it is served with a long `immutable` Cache-Control and
+    a strong ETag of the version.
+
+    Because only the server can sign, a request whose If-None-Match carries
+    the ETag of a correctly signed version is answered 304 from the URL
+    alone (is_signed()), before any query or disk access: the client holds
+    the content the URL was issued for. The trade-off is that such a 304 is
+    also given for a file deleted since. A 200 checks the version against
+    the stored file (version_is_current()), so a missing path still 404s
+    and an outdated version can't pin other content as immutable.
+    Unversioned media URLs, and ones whose version isn't current, keep the
+    mtime/size ETag and a short max-age.
+
+JSON API
+    @conditional(...) views get an ETag built from the page cache
+    generations they depend on (the catalogue version: content,
+    categories, settings, storage — see portal/pagecache.py), the full
+    path and any extra state the view names. A matching If-None-Match is
+    answered 304 before the view runs.
+"""
+import functools
+import hashlib
+import re
+
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from portal import pagecache
+
+# Hex digits of the signature, and of the content hash an item file's version starts with
+VERSION_LENGTH = 16
+_VERSION_RE = re.compile(r'([0-9a-f]{%d}){1,2}' % VERSION_LENGTH)
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+# Files under these are never rewritten in place, so the name identifies the content
+# (variants/ holds resized copies of write-once images, see portal/thumbs.py)
+WRITE_ONCE_DIRS = ('thumbnails/', 'covers/', 'variants/', 'previews/')
+
+
+# ── Validators ────────────────────────────────────────────────────────────────
+
+def etag_matches(request, etag):
+    """Weak comparison of If-None-Match against `etag` (RFC 7232 §3.2)."""
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    tag = etag[2:] if etag.startswith('W/') else etag
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == tag:
+            return True
+    return False
+
+
+def not_modified(etag, cache_control=None):
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    if cache_control:
+        response['Cache-Control'] = cache_control
+    return response
+
+
+# ── Media versions ────────────────────────────────────────────────────────────
+
+def _signature(name, content=''):
+    return salted_hmac('portal.media_version', f'{name}\0{content}', algorithm='sha256').hexdigest()[:VERSION_LENGTH]
+
+
+def media_version(name, content_hash=''):
+    """The ?v= version for a stored file, or None if it can't be versioned."""
+    if content_hash:
+        content = content_hash[:VERSION_LENGTH]
+        return content + _signature(name, content)
+    if name.startswith(WRITE_ONCE_DIRS):
+        return _signature(name)
+    return None
+
+
+def versioned_url(field_file, content_hash=''):
+    """field_file.url with its version appended, or plain if it has none."""
+    url = field_file.url
+    version = media_version(field_file.name, content_hash)
+    return f'{url}?v={version}' if version else url
+
+
+def requested_version(request):
+    version = request.GET.get('v', '')
+    return version if _VERSION_RE.fullmatch(version) else None
+
+
+def is_signed(name, version):
+    """True if media_version() issued `version` for `name` at some point. No query, no disk access."""
+    if len(version) == VERSION_LENGTH:
+        return name.startswith(WRITE_ONCE_DIRS) and constant_time_compare(version, _signature(name))
+    content, signature = version[:VERSION_LENGTH], version[VERSION_LENGTH:]
+    return constant_time_compare(signature, _signature(name, content))
+
+
+def version_is_current(name, version):
+    """True if `version` is the version of the file stored as `name` (one indexed query for item files)."""
+    if not is_signed(name, version):
+        return False
+    if name.startswith(WRITE_ONCE_DIRS):
+        return True
+    from portal.models import ContentBlob
+    digest = ContentBlob.objects.filter(name=name).values_list('hash', flat=True).first()
+    return digest is not None and digest[:VERSION_LENGTH] == version[:VERSION_LENGTH]
+
+
+# ── JSON API ──────────────────────────────────────────────────────────────────
+
+def conditional(*depends_on, extra=None):
+    """
+    ETag a GET view from the versions of `depends_on`, the full path and
+    `extra(request)` (a string, for state outside the generations), and
+    answer a matching If-None-Match with 304 before the view runs.
+    """
+    def decorator(view):
+        view_name = view.__name__
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            key = '|'.join((
+                view_name, request.get_full_path(), pagecache.versions(*depends_on),
+                extra(request) if extra else '',
+            ))
+            etag = '"%s"' % hashlib.blake2b(key.encode(), digest_size=12).hexdigest()
+            if etag_matches(request, etag):
+                return not_modified(etag, 'no-cache')
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.has_header('ETag'):
+                response['ETag'] = etag
+                patch_cache_control(response, no_cache=True)
+            return response
+        return wrapper
+    return decorator
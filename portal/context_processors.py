@@ -1,9 +1,14 @@
-from .models import SiteSettings, Category
+from django.utils.functional import SimpleLazyObject
+
+from .models import Category
+from . import pagecache
 
 
 def site_settings(request):
-    """Inject SiteSettings and all_categories into every template context."""
+    """Inject SiteSettings, all_categories and cache versions into every template context."""
     return {
-        'site_settings': SiteSettings.get(),
+        # Per-process copy refreshed when settings change; lazy so admin pages don't touch it
+        'site_settings': SimpleLazyObject(pagecache.site_settings),
         'all_categories': Category.objects.all(),
+        'cache_version': pagecache.Versions(),
     }
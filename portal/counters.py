@@ -0,0 +1,209 @@
+"""
+Buffered view counters.
+
+Viewing an item used to run an UPDATE per page hit, which takes SQLite's write
+lock on every request and, because it wrote a value read earlier, lost
+concurrent views. Now item_detail only calls incr(), which bumps an in-memory
+counter. A background thread in each gunicorn worker flushes the buffer every
+CDN_COUNTER_FLUSH_INTERVAL seconds (and at exit) in one transaction:
+
+  * ContentItem.downloads += n, as F() updates grouped by delta
+  * ViewWindow rows for the hour and the day of each view, upserted with
+    count = count + n
+  * CoView rows for visitors who went from one item page straight to
+    another (the related-items recommender uses them, portal/related.py)
+
+A worker killed with SIGKILL loses at most one interval of views. Old
+ViewWindow and CoView rows are pruned by the background worker
+(prune_view_windows).
+"""
+import atexit
+import logging
+import threading
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Hourly rows are kept this long, daily rows KEEP_DAYS
+KEEP_HOURS = 48
+KEEP_DAYS = 90
+
+# Keeps IN (...) lists under SQLite's bound-parameter limit
+_BATCH = 500
+
+_lock = threading.Lock()
+_pending = Counter()   # (item pk, hour start) -> views
+_pairs = Counter()     # (lower pk, higher pk, day) -> item-to-item navigations
+_thread = None
+_stop_event = threading.Event()
+
+
+def _hour_start(when):
+    return when.replace(minute=0, second=0, microsecond=0)
+
+
+def _day_start(when):
+    return timezone.localtime(when).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def window_start(when, period):
+    from portal.models import ViewWindow
+    return _hour_start(when) if period == ViewWindow.HOUR else _day_start(when)
+
+
+def incr(pk, n=1, came_from=None):
+    """
+    Count `n` views of item `pk`, reached from the page of item `came_from`
+    if given. Never touches the database.
+    """
+    now = timezone.now()
+    with _lock:
+        _pending[(pk, _hour_start(now))] += n
+        if came_from is not None and came_from != pk:
+            _pairs[(min(pk, came_from), max(pk, came_from), timezone.localdate(now))] += n
+    _ensure_thread()
+
+
+# ── Flushing ──────────────────────────────────────────────────────────────────
+
+def flush():
+    """Write buffered views to the database. Returns the number of views written."""
+    global _pending, _pairs
+    with _lock:
+        pending, _pending = _pending, Counter()
+        pairs, _pairs = _pairs, Counter()
+    if not pending:
+        return 0
+    try:
+        _write(pending, pairs)
+    except Exception:
+        with _lock:
+            _pending.update(pending)  # Retry on the next flush
+            _pairs.update(pairs)
+        raise
+    return sum(pending.values())
+
+
+def _write(pending, pairs=()):
+    from portal.models import CoView, ContentItem, ViewWindow
+
+    totals = Counter()
+    windows = Counter()
+    for (pk, hour), n in pending.items():
+        totals[pk] += n
+        windows[(pk, ViewWindow.HOUR, hour)] += n
+        windows[(pk, ViewWindow.DAY, _day_start(hour))] += n
+
+    with transaction.atomic():
+        pks = list(set(totals).union(*((a, b) for a, b, _ in pairs)))
+        existing = set()
+        for i in range(0, len(pks), _BATCH):
+            existing.update(ContentItem.objects.filter(pk__in=pks[i:i + _BATCH]).values_list('pk', flat=True))
+
+        by_delta = defaultdict(list)
+        for pk, n in totals.items():
+            if pk in existing:
+                by_delta[n].append(pk)
+        for n, group in by_delta.items():
+            for i in range(0, len(group), _BATCH):
+                ContentItem.objects.filter(pk__in=group[i:i + _BATCH]).update(downloads=F('downloads') + n)
+
+        qn = connection.ops.quote_name
+        table = qn(ViewWindow._meta.db_table)
+        rows = [
+            (pk, period, connection.ops.adapt_datetimefield_value(start), n)
+            for (pk, period, start), n in windows.items() if pk in existing
+        ]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {table} (item_id, period, {qn("start")}, {qn("count")}) '
+                f'VALUES (%s, %s, %s, %s) '
+                f'ON CONFLICT (item_id, period, {qn("start")}) '
+                f'DO UPDATE SET {qn("count")} = {table}.{qn("count")} + excluded.{qn("count")}',
+                rows,
+            )
+            pair_rows = [(a, b, n, day) for (a, b, day), n in pairs.items() if a in existing and b in existing]
+            if pair_rows:
+                table = qn(CoView._meta.db_table)
+                cursor.executemany(
+                    f'INSERT INTO {table} (item_a_id, item_b_id, {qn("count")}, last_viewed) '
+                    f'VALUES (%s, %s, %s, %s) '
+                    f'ON CONFLICT (item_a_id, item_b_id) '
+                    f'DO UPDATE SET {qn("count")} = {table}.{qn("count")} + excluded.{qn("count")}, '
+                    f'last_viewed = MAX(last_viewed, excluded.last_viewed)',
+                    [(a, b, n, connection.ops.adapt_datefield_value(day)) for a, b, n, day in pair_rows],
+                )
+
+
+def _flush_loop():
+    interval = settings.CDN_COUNTER_FLUSH_INTERVAL
+    try:
+        while not _stop_event.wait(interval):
+            close_old_connections()
+            try:
+                flush()
+            except Exception as e:
+                logger.error('View counter flush failed: %s', e)
+    finally:
+        connection.close()
+
+
+def _ensure_thread():
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            return
+        _thread = threading.Thread(target=_flush_loop, daemon=True, name='view-counters')
+        _thread.start()
+
+
+@atexit.register
+def _flush_at_exit():
+    _stop_event.set()
+    try:
+        flush()
+    except Exception as e:
+        logger.error('View counter flush at exit failed: %s', e)
+
+
+# ── Reading ───────────────────────────────────────────────────────────────────
+
+def _since(period, windows):
+    from portal.models import ViewWindow
+    step = timedelta(hours=1) if period == ViewWindow.HOUR else timedelta(days=1)
+    return window_start(timezone.now(), period) - step * (windows - 1)
+
+
+def popular(period='day', windows=1, limit=10):
+    """Return [(item pk, views)] over the last `windows` hours or days, most viewed first."""
+    from portal.models import ViewWindow
+    rows = ViewWindow.objects.filter(period=period, start__gte=_since(period, windows)) \
+        .values('item').annotate(views=Sum('count')).order_by('-views', 'item')[:limit]
+    return [(row['item'], row['views']) for row in rows]
+
+
+def history(pk, period='hour', windows=24):
+    """Return [(window start, views)] for one item, oldest first, skipping empty windows."""
+    from portal.models import ViewWindow
+    return list(
+        ViewWindow.objects.filter(item_id=pk, period=period, start__gte=_since(period, windows))
+        .order_by('start').values_list('start', 'count')
+    )
+
+
+def prune():
+    """Delete hourly rows older than KEEP_HOURS, daily and co-view rows older than KEEP_DAYS."""
+    from portal.models import CoView, ViewWindow
+    now = timezone.now()
+    deleted, _ = ViewWindow.objects.filter(period=ViewWindow.HOUR, start__lt=now - timedelta(hours=KEEP_HOURS)).delete()
+    more, _ = ViewWindow.objects.filter(period=ViewWindow.DAY, start__lt=now - timedelta(days=KEEP_DAYS)).delete()
+    pairs, _ = CoView.objects.filter(last_viewed__lt=timezone.localdate(now) - timedelta(days=KEEP_DAYS)).delete()
+    return deleted + more + pairs
@@ -0,0 +1,257 @@
+"""
+Content-addressed deduplication of item files.
+
+Every ContentItem file in the media root is identified by the BLAKE2b-256
+hash of its bytes. The first item with a given hash owns a ContentBlob
+(hash, storage name, size, ref_count); later items with the same bytes point
+their `file` at the blob's name instead of keeping a copy, and the blob
+counts them. Deleting an item or replacing its file releases its reference;
+the file is removed from the drive when the last reference goes.
+
+Hashes are computed while the data streams past, never by a second read in
+the request:
+
+  * admin form uploads — the upload handlers below hash each chunk as
+    Django spools it, so a duplicate is detected before it is written to
+    the media drive and only the existing blob is referenced
+  * resumable uploads, items saved from code and the existing library —
+    the worker's 'content_hash' and 'dedupe_library' jobs read the stored
+    file once and, if a blob with the same hash exists, relink the item and
+    delete its copy
+
+Only files the portal wrote itself (ContentItem.managed_file: admin and
+resumable uploads) are hashed, relinked or deleted. Libraries registered in
+place by import_library, whether linked in from outside the media root or
+already inside it, belong to the user's own folder structure.
+
+Blob creation relies on writes being serialised (SQLite BEGIN IMMEDIATE,
+see cdnnode/db/base.py), so two uploads of the same file can't both create
+a blob for it.
+"""
+import hashlib
+import logging
+import os
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.db import transaction
+from django.db.models import F, Count, Sum
+
+logger = logging.getLogger(__name__)
+
+# Bytes read per update when hashing a stored file
+HASH_CHUNK = 1024 * 1024
+
+
+def new_hash():
+    return hashlib.blake2b(digest_size=32)
+
+
+def hash_file(path):
+    h = new_hash()
+    with open(path, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# ── Upload handlers (settings.FILE_UPLOAD_HANDLERS) ───────────────────────────
+
+class _HashingMixin:
+    """Hash each uploaded file as its chunks arrive; the result is file.content_hash."""
+
+    def new_file(self, *args, **kwargs):
+        self._hash = new_hash()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if getattr(self, 'activated', True):
+            self._hash.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        if uploaded is not None:
+            uploaded.content_hash = self._hash.hexdigest()
+        return uploaded
+
+
+class HashingMemoryFileUploadHandler(_HashingMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(_HashingMixin, TemporaryFileUploadHandler):
+    pass
+
+
+# ── References ────────────────────────────────────────────────────────────────
+
+def _storage():
+    from portal.models import ContentItem
+    return ContentItem._meta.get_field('file').storage
+
+
+def _owned(storage, name):
+    """True if `name` really lives inside the media root (not behind a symlink)."""
+    root = os.path.realpath(storage.path(''))
+    return os.path.realpath(storage.path(name)).startswith(root + os.sep)
+
+
+def prepare(item):
+    """
+    Called by ContentItem.save() before a new or changed file is committed.
+    If the upload was hashed and that content is already on the drive, point
+    the item at the existing file so the upload is never written.
+    """
+    from portal.models import ContentBlob
+    item.blob = None
+    item.content_hash = ''
+    digest = getattr(getattr(item.file, 'file', None), 'content_hash', None) \
+        if not item.file._committed else None
+    if not digest:
+        return
+    item.content_hash = digest
+    blob = ContentBlob.objects.filter(hash=digest).first()
+    if blob is None:
+        return
+    storage = item.file.storage
+    try:
+        if storage.size(blob.name) != blob.size:
+            return
+    except OSError:
+        return
+    item.file.name = blob.name
+    item.file._committed = True
+    item.blob = blob
+
+
+def file_saved(item, old_blob_id=None):
+    """Called by ContentItem.save() after a new or changed file was saved."""
+    from portal.models import ContentBlob, Job
+    if item.blob_id:
+        ContentBlob.objects.filter(pk=item.blob_id).update(ref_count=F('ref_count') + 1)
+    elif item.managed_file:
+        if item.content_hash:
+            _link(item, item.content_hash)
+        else:
+            Job.enqueue('content_hash', item=item)
+    if old_blob_id:
+        release(old_blob_id)
+
+
+def _link(item, digest):
+    """
+    Make `item` a reference to the blob for `digest`, creating the blob from
+    the item's own file if there is none. Returns the bytes freed by
+    dropping the item's copy (0 if it was kept).
+    """
+    from portal.models import ContentBlob, ContentItem
+    storage = item.file.storage
+    name = item.file.name
+    size = storage.size(name)
+    duplicate = None
+    with transaction.atomic():
+        blob = ContentBlob.objects.filter(hash=digest).first()
+        if blob is not None and blob.name != name and _intact(storage, blob):
+            duplicate = name
+            ContentBlob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+        elif blob is not None:
+            # The blob is this very file, or its file went missing — this copy takes over
+            ContentBlob.objects.filter(pk=blob.pk).update(name=name, size=size, ref_count=F('ref_count') + 1)
+            ContentItem.objects.filter(blob=blob).update(file=name)
+            blob.name = name
+        else:
+            blob = ContentBlob.objects.create(hash=digest, name=name, size=size, ref_count=1)
+        ContentItem.objects.filter(pk=item.pk).update(file=blob.name, blob=blob, content_hash=digest)
+    item.file.name = blob.name
+    item.blob, item.content_hash = blob, digest
+    if duplicate is None:
+        return 0
+    transaction.on_commit(lambda: _delete_if_unused(storage, duplicate))
+    return size
+
+
+def _intact(storage, blob):
+    try:
+        return storage.size(blob.name) == blob.size
+    except OSError:
+        return False
+
+
+def release(blob_id):
+    """Drop one reference; delete the blob and its file when none are left."""
+    from portal.models import ContentBlob
+    with transaction.atomic():
+        ContentBlob.objects.filter(pk=blob_id, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        blob = ContentBlob.objects.filter(pk=blob_id, ref_count=0).first()
+        if blob is None:
+            return
+        blob.delete()
+    storage = _storage()
+    transaction.on_commit(lambda: _delete_if_unused(storage, blob.name))
+
+
+def _delete_if_unused(storage, name):
+    from portal.models import ContentBlob, ContentItem
+    if ContentItem.objects.filter(file=name).exists() or ContentBlob.objects.filter(name=name).exists():
+        return
+    try:
+        storage.delete(name)
+    except OSError as e:
+        logger.warning('Dedup: could not delete %s: %s', name, e)
+
+
+# ── Background hashing ────────────────────────────────────────────────────────
+
+def hash_item(item):
+    """Hash one item's stored file and dedupe it. Returns the bytes freed."""
+    from portal.models import ContentItem
+    if item.blob_id or not item.file or not item.managed_file:
+        return 0
+    storage = item.file.storage
+    name = item.file.name
+    # The upload directory itself may be a symlink into the user's folders
+    if not _owned(storage, name):
+        return 0
+    digest = hash_file(storage.path(name))
+    # The file may have been replaced while it was being read
+    if not ContentItem.objects.filter(pk=item.pk, file=name, blob__isnull=True).exists():
+        return 0
+    return _link(item, digest)
+
+
+def dedupe_library():
+    """
+    Hash and dedupe every uploaded item not yet linked to a blob. Returns
+    (items linked, bytes freed).
+    """
+    from portal.models import ContentItem
+    linked = freed = 0
+    pending = ContentItem.objects.filter(blob__isnull=True, managed_file=True).exclude(file='') \
+        .only('pk', 'file', 'blob', 'managed_file').order_by('pk')
+    for item in pending.iterator(chunk_size=200):
+        try:
+            freed += hash_item(item)
+        except OSError as e:
+            logger.warning('Dedup: skipping item %s (%s): %s', item.pk, item.file.name, e)
+            continue
+        if item.blob_id:
+            linked += 1
+    return linked, freed
+
+
+def stats():
+    """Return {'blobs', 'shared', 'references', 'stored_bytes', 'reclaimed_bytes'}."""
+    from portal.models import ContentBlob
+    totals = ContentBlob.objects.aggregate(
+        blobs=Count('pk'), references=Sum('ref_count'), stored_bytes=Sum('size'),
+    )
+    shared = ContentBlob.objects.filter(ref_count__gt=1).aggregate(
+        shared=Count('pk'), reclaimed_bytes=Sum(F('size') * (F('ref_count') - 1)),
+    )
+    return {
+        'blobs': totals['blobs'],
+        'shared': shared['shared'],
+        'references': totals['references'] or 0,
+        'stored_bytes': totals['stored_bytes'] or 0,
+        'reclaimed_bytes': shared['reclaimed_bytes'] or 0,
+    }
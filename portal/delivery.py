@@ -0,0 +1,349 @@
+"""
+Media delivery backends for the /media/ route.
+
+Selected with the CDN_MEDIA_DELIVERY environment variable:
+
+  sendfile    (default) Django FileResponse. Under gunicorn this goes through
+              wsgi.file_wrapper, which hands the file to os.sendfile() so the
+              bytes never pass through Python.
+  x-accel     Offload to a fronting nginx via X-Accel-Redirect. nginx needs an
+              internal location matching CDN_MEDIA_ACCEL_PREFIX that maps to /:
+
+                  location /_media_internal/ {
+                      internal;
+                      alias /;
+                  }
+
+  x-sendfile  Offload to Apache mod_xsendfile / lighttpd via X-Sendfile.
+
+The offload modes free the gunicorn worker as soon as the headers are sent,
+which is what keeps long video streams from starving the portal.
+
+The sendfile backend also answers byte-range requests (RFC 7233) so video
+seeking and resumed downloads don't restart from byte 0: single ranges,
+multipart/byteranges and If-Range. nginx and Apache handle ranges themselves.
+
+Conditional requests (If-None-Match, If-Modified-Since) are answered here for
+every backend, before the file is opened. A revalidation of a correctly signed
+?v= URL is answered 304 first thing, without a query or a stat. Otherwise a
+versioned URL is immutable once the path resolves and the version is that of
+the stored file; any other ?v= gets the file's own validators — see
+portal/conditional.py.
+
+Resized card images (variants/...) are created on their first request — see
+portal/thumbs.py. HLS segments (.hls/...) are plain files here; portal/hls.py
+writes them. Hidden paths (.uploads/ parts, HLS packaging state) are 404.
+"""
+import mimetypes
+import os
+import posixpath
+import uuid
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.static import was_modified_since
+
+from portal import conditional, hls, telemetry, thumbs
+
+# Bytes read per iteration when streaming a range from disk
+CHUNK_SIZE = 256 * 1024
+
+# More (coalesced) ranges than this and we just send the whole file
+MAX_RANGES = 16
+
+# Python's table maps .ts to Qt Linguist files; here they are HLS segments
+mimetypes.add_type('video/mp2t', '.ts')
+
+
+def resolve_media_path(path):
+    """
+    Return the absolute filesystem path for a media URL path.
+    Looks in the configured media root first, then falls back to
+    settings.MEDIA_ROOT so files uploaded before a storage path change
+    (e.g. before an external drive was configured) are still served.
+    """
+    from portal.storage import _get_media_root
+    primary = _get_media_root()
+    roots = [primary]
+    fallback = str(settings.MEDIA_ROOT)
+    if fallback != primary:
+        roots.append(fallback)
+
+    for root in roots:
+        try:
+            fullpath = safe_join(root, path)
+        except SuspiciousFileOperation:
+            raise Http404('Invalid media path')
+        if os.path.isfile(fullpath):
+            return fullpath
+    raise Http404(f'"{path}" does not exist in {primary}')
+
+
+def _content_type(fullpath):
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    return content_type or 'application/octet-stream', encoding
+
+
+def _etag(stat):
+    return '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+
+
+# ── Byte ranges ───────────────────────────────────────────────────────────────
+
+def parse_range_header(header, size):
+    """
+    Parse a Range header against a file of `size` bytes.
+    Returns a sorted list of inclusive (start, end) pairs with overlapping and
+    adjacent ranges merged, [] if no range is satisfiable (→ 416), or None if
+    the header is absent, malformed or not in bytes (→ ignore, send 200).
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, sep, last = part.partition('-')
+        first, last = first.strip(), last.strip()
+        if not sep or not (first or last):
+            return None
+        if (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first:
+            # Suffix range: the final N bytes
+            length = int(last)
+            if length == 0 or size == 0:
+                continue
+            ranges.append((max(size - length, 0), size - 1))
+            continue
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            continue
+        end = min(int(last), size - 1) if last else size - 1
+        ranges.append((start, end))
+
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _if_range_matches(request, stat, etag):
+    """True when there is no If-Range header or it still matches the file."""
+    validator = request.META.get('HTTP_IF_RANGE')
+    if not validator:
+        return True
+    validator = validator.strip()
+    if validator.startswith('W/'):
+        return False  # Weak validators never match for ranges
+    if validator.startswith('"'):
+        return validator == etag
+    since = parse_http_date_safe(validator)
+    return since is not None and since == int(stat.st_mtime)
+
+
+class _FileRange:
+    """
+    File-like view of one byte range (or the whole file) that counts how much
+    of it was sent, for telemetry. Exposes fileno() with the file positioned
+    at the range start, so gunicorn's wsgi.file_wrapper can still use
+    os.sendfile() (it stops after Content-Length bytes); other servers fall
+    back to the bounded read().
+    """
+
+    def __init__(self, f, start, length):
+        self._f = f
+        self._f.seek(start)
+        self._start = start
+        self._end = start + length
+        self._pos = start
+        # Bytes read by the server, or reported by socket.sendfile() via seek()
+        self.sent = 0
+
+    def read(self, size=-1):
+        remaining = self._end - self._pos
+        if remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        data = self._f.read(size)
+        self.seek(self._pos + len(data))
+        return data
+
+    def seek(self, offset):
+        # socket.sendfile() leaves the file positioned after the bytes it sent
+        if offset != self._pos:
+            self._f.seek(offset)
+        self._pos = offset
+        self.sent = max(self.sent, min(offset, self._end) - self._start)
+
+    def seekable(self):
+        # seek() is only for socket.sendfile(); FileResponse must not measure the file with it
+        return False
+
+    def fileno(self):
+        return self._f.fileno()
+
+    def close(self):
+        self._f.close()
+
+
+def _iter_ranges(fullpath, ranges, boundary, content_type, size):
+    """Yield a multipart/byteranges body, reading each range in CHUNK_SIZE pieces."""
+    with open(fullpath, 'rb') as f:
+        for start, end in ranges:
+            yield _part_header(boundary, content_type, start, end, size)
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                data = f.read(min(CHUNK_SIZE, remaining))
+                if not data:
+                    return
+                remaining -= len(data)
+                yield data
+            yield b'\r\n'
+        yield f'--{boundary}--\r\n'.encode('ascii')
+
+
+def _part_header(boundary, content_type, start, end, size):
+    return (
+        f'--{boundary}\r\n'
+        f'Content-Type: {content_type}\r\n'
+        f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+    ).encode('ascii')
+
+
+def _multipart_length(ranges, boundary, content_type, size):
+    total = len(f'--{boundary}--\r\n')
+    for start, end in ranges:
+        total += len(_part_header(boundary, content_type, start, end, size))
+        total += end - start + 1 + 2
+    return total
+
+
+def _serve_sendfile(request, fullpath, stat, etag):
+    content_type, encoding = _content_type(fullpath)
+    size = stat.st_size
+
+    ranges = None
+    if request.method in ('GET', 'HEAD') and _if_range_matches(request, stat, etag):
+        ranges = parse_range_header(request.META.get('HTTP_RANGE'), size)
+        if ranges is not None and len(ranges) > MAX_RANGES:
+            ranges = None
+
+    if ranges == []:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    elif ranges and len(ranges) == 1:
+        start, end = ranges[0]
+        length = end - start + 1
+        response = FileResponse(
+            _FileRange(open(fullpath, 'rb'), start, length),
+            content_type=content_type, status=206,
+        )
+        response['Content-Length'] = length
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    elif ranges:
+        boundary = uuid.uuid4().hex
+        response = StreamingHttpResponse(
+            _iter_ranges(fullpath, ranges, boundary, content_type, size),
+            content_type=f'multipart/byteranges; boundary={boundary}', status=206,
+        )
+        response['Content-Length'] = _multipart_length(ranges, boundary, content_type, size)
+    else:
+        response = FileResponse(_FileRange(open(fullpath, 'rb'), 0, size), content_type=content_type)
+        response['Content-Length'] = size
+        if encoding:
+            response['Content-Encoding'] = encoding
+
+    response['Accept-Ranges'] = 'bytes'
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['ETag'] = etag
+    return response
+
+
+def _serve_x_accel(request, fullpath, stat, etag):
+    content_type, _ = _content_type(fullpath)
+    response = HttpResponse(content_type=content_type)
+    prefix = settings.CDN_MEDIA_ACCEL_PREFIX.rstrip('/')
+    response['X-Accel-Redirect'] = prefix + quote(os.path.abspath(fullpath))
+    return response
+
+
+def _serve_x_sendfile(request, fullpath, stat, etag):
+    content_type, _ = _content_type(fullpath)
+    response = HttpResponse(content_type=content_type)
+    response['X-Sendfile'] = os.path.abspath(fullpath)
+    return response
+
+
+BACKENDS = {
+    'sendfile': _serve_sendfile,
+    'x-accel': _serve_x_accel,
+    'x-sendfile': _serve_x_sendfile,
+}
+
+
+def _is_public(path):
+    """
+    Hidden files (resumable upload parts under .uploads/, HLS packaging
+    state) aren't served; under .hls/ only stream segments are.
+    """
+    parts = posixpath.normpath(path).split('/')
+    if parts[0] == hls.CACHE_DIR:
+        return hls.is_public('/'.join(parts[1:]))
+    return not any(part.startswith('.') for part in parts)
+
+
+def serve_media(request, path):
+    """Resolve a media path and hand it to the configured delivery backend."""
+    if not _is_public(path):
+        raise Http404('Not a public media file')
+    version = conditional.requested_version(request)
+    if version and conditional.is_signed(path, version):
+        etag = f'"{version}"'
+        if conditional.etag_matches(request, etag):
+            return conditional.not_modified(etag, conditional.IMMUTABLE)
+    try:
+        fullpath = resolve_media_path(path)
+    except Http404:
+        if not path.startswith(thumbs.VARIANT_DIR):
+            raise
+        # First request for this size of a card image: make it now, serve it from disk after
+        fullpath = thumbs.generate(path)
+    stat = os.stat(fullpath)
+    # Only a version that names the stored content is immutable; a made-up or
+    # outdated ?v= falls through to the file's own validators
+    if version and conditional.version_is_current(path, version):
+        etag = f'"{version}"'
+        cache_control = conditional.IMMUTABLE
+        if conditional.etag_matches(request, etag):
+            return conditional.not_modified(etag, cache_control)
+    else:
+        etag = _etag(stat)
+        cache_control = f'public, max-age={settings.CDN_MEDIA_MAX_AGE}'
+        if conditional.etag_matches(request, etag):
+            return conditional.not_modified(etag, cache_control)
+        if 'HTTP_IF_NONE_MATCH' not in request.META and \
+                not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime):
+            return conditional.not_modified(etag, cache_control)
+
+    backend = BACKENDS.get(settings.CDN_MEDIA_DELIVERY, _serve_sendfile)
+    response = backend(request, fullpath, stat, etag)
+    response['Cache-Control'] = cache_control
+    return telemetry.track_media(response)
@@ -0,0 +1,170 @@
+"""
+Disk usage sampler — shutil.disk_usage results for every path anyone has asked
+about, kept fresh by one background thread per process.
+
+/api/stats/ (fetched on every page), the heartbeat, the drive picker in the
+admin and storage auto-detection all read from here instead of stat'ing the
+drive themselves:
+
+    usage = diskusage.usage(path)   # DiskUsage(total, used, free, sampled_at, stale) or None
+
+The first read of a new path waits up to CDN_DISK_PROBE_TIMEOUT seconds for a
+sample; after that reads never block. Paths are re-sampled every
+CDN_DISK_USAGE_TTL seconds while they are being read and forgotten once
+nobody has asked for them in a while.
+
+statvfs() on a hung NFS mount or a dying USB drive can block forever. A single
+watchdog thread notices when a probe overruns the timeout, marks the path as
+hung (its last sample is returned with stale=True) and starts a fresh probe
+thread so other paths keep updating. The stuck thread is abandoned; the path
+is not probed again until it has returned.
+"""
+import shutil
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+
+DiskUsage = namedtuple('DiskUsage', 'total used free sampled_at stale')
+
+# Paths nobody has read for this long stop being sampled
+FORGET_AFTER = 600
+
+# Wait this long before probing a path again after it hung or errored
+RETRY_AFTER = 60
+
+
+class _Sampler:
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._samples = {}     # path -> (shutil usage, wall time, monotonic time)
+        self._last_read = {}   # path -> monotonic time of the last usage() call
+        self._failed = {}      # path -> monotonic time of the last failed/hung probe
+        self._stuck = {}       # path -> abandoned probe thread still blocked on it
+        self._probing = None   # (path, monotonic start) for the current probe
+        self._probe_thread = None
+        self._watchdog = None
+
+    # ── Reading ──────────────────────────────────────────────────────────────
+
+    def usage(self, path, wait=True):
+        path = str(path)
+        ttl = settings.CDN_DISK_USAGE_TTL
+        timeout = settings.CDN_DISK_PROBE_TIMEOUT
+        with self._cond:
+            self._ensure_threads()
+            now = time.monotonic()
+            new = path not in self._last_read
+            self._last_read[path] = now
+            if new:
+                self._cond.notify_all()
+            if wait and path not in self._samples and not self._is_failing(path, now):
+                self._cond.wait_for(
+                    lambda: path in self._samples or self._is_failing(path, time.monotonic()),
+                    timeout=timeout,
+                )
+            sample = self._samples.get(path)
+            if sample is None:
+                return None
+            disk, sampled_at, sampled_mono = sample
+            age = time.monotonic() - sampled_mono
+            stale = age > 2 * ttl or path in self._failed
+            return DiskUsage(disk.total, disk.used, disk.free, sampled_at, stale)
+
+    def _is_failing(self, path, now):
+        failed = self._failed.get(path)
+        return failed is not None and now - failed < RETRY_AFTER
+
+    # ── Sampling ─────────────────────────────────────────────────────────────
+
+    def _ensure_threads(self):
+        # Called with the lock held
+        if self._probe_thread is None or not self._probe_thread.is_alive():
+            self._start_probe_thread()
+        if self._watchdog is None or not self._watchdog.is_alive():
+            self._watchdog = threading.Thread(target=self._watchdog_loop, daemon=True, name='disk-watchdog')
+            self._watchdog.start()
+
+    def _start_probe_thread(self):
+        self._probing = None
+        self._probe_thread = threading.Thread(target=self._probe_loop, daemon=True, name='disk-sampler')
+        self._probe_thread.start()
+
+    def _next_due(self, now):
+        """Pick the path most overdue for a sample, or None. Called with the lock held."""
+        ttl = settings.CDN_DISK_USAGE_TTL
+        best, best_age = None, -1
+        for path, last_read in list(self._last_read.items()):
+            if now - last_read > FORGET_AFTER:
+                del self._last_read[path]
+                self._samples.pop(path, None)
+                self._failed.pop(path, None)
+                continue
+            if self._is_failing(path, now):
+                continue
+            stuck = self._stuck.get(path)
+            if stuck is not None:
+                if stuck.is_alive():
+                    continue
+                del self._stuck[path]
+            sample = self._samples.get(path)
+            age = float('inf') if sample is None else now - sample[2]
+            if age >= ttl and age > best_age:
+                best, best_age = path, age
+        return best
+
+    def _probe_loop(self):
+        me = threading.current_thread()
+        while True:
+            with self._cond:
+                if self._probe_thread is not me:
+                    return
+                path = self._next_due(time.monotonic())
+                if path is None:
+                    self._cond.wait(timeout=1)
+                    continue
+                self._probing = (path, time.monotonic())
+
+            try:
+                disk = shutil.disk_usage(path)
+            except OSError:
+                disk = None
+
+            with self._cond:
+                if self._probe_thread is not me:
+                    return  # Declared hung by the watchdog and replaced
+                self._probing = None
+                if disk is None:
+                    self._failed[path] = time.monotonic()
+                else:
+                    self._failed.pop(path, None)
+                    self._samples[path] = (disk, time.time(), time.monotonic())
+                self._cond.notify_all()
+
+    def _watchdog_loop(self):
+        timeout = settings.CDN_DISK_PROBE_TIMEOUT
+        while True:
+            time.sleep(timeout / 2)
+            with self._cond:
+                probing = self._probing
+                if probing is None or time.monotonic() - probing[1] < timeout:
+                    continue
+                path = probing[0]
+                self._failed[path] = time.monotonic()
+                self._stuck[path] = self._probe_thread
+                self._start_probe_thread()
+                self._cond.notify_all()
+
+
+_sampler = _Sampler()
+
+
+def usage(path, wait=True):
+    """
+    Return DiskUsage for `path`, or None if it has never been sampled
+    successfully (missing, not mounted, or hung on the first probe).
+    wait=False returns immediately even for a path not yet sampled.
+    """
+    return _sampler.usage(path, wait=wait)
@@ -1,25 +1,89 @@
 """
 Heartbeat service — runs in a background thread, sends status to CN Platform.
-Started from apps.py when Django is ready.
+Started from cdnnode/wsgi.py (portal.apps.start_services()), so it runs
+only in processes that serve requests.
+
+The thread runs in every gunicorn worker, but only one of them per
+node sends: the thread that holds an exclusive flock() on
+CDN_STATE_DIR/heartbeat.lock is the leader and the others retry the lock
+every LEADER_RETRY seconds. The kernel drops the lock when the leader's
+process exits, so another worker takes over within LEADER_RETRY seconds.
+
+Each cycle samples the system without blocking (CPU and network figures are
+deltas since the previous cycle) and queues the payload. Queued payloads are
+sent oldest first over a keep-alive Session; while the platform is
+unreachable, sends back off exponentially (up to CDN_HEARTBEAT_MAX_BACKOFF)
+and the queue keeps the newest CDN_HEARTBEAT_QUEUE_SIZE payloads.
 """
+import os
 import threading
 import time
 import logging
 import requests
 import platform
+from collections import deque
 from django.conf import settings
+from django.utils import timezone
+
+try:
+    import fcntl
+except ImportError:  # Not on Linux — every process sends
+    fcntl = None
 
 logger = logging.getLogger(__name__)
 
 _thread = None
 _stop_event = threading.Event()
 
+# Seconds between attempts to take over as leader
+LEADER_RETRY = 15
+
+
+# ── Leader election ───────────────────────────────────────────────────────────
+
+_lock_file = None
+
+
+def _acquire_leadership():
+    """Return True if this process holds (or just took) the node-wide heartbeat lock."""
+    global _lock_file
+    if _lock_file is not None or fcntl is None:
+        return True
+    path = os.path.join(str(settings.CDN_STATE_DIR), 'heartbeat.lock')
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        f = open(path, 'a+')
+    except OSError as e:
+        logger.error('Heartbeat: cannot open lock file %s: %s', path, e)
+        return False
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    f.seek(0)
+    f.truncate()
+    f.write(f'{os.getpid()}\n')
+    f.flush()
+    _lock_file = f
+    logger.info('Heartbeat: this worker (pid %s) is the sender', os.getpid())
+    return True
+
+
+def _release_leadership():
+    global _lock_file
+    if _lock_file is not None:
+        _lock_file.close()  # Closing the file drops the flock
+        _lock_file = None
+
+
+# ── Sampling ──────────────────────────────────────────────────────────────────
 
 def _get_storage_info():
     try:
-        import shutil
+        from portal import diskusage
         from portal.storage import _get_media_root
-        disk = shutil.disk_usage(_get_media_root())
+        disk = diskusage.usage(_get_media_root())
         return {
             'total': disk.total,
             'used': disk.used,
@@ -29,69 +93,150 @@ def _get_storage_info():
         return {'total': 0, 'used': 0, 'available': 0}
 
 
-def _get_system_info():
-    info = {
-        'platform': platform.system(),
-        'python': platform.python_version(),
+class _SystemSampler:
+    """System figures without blocking — rates are measured between calls."""
+
+    def __init__(self):
+        try:
+            import psutil
+        except ImportError:
+            psutil = None
+        self.psutil = psutil
+        self._net = None
+        if psutil:
+            psutil.cpu_percent(interval=None)  # Prime: the next call reports usage since now
+            self._net = (time.monotonic(), psutil.net_io_counters())
+
+    def sample(self):
+        info = {
+            'platform': platform.system(),
+            'python': platform.python_version(),
+        }
+        psutil = self.psutil
+        if psutil:
+            info['cpu_percent'] = psutil.cpu_percent(interval=None)
+            info['memory_percent'] = psutil.virtual_memory().percent
+            now, net = time.monotonic(), psutil.net_io_counters()
+            if self._net and net:
+                then, prev = self._net
+                elapsed = max(now - then, 1e-6)
+                info['net_sent_bps'] = int((net.bytes_sent - prev.bytes_sent) / elapsed)
+                info['net_recv_bps'] = int((net.bytes_recv - prev.bytes_recv) / elapsed)
+            self._net = (now, net)
+        # Raspberry Pi CPU temperature
+        try:
+            with open('/sys/class/thermal/thermal_zone0/temp') as f:
+                info['temperature'] = int(f.read().strip()) / 1000
+        except Exception:
+            pass
+        return info
+
+
+def _build_payload(system):
+    # Lazy import to avoid Django startup issues
+    from django.db.models import Sum
+    from portal import telemetry
+    from portal.models import Category
+
+    # Stored per-category totals — no COUNT over the items table
+    total_items = Category.objects.aggregate(n=Sum('active_item_count'))['n'] or 0
+    return {
+        'identifier': settings.CDN_NODE_IDENTIFIER,
+        'name': settings.CDN_NODE_NAME,
+        'status': 'online',
+        'timestamp': timezone.now().isoformat(),
+        'storage': _get_storage_info(),
+        'content': {'totalItems': total_items},
+        'deviceInfo': system.sample(),
+        'telemetry': telemetry.summary(views=False),
     }
-    try:
-        import psutil
-        info['cpu_percent'] = psutil.cpu_percent(interval=1)
-        info['memory_percent'] = psutil.virtual_memory().percent
-    except ImportError:
-        pass
-    # Raspberry Pi CPU temperature
-    try:
-        with open('/sys/class/thermal/thermal_zone0/temp') as f:
-            info['temperature'] = int(f.read().strip()) / 1000
-    except Exception:
-        pass
-    return info
 
 
-def _send_heartbeat():
-    platform_url = settings.CDN_PLATFORM_URL
-    api_key = settings.CDN_API_KEY
-    if not platform_url or not api_key:
+# ── Sending ───────────────────────────────────────────────────────────────────
+
+class _Sender:
+    """Queue of unsent payloads, delivered oldest first with exponential backoff."""
+
+    def __init__(self):
+        self.session = requests.Session()
+        self.queue = deque(maxlen=settings.CDN_HEARTBEAT_QUEUE_SIZE)
+        self.failures = 0
+        self.next_attempt = 0.0
+
+    def push(self, payload):
+        if len(self.queue) == self.queue.maxlen:
+            logger.warning('Heartbeat: offline queue full, dropping oldest payload')
+        self.queue.append(payload)
+
+    def flush(self):
+        """Send queued payloads until one fails or the backoff window hasn't passed."""
+        if time.monotonic() < self.next_attempt:
+            return
+        platform_url = settings.CDN_PLATFORM_URL
+        url = f"{platform_url.rstrip('/')}/api/cdn/node/heartbeat"
+        while self.queue:
+            try:
+                response = self.session.post(
+                    url,
+                    json=self.queue[0],
+                    headers={'X-CDN-API-Key': settings.CDN_API_KEY},
+                    timeout=10,
+                )
+            except requests.exceptions.ConnectionError:
+                self._failed('cannot reach platform at %s' % platform_url)
+                return
+            except requests.exceptions.RequestException as e:
+                self._failed(e)
+                return
+            if response.status_code >= 500:
+                self._failed('platform returned %s' % response.status_code)
+                return
+            self.queue.popleft()
+            if response.status_code >= 400:
+                # Rejected (bad key, bad payload) — retrying the same payload won't help
+                logger.error('Heartbeat rejected: %s %s', response.status_code, response.text[:200])
+            else:
+                logger.info('Heartbeat sent: %s', response.status_code)
+            if self.failures:
+                logger.warning('Heartbeat: platform reachable again after %s failed attempt(s)', self.failures)
+            self.failures = 0
+            self.next_attempt = 0.0
+
+    def _failed(self, reason):
+        self.failures += 1
+        delay = min(settings.CDN_HEARTBEAT_INTERVAL * 2 ** (self.failures - 1),
+                    settings.CDN_HEARTBEAT_MAX_BACKOFF)
+        self.next_attempt = time.monotonic() + delay
+        logger.error('Heartbeat: %s — %s payload(s) queued, retrying in %ss', reason, len(self.queue), delay)
+
+
+def _send_heartbeat(sender, system):
+    if not settings.CDN_PLATFORM_URL or not settings.CDN_API_KEY:
         return  # Not configured — silently skip
-
-    # Lazy import to avoid Django startup issues
-    from portal.models import ContentItem, Category
-    from django.db import connection
-
+    from django.db import close_old_connections
+    close_old_connections()
     try:
-        total_items = ContentItem.objects.filter(is_active=True).count()
-        storage = _get_storage_info()
-        system = _get_system_info()
-
-        payload = {
-            'identifier': settings.CDN_NODE_IDENTIFIER,
-            'name': settings.CDN_NODE_NAME,
-            'status': 'online',
-            'storage': storage,
-            'content': {'totalItems': total_items},
-            'deviceInfo': system,
-        }
-
-        response = requests.post(
-            f"{platform_url.rstrip('/')}/api/cdn/node/heartbeat",
-            json=payload,
-            headers={'X-CDN-API-Key': api_key},
-            timeout=10,
-        )
-        logger.info('Heartbeat sent: %s', response.status_code)
-    except requests.exceptions.ConnectionError:
-        logger.error('Heartbeat: cannot reach platform at %s', platform_url)
+        sender.push(_build_payload(system))
     except Exception as e:
         logger.error('Heartbeat error: %s', e)
+    sender.flush()
 
 
 def _heartbeat_loop():
     interval = settings.CDN_HEARTBEAT_INTERVAL
     logger.info('Heartbeat service started (interval: %ss)', interval)
-    while not _stop_event.is_set():
-        _send_heartbeat()
-        _stop_event.wait(interval)
+    sender = system = None
+    try:
+        while not _stop_event.is_set():
+            if not _acquire_leadership():
+                _stop_event.wait(min(interval, LEADER_RETRY))
+                continue
+            if sender is None:
+                sender, system = _Sender(), _SystemSampler()
+            _send_heartbeat(sender, system)
+            _stop_event.wait(interval)
+    finally:
+        _release_leadership()
     logger.info('Heartbeat service stopped')
 
 
@@ -0,0 +1,320 @@
+"""
+HLS streams for video items, packaged on first request.
+
+Progressive MP4 stalls on weak links. An encoder that writes the index
+(moov) at the end makes the browser fetch it before the first frame, and
+for a film it is several MB. MKV and AVI don't play in browsers at all.
+/item/<pk>/hls/ serves an HLS playlist instead:
+
+  * The first request claims the stream and starts a background thread
+    that probes the file, makes room in the cache and runs ffmpeg; the
+    request itself only waits briefly for the first segment. A file that
+    can't be probed gets the failure marker like a failed ffmpeg run, so it
+    isn't probed again on every request. ffmpeg copies H.264
+    video and AAC/MP3 audio into 2-second MPEG-TS segments, without
+    re-encoding. Other codecs are encoded with CDN_HLS_VIDEO_ENCODER, or
+    AAC for audio. The playlist is an EVENT playlist, so the player
+    starts as soon as the first segment is written and the playlist grows
+    until ffmpeg finishes.
+  * Segments live on the media drive under .hls/<pk>-<version>/ and are
+    served by the /media/ route like any file (sendfile, or nginx with
+    x-accel). The version is the content hash, so a replaced file gets a
+    new stream. Only the segments are public: the packaging lock, failure
+    marker and ffmpeg.log next to them are not (is_public()).
+  * The cache is capped at CDN_HLS_CACHE_MAX_BYTES. Streams whose playlist
+    was requested least recently are deleted first, when a new stream
+    starts and hourly on the worker ('prune_hls'). At most
+    CDN_HLS_MAX_PACKAGERS ffmpeg processes run at once.
+
+The player uses HLS where the browser plays it natively and falls back to
+the file itself on any error (static/js/portal.js).
+"""
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+from django.conf import settings
+
+from portal import video
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = '.hls'
+PLAYLIST = 'index.m3u8'
+# Short, so the player needs little before the first frame. Copied streams
+# are cut at the first keyframe after this, so theirs follow the source's GOP
+SEGMENT_SECONDS = 2
+
+# Codecs browsers play from MPEG-TS without re-encoding
+COPY_VIDEO = {'h264'}
+COPY_AUDIO = {'aac', 'mp3'}
+
+# How long a playlist request waits for the first segment before answering
+# 503 (Retry-After). Short: the wait holds a sync gunicorn worker. A remux
+# writes its first segment in about 0.2 s; a re-encode takes longer and the
+# player asks again
+WAIT_SECONDS = 1
+# A stream whose ffmpeg failed isn't retried for this long
+RETRY_FAILED_AFTER = 3600
+
+_LOCK = '.packaging'
+_FAILED = '.failed'
+_LAST_USED = '.last_used'
+
+
+class NotReady(Exception):
+    """The stream is being packaged (or too many are) — retry shortly."""
+
+
+class Unavailable(Exception):
+    """This item can't be streamed as HLS."""
+
+
+def is_public(name):
+    """True if `name`, relative to the stream cache, is a segment the player may fetch."""
+    parts = name.split('/')
+    return len(parts) == 2 and parts[1].endswith('.ts') and not parts[1].startswith('.')
+
+
+def cache_root():
+    from portal.storage import _get_media_root
+    return os.path.join(_get_media_root(), CACHE_DIR)
+
+
+def stream_key(item):
+    version = item.content_hash[:16] if item.content_hash else hashlib.blake2b(
+        f'{item.file.name}:{item.file_size}'.encode(), digest_size=8).hexdigest()
+    return f'{item.pk}-{version}'
+
+
+def _running(path):
+    """True if a live process holds the packaging lock of the stream in `path`."""
+    try:
+        with open(os.path.join(path, _LOCK)) as f:
+            pid = int(f.read().strip())
+        os.kill(pid, 0)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def _claim(path):
+    """
+    Take the packaging lock for `path`; False if another process holds it.
+    The lock holds our pid until ffmpeg's replaces it, so a process that dies
+    in between leaves a lock the next request can see is stale.
+    """
+    lock = os.path.join(path, _LOCK)
+    tmp = f'{lock}.{os.getpid()}.{threading.get_ident()}'
+    with open(tmp, 'w') as f:
+        f.write(str(os.getpid()))
+    try:
+        for _ in range(2):
+            try:
+                os.link(tmp, lock)  # Atomic, and fails if the lock exists
+                return True
+            except FileExistsError:
+                if _running(path):
+                    return False
+                try:
+                    os.unlink(lock)
+                except FileNotFoundError:
+                    pass
+        return False
+    finally:
+        os.unlink(tmp)
+
+
+def _read_playlist(path):
+    try:
+        with open(os.path.join(path, PLAYLIST)) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+# ── Playlist ──────────────────────────────────────────────────────────────────
+
+def playlist(item):
+    """
+    The item's HLS playlist text, starting packaging in the background if
+    the stream isn't cached. Raises NotReady or Unavailable.
+    """
+    if not settings.CDN_HLS_ENABLED or item.file_type != 'video' or not item.file or not video.available():
+        raise Unavailable('HLS is not available for this item')
+    path = os.path.join(cache_root(), stream_key(item))
+    os.makedirs(path, exist_ok=True)
+    # Least recently used streams are evicted first
+    with open(os.path.join(path, _LAST_USED), 'a'):
+        os.utime(os.path.join(path, _LAST_USED))
+
+    text = _read_playlist(path)
+    if text and '#EXT-X-ENDLIST' in text:
+        return text
+    if not _running(path):
+        try:
+            failed_at = os.stat(os.path.join(path, _FAILED)).st_mtime
+        except FileNotFoundError:
+            failed_at = None
+        if failed_at is not None and time.time() - failed_at < RETRY_FAILED_AFTER:
+            raise Unavailable('Packaging failed recently')
+        if _claim(path):
+            # Our own lock counts as one
+            if sum(_running(entry.path) for entry in _streams()) > settings.CDN_HLS_MAX_PACKAGERS:
+                os.unlink(os.path.join(path, _LOCK))
+                raise NotReady('Too many streams being packaged')
+            # A failure old enough to retry; the wait below mustn't mistake it for this run's
+            try:
+                os.unlink(os.path.join(path, _FAILED))
+            except FileNotFoundError:
+                pass
+            threading.Thread(target=_package, args=(item.pk, item.file.path, item.file_size, path),
+                             daemon=True, name=f'hls-{item.pk}').start()
+
+    deadline = time.monotonic() + WAIT_SECONDS
+    while True:
+        text = _read_playlist(path)
+        if text and '#EXTINF' in text:
+            return text
+        if os.path.exists(os.path.join(path, _FAILED)):
+            raise Unavailable('Packaging failed')
+        if time.monotonic() > deadline:
+            raise NotReady('First segment not ready yet')
+        time.sleep(0.1)
+
+
+def _package(pk, source, size, path):
+    """
+    Runs in a background thread holding the packaging lock: probe the file,
+    make room in the cache, then run ffmpeg to the end and record how it ended.
+    """
+    try:
+        info = video.probe(source)
+        if info is None or info['video_codec'] is None:
+            logger.warning('HLS: item %s is not a readable video', pk)
+            _fail(path)
+            return
+        prune(reserve=size)
+        process = _start(pk, source, info, path)
+    except Exception:
+        logger.exception('HLS packaging for item %s could not start', pk)
+        _fail(path)
+        return
+    _wait(process, path)
+
+
+def _start(pk, source, info, path):
+    # Leftovers of an interrupted run would be mixed into the new playlist
+    for name in os.listdir(path):
+        if name != _LAST_USED and not name.startswith(_LOCK):
+            os.unlink(os.path.join(path, name))
+
+    base_url = f'{settings.MEDIA_URL}{CACHE_DIR}/{os.path.basename(path)}/'
+    if info['video_codec'] in COPY_VIDEO:
+        video_args = ['-c:v', 'copy']
+    else:
+        video_args = ['-c:v', settings.CDN_HLS_VIDEO_ENCODER, '-preset', 'veryfast',
+                      '-crf', '23', '-pix_fmt', 'yuv420p',
+                      '-force_key_frames', f'expr:gte(t,n_forced*{SEGMENT_SECONDS})']
+    audio_args = ['-c:a', 'copy'] if info['audio_codec'] in COPY_AUDIO else ['-c:a', 'aac', '-b:a', '128k', '-ac', '2']
+    cmd = [
+        settings.CDN_FFMPEG, '-hide_banner', '-loglevel', 'error', '-nostdin',
+        '-i', source, '-map', '0:v:0', '-map', '0:a:0?', '-sn', '-dn',
+        *video_args, *audio_args,
+        '-f', 'hls', '-hls_time', str(SEGMENT_SECONDS),
+        '-hls_playlist_type', 'event', '-hls_flags', 'independent_segments+temp_file',
+        '-hls_base_url', base_url,
+        '-hls_segment_filename', os.path.join(path, 'seg%05d.ts'),
+        os.path.join(path, PLAYLIST),
+    ]
+    if shutil.which('nice'):
+        cmd = ['nice', '-n', '10', *cmd]
+
+    stderr = open(os.path.join(path, 'ffmpeg.log'), 'wb')
+    try:
+        process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                   stderr=stderr, start_new_session=True)
+    finally:
+        stderr.close()
+    # Replaced atomically: _running() must never read a half-written pid
+    tmp = os.path.join(path, f'{_LOCK}.{process.pid}')
+    with open(tmp, 'w') as f:
+        f.write(str(process.pid))
+    os.replace(tmp, os.path.join(path, _LOCK))
+    logger.info('Packaging HLS for item %s (video %s, audio %s)', pk, video_args[1], audio_args[1])
+    return process
+
+
+def _wait(process, path):
+    """Reap the ffmpeg process and record how it ended."""
+    code = process.wait()
+    text = _read_playlist(path)
+    if code != 0 or not text or '#EXT-X-ENDLIST' not in text:
+        logger.warning('HLS packaging in %s exited with %s', path, code)
+        _fail(path)
+    else:
+        _unlock(path)
+
+
+def _fail(path):
+    """Mark the stream failed (not retried for RETRY_FAILED_AFTER) and release its lock."""
+    open(os.path.join(path, _FAILED), 'w').close()
+    _unlock(path)
+
+
+def _unlock(path):
+    try:
+        os.unlink(os.path.join(path, _LOCK))
+    except FileNotFoundError:
+        pass
+
+
+# ── Cache eviction ────────────────────────────────────────────────────────────
+
+def _streams():
+    try:
+        return [entry for entry in os.scandir(cache_root()) if entry.is_dir(follow_symlinks=False)]
+    except FileNotFoundError:
+        return []
+
+
+def _size(path):
+    total = 0
+    for entry in os.scandir(path):
+        if entry.is_file(follow_symlinks=False):
+            total += entry.stat(follow_symlinks=False).st_size
+    return total
+
+
+def _last_used(path):
+    try:
+        return os.stat(os.path.join(path, _LAST_USED)).st_mtime
+    except FileNotFoundError:
+        return os.stat(path).st_mtime
+
+
+def prune(reserve=0):
+    """
+    Delete least recently used streams until the cache plus `reserve` bytes
+    fits CDN_HLS_CACHE_MAX_BYTES. Streams being packaged are kept. Returns
+    the bytes freed.
+    """
+    streams = [(_last_used(entry.path), _size(entry.path), entry.path) for entry in _streams()]
+    total = sum(size for _, size, _ in streams)
+    limit = settings.CDN_HLS_CACHE_MAX_BYTES - reserve
+    freed = 0
+    for _, size, path in sorted(streams):
+        if total <= limit:
+            break
+        if _running(path):
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        freed += size
+    if freed:
+        logger.info('Evicted %d bytes of HLS streams', freed)
+    return freed
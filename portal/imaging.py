@@ -0,0 +1,78 @@
+"""
+Memory-bounded image decoding for thumbnails, card variants and theme colours.
+
+Pillow decodes an image at full resolution unless told otherwise. A
+100-megapixel panorama or scanned poster is ~300 MB of RGB, enough to get
+the worker OOM-killed on a 1 GB Pi. open_image() decodes in three steps:
+
+  1. Ask the decoder for a reduced image first. JPEG's DCT scaling
+     (draft()) decodes at 1/2, 1/4 or 1/8 straight from the compressed
+     stream, so the full-size image is never in memory.
+  2. Check what still has to be held against CDN_IMAGE_MAX_PIXELS. A
+     progressive JPEG counts at full size, because libjpeg buffers every
+     coefficient of the image before it can scale. Formats without reduced
+     decoding (PNG, TIFF, WebP, ...) count at full size too.
+  3. Decode, or raise ImageTooLarge so the caller skips the image instead
+     of the kernel killing the process.
+
+Callers should shrink the image (thumbnail()) before converting its mode,
+so any conversion copies the small image rather than the full-size one.
+"""
+import logging
+
+from django.conf import settings
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+def open_image(source, size):
+    """
+    Open and load `source` (a path or file object) at the smallest
+    resolution the decoder can produce that is still at least `size`
+    (width, height). Raises ImageTooLarge past the pixel budget.
+    """
+    img = Image.open(source)
+    try:
+        full_pixels = img.width * img.height
+        # JPEG only; a no-op for other formats
+        img.draft('RGB', size)
+        pixels = full_pixels if img.info.get('progressive') else img.width * img.height
+        if pixels > settings.CDN_IMAGE_MAX_PIXELS:
+            raise ImageTooLarge(
+                f'{img.format} image needs {pixels / 1e6:.0f} MP in memory '
+                f'(limit {settings.CDN_IMAGE_MAX_PIXELS / 1e6:.0f} MP)'
+            )
+        img.load()
+    except ImageTooLarge as e:
+        img.close()
+        logger.warning('Not decoding %s: %s', getattr(source, 'name', source), e)
+        raise
+    except BaseException:
+        img.close()
+        raise
+    return img
+
+
+def shrink(img, size):
+    """Fit `img` within `size` (never enlarging). Palette images are converted first so they resample smoothly."""
+    if img.mode in ('1', 'P'):
+        img = img.convert('RGBA' if 'transparency' in img.info else 'RGB')
+    img.thumbnail(size, Image.Resampling.LANCZOS)
+    return img
+
+
+def flatten(img, background=(255, 255, 255)):
+    """`img` as RGB, with any transparency composited onto `background`."""
+    if img.mode == 'RGB':
+        return img
+    if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info:
+        rgba = img.convert('RGBA')
+        out = Image.new('RGB', rgba.size, background)
+        out.paste(rgba, mask=rgba.split()[-1])
+        return out
+    return img.convert('RGB')
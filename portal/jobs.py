@@ -0,0 +1,240 @@
+"""
+Background job queue — jobs live in the portal_job table and are executed by
+`manage.py run_worker`, a separate process running a bounded number of
+threads so thumbnailing can't swamp the Pi or block gunicorn workers.
+
+Handlers are registered per job kind:
+
+    @handler('thumbnail')
+    def _thumbnail(job): ...
+
+A handler that raises is retried with exponential backoff until the job's
+max_attempts is reached, after which it is marked failed (visible in admin).
+Periodic jobs are registered with every(kind, seconds).
+"""
+import logging
+import os
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import F
+from django.utils import timezone
+
+from portal.models import Job
+
+try:
+    import fcntl
+except ImportError:  # Not on Linux — no lock, a worker always recovers
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+# kind -> interval in seconds for jobs the worker enqueues on its own
+SCHEDULE = {}
+
+# First retry after RETRY_BASE_DELAY seconds, then doubling
+RETRY_BASE_DELAY = 30
+
+# Finished jobs older than this are pruned when the worker starts
+KEEP_DONE_DAYS = 7
+
+# How often the scheduler thread checks SCHEDULE
+SCHEDULER_TICK = 30
+
+# How often a second worker retries the worker lock while it waits
+LOCK_RETRY = 5
+
+
+def handler(kind):
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def every(kind, seconds):
+    """Have the worker enqueue a `kind` job every `seconds` (and once at start-up)."""
+    SCHEDULE[kind] = seconds
+
+
+def claim_next():
+    """Atomically move the oldest runnable job to 'running' and return it, or None."""
+    while True:
+        now = timezone.now()
+        pk = Job.objects.filter(status=Job.PENDING, run_after__lte=now) \
+            .order_by('pk').values_list('pk', flat=True).first()
+        if pk is None:
+            return None
+        claimed = Job.objects.filter(pk=pk, status=Job.PENDING).update(
+            status=Job.RUNNING, started_at=now, attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return Job.objects.select_related('item').get(pk=pk)
+        # Another thread won the race — try the next one
+
+
+def run_job(job):
+    func = HANDLERS.get(job.kind)
+    try:
+        if func is None:
+            raise LookupError(f'No handler registered for job kind {job.kind!r}')
+        func(job)
+    except Exception:
+        error = traceback.format_exc(limit=5)
+        if job.attempts < job.max_attempts:
+            delay = RETRY_BASE_DELAY * 2 ** (job.attempts - 1)
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.PENDING, last_error=error,
+                run_after=timezone.now() + timedelta(seconds=delay),
+            )
+            logger.warning('Job %s failed (attempt %s), retrying in %ss', job, job.attempts, delay)
+        else:
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.FAILED, last_error=error, finished_at=timezone.now(),
+            )
+            logger.error('Job %s failed permanently:\n%s', job, error)
+        return False
+    Job.objects.filter(pk=job.pk).update(status=Job.DONE, finished_at=timezone.now())
+    return True
+
+
+def run_pending(limit=None):
+    """Run runnable jobs in the current thread until none are left. Returns the count."""
+    count = 0
+    while limit is None or count < limit:
+        job = claim_next()
+        if job is None:
+            break
+        run_job(job)
+        count += 1
+    return count
+
+
+def _worker_loop(stop_event, poll_interval):
+    try:
+        while not stop_event.is_set():
+            close_old_connections()
+            if not run_pending(limit=1):
+                stop_event.wait(poll_interval)
+    finally:
+        connection.close()
+
+
+def _scheduler_loop(stop_event):
+    last_run = {}
+    try:
+        while not stop_event.is_set():
+            close_old_connections()
+            now = time.monotonic()
+            for kind, seconds in SCHEDULE.items():
+                if kind in last_run and now - last_run[kind] < seconds:
+                    continue
+                last_run[kind] = now
+                busy = Job.objects.filter(kind=kind, status__in=[Job.PENDING, Job.RUNNING]).exists()
+                if not busy:
+                    Job.enqueue(kind)
+            stop_event.wait(SCHEDULER_TICK)
+    finally:
+        connection.close()
+
+
+_lock_file = None
+
+
+def acquire_worker_lock():
+    """
+    Take the node-wide worker lock (CDN_STATE_DIR/worker.lock) for the life of
+    this process. Returns False if another worker holds it. Only the holder
+    may recover(): while it holds the lock no other worker is running, so jobs
+    marked 'running' were left by one that died.
+    """
+    global _lock_file
+    if _lock_file is not None or fcntl is None:
+        return True
+    path = os.path.join(str(settings.CDN_STATE_DIR), 'worker.lock')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    f = open(path, 'a+')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    f.seek(0)
+    f.truncate()
+    f.write(f'{os.getpid()}\n')
+    f.flush()
+    _lock_file = f
+    return True
+
+
+def release_worker_lock():
+    global _lock_file
+    if _lock_file is not None:
+        _lock_file.close()  # Closing the file drops the flock
+        _lock_file = None
+
+
+def recover():
+    """
+    Requeue jobs left 'running' by a worker that died, and prune old finished
+    ones. Call only while holding the worker lock (acquire_worker_lock()).
+    """
+    requeued = Job.objects.filter(status=Job.RUNNING).update(status=Job.PENDING)
+    cutoff = timezone.now() - timedelta(days=KEEP_DONE_DAYS)
+    Job.objects.filter(status=Job.DONE, finished_at__lt=cutoff).delete()
+    return requeued
+
+
+def run_worker(concurrency=None, poll_interval=None, stop_event=None):
+    """
+    Block running jobs on `concurrency` threads until stop_event is set.
+    Waits for the worker lock first if another worker holds it.
+    """
+    from portal import tasks  # noqa: F401 — register handlers
+    concurrency = concurrency or settings.CDN_WORKER_CONCURRENCY
+    poll_interval = poll_interval or settings.CDN_WORKER_POLL_INTERVAL
+    stop_event = stop_event or threading.Event()
+
+    # One worker per node: a second one waits for the first to exit, so the
+    # thread count stays bounded and the dead worker's jobs are requeued
+    if not acquire_worker_lock():
+        logger.warning('Another worker is running; waiting for it to exit')
+        while not acquire_worker_lock():
+            if stop_event.wait(LOCK_RETRY):
+                return
+    try:
+        _run_threads(concurrency, poll_interval, stop_event)
+    finally:
+        release_worker_lock()
+
+
+def _run_threads(concurrency, poll_interval, stop_event):
+    requeued = recover()
+    if requeued:
+        logger.warning('Requeued %s interrupted job(s)', requeued)
+    logger.info('Worker started (%s thread(s))', concurrency)
+
+    threads = [
+        threading.Thread(target=_worker_loop, args=(stop_event, poll_interval),
+                         daemon=True, name=f'worker-{i}')
+        for i in range(concurrency)
+    ]
+    threads.append(threading.Thread(target=_scheduler_loop, args=(stop_event,),
+                                    daemon=True, name='worker-scheduler'))
+    for t in threads:
+        t.start()
+    try:
+        while any(t.is_alive() for t in threads):
+            for t in threads:
+                t.join(timeout=1)
+    except KeyboardInterrupt:
+        stop_event.set()
+        for t in threads:
+            t.join()
+    logger.info('Worker stopped')
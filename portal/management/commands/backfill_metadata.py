@@ -0,0 +1,42 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from portal import audiometa
+from portal.models import Category, ContentItem
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill in duration, year and artist/album/genre tags of existing audio items from '
+        'their ID3, MP4 and Vorbis tags. By default only tracks without a duration are read, '
+        'so re-running picks up where it stopped. Values typed in by hand are kept.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--category', help='Only items in the category with this slug')
+        parser.add_argument('--all', action='store_true',
+                            help='Also re-read tracks that already have a duration (adds new tags only)')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processes reading files')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        items = ContentItem.objects.filter(file_type='audio')
+        if options['category']:
+            try:
+                items = items.filter(category=Category.objects.get(slug=options['category']))
+            except Category.DoesNotExist:
+                raise CommandError(f"No category with slug {options['category']!r}")
+        if not options['all']:
+            items = items.filter(duration='')
+
+        def progress(done, total):
+            self.stdout.write(f'  {done}/{total} files read')
+
+        stats = audiometa.backfill(items, options['workers'], options['batch_size'], progress)
+        rate = stats['items'] / stats['seconds'] if stats['seconds'] else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Read {stats['items']} files in {stats['seconds']:.1f}s ({rate:.0f} files/s, "
+            f"{options['workers']} workers): {stats['updated']} updated, {stats['unreadable']} unreadable"
+        ))
@@ -0,0 +1,214 @@
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Delivery modes compared. 'static' is the /media/ view before portal/delivery.py
+# (django.views.static.serve); 'stream' pushes the file through Python in chunks,
+# as any server without wsgi.file_wrapper does. Both are installed into the
+# gunicorn workers by the config below.
+MODES = ('static', 'stream', 'sendfile', 'x-accel')
+
+GUNICORN_CONFIG = '''
+def post_worker_init(worker):
+    from portal.management.commands.bench_delivery import install_baselines
+    install_baselines()
+'''
+
+PROBE_INTERVAL = 0.05
+# Bytes a throttled client reads at a time
+READ_SIZE = 64 * 1024
+
+
+def install_baselines():
+    """Register the 'static' and 'stream' modes as delivery backends (gunicorn hook)."""
+    from django.http import StreamingHttpResponse
+    from django.views.static import serve
+
+    from portal import delivery
+
+    def _serve_static(request, fullpath, stat, etag):
+        return serve(request, os.path.basename(fullpath), document_root=os.path.dirname(fullpath))
+
+    def _serve_stream(request, fullpath, stat, etag):
+        def chunks():
+            with open(fullpath, 'rb') as f:
+                while data := f.read(delivery.CHUNK_SIZE):
+                    yield data
+        response = StreamingHttpResponse(chunks(), content_type='application/octet-stream')
+        response['Content-Length'] = stat.st_size
+        return response
+
+    delivery.BACKENDS['static'] = _serve_static
+    delivery.BACKENDS['stream'] = _serve_stream
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _get(port, path, rate=0, deadline=None):
+    """
+    GET `path`, reading and discarding the body; returns the bytes received.
+    With `rate` (bytes/s) the body is read no faster than a slow client would,
+    and the read stops at `deadline`.
+    """
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        received = 0
+        started = time.monotonic()
+        while data := response.read(READ_SIZE if rate else 1024 * 1024):
+            received += len(data)
+            if rate:
+                if deadline and time.monotonic() > deadline:
+                    return received
+                time.sleep(max(0.0, started + received / rate - time.monotonic()))
+        if response.status != 200:
+            raise OSError(f'{path}: HTTP {response.status}')
+        return received
+    finally:
+        conn.close()
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark /media/ delivery under gunicorn: concurrent downloads of a large file with '
+        'the old static view, Python streaming, sendfile and X-Accel-Redirect, while a probe '
+        'measures how long a small request waits for a free worker.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', default='1,10,50', help='Comma-separated concurrency levels')
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--size-mb', type=int, default=64)
+        parser.add_argument('--workers', type=int, default=2, help='gunicorn sync workers')
+        parser.add_argument('--modes', default=','.join(MODES))
+        parser.add_argument('--client-mbit', type=float, default=0,
+                            help='Throttle each download to this rate, like a phone on Wi-Fi (0 = as fast as possible)')
+
+    def handle(self, *args, **options):
+        clients = [int(c) for c in options['clients'].split(',')]
+        modes = options['modes'].split(',')
+        unknown = set(modes) - set(MODES)
+        if unknown:
+            raise CommandError(f"Unknown mode(s): {', '.join(sorted(unknown))}")
+
+        with tempfile.TemporaryDirectory(prefix='bench_delivery_') as tmp:
+            media = os.path.join(tmp, 'media')
+            os.makedirs(media)
+            with open(os.path.join(media, 'big.bin'), 'wb') as f:
+                for _ in range(options['size_mb']):
+                    f.write(os.urandom(1024 * 1024))
+            with open(os.path.join(media, 'probe.bin'), 'wb') as f:
+                f.write(os.urandom(4096))
+            config = os.path.join(tmp, 'gunicorn.conf.py')
+            with open(config, 'w') as f:
+                f.write(GUNICORN_CONFIG)
+
+            self.stdout.write(
+                f"{options['size_mb']} MB file, {options['workers']} gunicorn sync workers, "
+                f"{options['seconds']:g}s per run"
+                + (f", clients read at {options['client_mbit']:g} Mbit/s" if options['client_mbit'] else '')
+            )
+            header = f"{'mode':<9} {'clients':>7} {'req/s':>8} {'MB/s':>8} {'probe p50 ms':>12} {'probe p99 ms':>12} {'errors':>6}"
+            self.stdout.write(header)
+            self.stdout.write('-' * len(header))
+            for mode in modes:
+                port = _free_port()
+                server = self._start_server(mode, port, media, tmp, config, options['workers'])
+                try:
+                    for n in clients:
+                        requests, received, probes, errors, elapsed = self._run(port, n, options['seconds'], options['client_mbit'] * 1e6 / 8)
+                        mb_s = f"{received / elapsed / 1e6:>8.1f}" if mode != 'x-accel' else f"{'(nginx)':>8}"
+                        self.stdout.write(
+                            f"{mode:<9} {n:>7} {requests / elapsed:>8.1f} {mb_s} "
+                            f"{statistics.median(probes) * 1000 if probes else 0:>12.1f} "
+                            f"{_percentile(probes, 99) * 1000:>12.1f} {errors:>6}"
+                        )
+                finally:
+                    server.terminate()
+                    server.wait()
+
+    def _start_server(self, mode, port, media, tmp, config, workers):
+        env = {
+            **os.environ,
+            'MEDIA_ROOT': media,
+            'CDN_STATE_DIR': os.path.join(tmp, 'state'),
+            'CDN_MEDIA_DELIVERY': mode,
+            'CDN_PLATFORM_URL': '',  # No heartbeats from the bench server
+        }
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', 'cdnnode.wsgi:application', '-c', config,
+             '-w', str(workers), '-b', f'127.0.0.1:{port}', '--timeout', '120', '--log-level', 'warning'],
+            cwd=str(settings.BASE_DIR), env=env,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                _get(port, '/media/probe.bin')
+                return server
+            except OSError:
+                if server.poll() is not None:
+                    raise CommandError(f'gunicorn exited with {server.returncode}')
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError('gunicorn did not start')
+
+    def _run(self, port, clients, seconds, rate):
+        """Returns (completed downloads, bytes, probe latencies, errors, seconds until all finished)."""
+        started = time.monotonic()
+        deadline = started + seconds
+        lock = threading.Lock()
+        totals = {'requests': 0, 'bytes': 0, 'errors': 0}
+        probes = []
+
+        def download():
+            while time.monotonic() < deadline:
+                try:
+                    received = _get(port, '/media/big.bin', rate, deadline)
+                except OSError:
+                    with lock:
+                        totals['errors'] += 1
+                    continue
+                with lock:
+                    totals['requests'] += 1
+                    totals['bytes'] += received
+
+        def probe():
+            # A page-sized request: how long it queues behind the downloads
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                try:
+                    _get(port, '/media/probe.bin')
+                    probes.append(time.monotonic() - started)
+                except OSError:
+                    with lock:
+                        totals['errors'] += 1
+                time.sleep(PROBE_INTERVAL)
+
+        threads = [threading.Thread(target=download) for _ in range(clients)] + [threading.Thread(target=probe)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        # Unthrottled downloads in flight at the deadline run to completion and are counted
+        return totals['requests'], totals['bytes'], probes, totals['errors'], time.monotonic() - started
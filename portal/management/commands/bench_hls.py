@@ -0,0 +1,168 @@
+import gzip
+import logging
+import os
+import struct
+import subprocess
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from portal import hls, storage, video
+from portal.models import Category, ContentItem
+
+# Test clips made when no files are given: (name, ffmpeg output arguments).
+# The MP4 is written the way most encoders do, with the moov after the media
+GENERATED = (
+    ('h264_aac.mp4', ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '28', '-g', '48', '-c:a', 'aac']),
+    ('mpeg4_aac.mkv', ['-c:v', 'mpeg4', '-q:v', '5', '-c:a', 'aac']),
+)
+POLL_SECONDS = 0.2
+
+
+def _boxes(path):
+    """{type: (offset, size)} of the top-level boxes of an MP4, or None if `path` isn't one."""
+    boxes, offset, size = {}, 0, os.path.getsize(path)
+    with open(path, 'rb') as f:
+        while offset < size:
+            f.seek(offset)
+            header = f.read(16)
+            if len(header) < 8:
+                return None
+            length, kind = struct.unpack('>I4s', header[:8])
+            if length == 1:
+                length = struct.unpack('>Q', header[8:16])[0]
+            if length < 8 or not kind.isascii():
+                return None
+            boxes[kind.decode()] = (offset, length)
+            offset += length
+    return boxes if 'moov' in boxes and 'mdat' in boxes else None
+
+
+def _ffmpeg(*args):
+    subprocess.run([settings.CDN_FFMPEG, '-hide_banner', '-loglevel', 'error', '-nostdin', '-y', *args], check=True)
+
+
+def _first_gop_bytes(path, tmp):
+    """Media bytes of the first SEGMENT_SECONDS of `path`: what a player needs before its first frame."""
+    out = os.path.join(tmp, 'gop.mp4')
+    _ffmpeg('-i', path, '-t', str(hls.SEGMENT_SECONDS - 0.01), '-c', 'copy', out)
+    return _boxes(out)['mdat'][1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Time to first frame of a video over a slow link, playing the file directly versus '
+        'the HLS stream. Server times are measured (packaging starts on the first playlist '
+        'request, as in production); the transfer is modelled from the bytes each needs.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='*', help='Videos to test (default: generate an MP4 and an MKV)')
+        parser.add_argument('--seconds', type=int, default=300, help='Length of the generated clips')
+        parser.add_argument('--mbit', type=float, default=2, help='Modelled link speed')
+        parser.add_argument('--rtt-ms', type=float, default=50, help='Modelled round trip time')
+
+    def handle(self, *args, **options):
+        if not video.available():
+            raise CommandError(f'ffmpeg not found (CDN_FFMPEG={settings.CDN_FFMPEG!r})')
+        with tempfile.TemporaryDirectory(prefix='bench_hls_') as tmp, override_settings(
+            MEDIA_ROOT=os.path.join(tmp, 'media'),
+            CDN_STATE_DIR=os.path.join(tmp, 'state'),
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+        ):
+            files = [os.path.abspath(f) for f in options['files']] or self._generate(tmp, options['seconds'])
+            setup_test_environment()
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                storage.invalidate_media_root()
+                self._run(files, tmp, options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+                storage.invalidate_media_root()
+
+    def _generate(self, tmp, seconds):
+        self.stdout.write(f'Generating {seconds}s 720p test clips...')
+        files = []
+        for name, codec_args in GENERATED:
+            path = os.path.join(tmp, name)
+            _ffmpeg('-f', 'lavfi', '-i', f'testsrc2=size=1280x720:rate=24:duration={seconds}',
+                    '-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}', *codec_args, path)
+            files.append(path)
+        return files
+
+    def _run(self, files, tmp, options):
+        rate = options['mbit'] * 1e6 / 8
+        rtt = options['rtt_ms'] / 1000
+        client = Client(HTTP_ACCEPT_ENCODING='gzip')
+        # The 503s while a stream is packaged are expected here, not server errors
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        category = Category.objects.create(name='Videos')
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'videos'))
+        self.stdout.write(f"Modelled link: {options['mbit']:g} Mbit/s, {options['rtt_ms']:g} ms RTT")
+        for path in files:
+            name = f'videos/{os.path.basename(path)}'
+            os.symlink(path, os.path.join(settings.MEDIA_ROOT, name))
+            # bulk_create: no thumbnail or HLS jobs from save()
+            item, = ContentItem.objects.bulk_create([ContentItem(
+                title=name, category=category, file=name, file_type='video', file_size=os.path.getsize(path),
+            )])
+            url = f'/item/{item.pk}/hls/index.m3u8'
+
+            # Cold: ask as the player does, waiting Retry-After on 503
+            started = time.perf_counter()
+            response = client.get(url)
+            first_answer = time.perf_counter() - started
+            first_status = response.status_code
+            while response.status_code == 503:
+                time.sleep(int(response['Retry-After']))
+                response = client.get(url)
+            if response.status_code != 200:
+                raise CommandError(f'{name}: playlist answered {response.status_code}')
+            cold = time.perf_counter() - started
+            playlist_bytes = len(response.content)
+            text = response.content
+            if response.get('Content-Encoding') == 'gzip':
+                text = gzip.decompress(text)
+            segment_url = next(line for line in text.decode().splitlines() if line and not line.startswith('#'))
+            segment = client.get(segment_url)
+            segment_bytes = int(segment['Content-Length'])
+            segment.close()
+
+            stream = os.path.join(hls.cache_root(), hls.stream_key(item))
+            while hls._running(stream):
+                time.sleep(POLL_SECONDS)
+            packaged = time.perf_counter() - started
+            started = time.perf_counter()
+            response = client.get(url)
+            warm = time.perf_counter() - started
+            full_playlist_bytes = len(response.content)
+
+            hls_cold = cold + 2 * rtt + (playlist_bytes + segment_bytes) / rate
+            hls_warm = warm + 2 * rtt + (full_playlist_bytes + segment_bytes) / rate
+            boxes = _boxes(path)
+            if boxes is None:
+                direct = 'does not play'
+            else:
+                gop = _first_gop_bytes(path, tmp)
+                moov_offset, moov = boxes['moov']
+                # moov after the media: GET sees mdat first and gives up, then a range for the
+                # moov and one for the first frames. Before it: one GET streams both
+                trips = 3 if moov_offset > boxes['mdat'][0] else 1
+                direct = f'{trips * rtt + (moov + gop) / rate:.2f}s (moov {moov / 1024:.0f} KiB, first GOP {gop / 1024:.0f} KiB)'
+
+            self.stdout.write(f'{os.path.basename(path)}')
+            self.stdout.write(
+                f'  server: first answer {first_status} after {first_answer * 1000:.0f} ms, playlist 200 after '
+                f'{cold * 1000:.0f} ms, packaged in {packaged:.1f}s, warm playlist {warm * 1000:.1f} ms'
+            )
+            self.stdout.write(
+                f'  bytes: playlist {playlist_bytes / 1024:.1f} KiB cold / {full_playlist_bytes / 1024:.1f} KiB '
+                f'complete, first segment {segment_bytes / 1024:.0f} KiB'
+            )
+            self.stdout.write(f'  time to first frame: direct {direct}; HLS cold {hls_cold:.2f}s, warm {hls_warm:.2f}s')
@@ -0,0 +1,127 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from portal.models import extract_colors_from_image, extract_image_thumbnail
+
+# (file name, width, height, save options): phone photo, panoramas and poster scans
+CORPUS = (
+    ('photo24.jpg', 6000, 4000, {'format': 'JPEG', 'quality': 90}),
+    ('pano100.jpg', 12000, 8400, {'format': 'JPEG', 'quality': 90}),
+    ('pano100_progressive.jpg', 12000, 8400, {'format': 'JPEG', 'quality': 90, 'progressive': True}),
+    ('scan30.png', 6700, 4500, {'format': 'PNG', 'compress_level': 1}),
+    ('scan100.png', 12000, 8400, {'format': 'PNG', 'compress_level': 1}),
+)
+
+# What extract_colors_from_image() returns when it could not read the image
+FALLBACK_PRIMARY = '#2563eb'
+
+
+def _old_thumbnail(path):
+    """extract_image_thumbnail() before portal/imaging.py: full decode, convert, then shrink."""
+    img = Image.open(path)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img.thumbnail((300, 300), Image.Resampling.LANCZOS)
+    output = io.BytesIO()
+    img.save(output, format='JPEG', quality=85)
+    return output.getvalue()
+
+
+def _old_colors(path):
+    """extract_colors_from_image() before portal/imaging.py."""
+    img = Image.open(path)
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img.thumbnail((150, 150))
+    return img.quantize(colors=5).getpalette()[:15]
+
+
+def _thumbnail(path):
+    return extract_image_thumbnail(path)
+
+
+def _colors(path):
+    colors = extract_colors_from_image(path)
+    return None if colors['primary_color'] == FALLBACK_PRIMARY else colors
+
+
+# (label, before, after)
+FUNCTIONS = (
+    ('thumbnail', _old_thumbnail, _thumbnail),
+    ('colours', _old_colors, _colors),
+)
+
+
+def _peak_rss_mb():
+    """This process's peak RSS. Not ru_maxrss: that survives exec, so a child would report the parent's."""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+
+
+def measure(label, version, path):
+    """
+    Runs in a fresh process: call one function on one image and print
+    [peak RSS increase in MB, seconds, whether it produced a result] as JSON.
+    """
+    warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+    fn = dict((name, (before, after)) for name, before, after in FUNCTIONS)[label][version == 'after']
+    base = _peak_rss_mb()
+    started = time.perf_counter()
+    done = fn(path) is not None
+    seconds = time.perf_counter() - started
+    print(json.dumps([_peak_rss_mb() - base, seconds, done]))
+
+
+def _make_corpus(directory):
+    for name, width, height, options in CORPUS:
+        # A fractal scaled up: compresses like a photo, generated at 1/64 of the pixels
+        small = Image.effect_mandelbrot((width // 8, height // 8), (-2.2, -1.2, 0.8, 1.2), 80).convert('RGB')
+        small.resize((width, height), Image.Resampling.BILINEAR).save(os.path.join(directory, name), **options)
+
+
+class Command(BaseCommand):
+    help = (
+        'Peak memory of thumbnailing and colour extraction over generated large images '
+        '(24-100 MP JPEG and PNG), with a full decode versus portal/imaging.py. Each call '
+        'runs in a fresh process so its peak RSS is its own.'
+    )
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory(prefix='bench_image_memory_') as tmp:
+            self.stdout.write('Generating images...')
+            _make_corpus(tmp)
+            self.stdout.write(f'Pixel budget (CDN_IMAGE_MAX_PIXELS): {settings.CDN_IMAGE_MAX_PIXELS / 1e6:g} MP')
+            header = f"{'function':<10} {'image':<24} {'MB':>6} {'before MB':>10} {'after MB':>9} {'after s':>8} {'result':>8}"
+            self.stdout.write(header)
+            self.stdout.write('-' * len(header))
+            for label, _, _ in FUNCTIONS:
+                for name, *_ in CORPUS:
+                    path = os.path.join(tmp, name)
+                    before_mb, _, _ = self._child(label, 'before', path)
+                    after_mb, seconds, done = self._child(label, 'after', path)
+                    self.stdout.write(
+                        f'{label:<10} {name:<24} {os.path.getsize(path) / 1e6:>6.1f} {before_mb:>10.0f} '
+                        f"{after_mb:>9.0f} {seconds:>8.2f} {'ok' if done else 'skipped':>8}"
+                    )
+
+    def _child(self, label, version, path):
+        code = (
+            'import django; django.setup(); '
+            'from portal.management.commands.bench_image_memory import measure; '
+            f'measure({label!r}, {version!r}, {path!r})'
+        )
+        out = subprocess.run([sys.executable, '-c', code], cwd=str(settings.BASE_DIR),
+                             capture_output=True, text=True, check=True)
+        return json.loads(out.stdout.strip().splitlines()[-1])
@@ -0,0 +1,81 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+
+from portal import storage
+from portal.models import Category, ContentItem
+
+URLS = ('/category/{slug}/', '/api/files/')
+
+
+class _UncachedResolver:
+    """The media root lookup before the resolver: one SiteSettings query per storage call."""
+
+    def _resolve(self):
+        root = storage._query_media_root() or str(settings.MEDIA_ROOT)
+        return root, FileSystemStorage(location=root, base_url=settings.MEDIA_URL)
+
+    def root(self):
+        return self._resolve()[0]
+
+    def storage(self):
+        return self._resolve()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Count the SQL queries of a category page and /api/files/ on a scratch database, with '
+        'the media root looked up on every storage call versus cached per process. Page '
+        'caching is switched off so each request renders.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=200, help='Items with thumbnails in the category')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory(prefix='bench_media_root_') as tmp, override_settings(
+            MEDIA_ROOT=os.path.join(tmp, 'media'),
+            CDN_STATE_DIR=os.path.join(tmp, 'state'),
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+        ):
+            setup_test_environment()
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                storage.invalidate_media_root()
+                category = Category.objects.create(name='Movies')
+                ContentItem.objects.bulk_create(
+                    ContentItem(title=f'Movie {i}', category=category, file=f'movies/{i}.mp4',
+                                thumbnail=f'thumbnails/{i}.jpg', file_type='video')
+                    for i in range(options['items'])
+                )
+                self._report(category, options['items'])
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+                storage.invalidate_media_root()
+
+    def _report(self, category, items):
+        client = Client()
+        self.stdout.write(f'{items} items with thumbnails; queries per request')
+        header = f"{'url':<22} {'uncached':>9} {'cached':>7}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for url in URLS:
+            url = url.format(slug=category.slug)
+            counts = []
+            for resolver in (_UncachedResolver(), storage._resolver):
+                with mock.patch.object(storage, '_resolver', resolver):
+                    client.get(url)  # Warm the resolver and Django's own caches
+                    with CaptureQueriesContext(connection) as queries:
+                        status = client.get(url).status_code
+                if status != 200:
+                    self.stderr.write(f'{url}: HTTP {status}')
+                counts.append(len(queries))
+            self.stdout.write(f'{url:<22} {counts[0]:>9} {counts[1]:>7}')
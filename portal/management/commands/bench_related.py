@@ -0,0 +1,109 @@
+import random
+import resource
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from portal import related
+from portal.models import Category, ContentItem, CoView, RelatedItems
+
+CATEGORIES = 20
+# Zipf-like vocabularies: a few very common title words and tags, a long tail of rare ones
+TITLE_WORDS = 20000
+TAGS = 3000
+LOOKUPS = 1000
+
+
+def _generate(items, coviews, seed):
+    rng = random.Random(seed)
+    categories = [Category.objects.create(name=f'Category {i}') for i in range(CATEGORIES)]
+    words = [f'w{i}' for i in range(TITLE_WORDS)]
+    word_weights = [1 / (i + 1) for i in range(TITLE_WORDS)]
+    tags = [f'tag{i}' for i in range(TAGS)]
+    tag_weights = [1 / (i + 1) ** 0.8 for i in range(TAGS)]
+    ContentItem.objects.bulk_create(
+        (ContentItem(
+            title=' '.join(rng.choices(words, word_weights, k=rng.randint(2, 6))),
+            category=rng.choice(categories), file=f'bench/{i}.mp4',
+            tags=', '.join(set(rng.choices(tags, tag_weights, k=rng.randint(0, 5)))),
+            year=rng.choice([None, *range(1960, 2025)]), downloads=rng.randint(0, 1000),
+        ) for i in range(items)),
+        batch_size=2000,
+    )
+    pks = list(ContentItem.objects.values_list('pk', flat=True))
+    pairs = {}
+    for _ in range(coviews):
+        a, b = rng.sample(pks, 2)
+        pairs[min(a, b), max(a, b)] = rng.randint(1, 50)
+    today = timezone.localdate()
+    CoView.objects.bulk_create(
+        (CoView(item_a_id=a, item_b_id=b, count=count, last_viewed=today) for (a, b), count in pairs.items()),
+        batch_size=5000,
+    )
+    return pks, rng
+
+
+def _old_related(pk):
+    """What item_detail ran on every view before the table: 8 items of the same category."""
+    item = ContentItem.objects.only('category_id').get(pk=pk)
+    return list(ContentItem.objects.filter(category_id=item.category_id, is_active=True)
+                .exclude(pk=pk).values_list('pk', flat=True)[:8])
+
+
+def _median_ms(fn, pks):
+    timings = []
+    for pk in pks:
+        started = time.perf_counter()
+        fn(pk)
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the related-items rebuild on a scratch database of synthetic items and '
+        'co-view pairs: load, compute and write times, peak memory, table size, and the '
+        'per-view lookup against the old same-category query.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100000)
+        parser.add_argument('--coviews', type=int, default=200000, help='Co-view pairs')
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            started = time.monotonic()
+            pks, rng = _generate(options['items'], options['coviews'], seed=1)
+            self.stdout.write(
+                f"{options['items']} items, {CoView.objects.count()} co-view pairs "
+                f"(generated in {time.monotonic() - started:.0f}s)"
+            )
+            header = f"{'rebuild':<8} {'load s':>7} {'compute s':>10} {'write s':>8} {'total s':>8} {'peak RSS MB':>12}"
+            self.stdout.write(header)
+            self.stdout.write('-' * len(header))
+            # The second run replaces existing rows, as the periodic rebuild does
+            for label in ('first', 'again'):
+                started = time.monotonic()
+                stats = related.rebuild()
+                total = time.monotonic() - started
+                peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+                self.stdout.write(
+                    f"{label:<8} {stats['load_seconds']:>7.1f} {stats['compute_seconds']:>10.1f} "
+                    f"{stats['write_seconds']:>8.1f} {total:>8.1f} {peak:>12.0f}"
+                )
+
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT COUNT(*), SUM(LENGTH(ids)) FROM {RelatedItems._meta.db_table}')
+                rows, packed = cursor.fetchone()
+            sample = rng.sample(pks, min(LOOKUPS, len(pks)))
+            self.stdout.write(
+                f'{rows} rows, {packed / 1e6:.1f} MB of packed ids; per view: '
+                f'stored lookup {_median_ms(related.related_ids, sample):.2f} ms, '
+                f'old category query {_median_ms(_old_related, sample):.2f} ms (median)'
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
@@ -0,0 +1,133 @@
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from portal.search import FTS_TABLE, _rank_sql, fts_query
+
+# Same table definition as migration 0007
+FTS_DDL = (
+    "CREATE VIRTUAL TABLE item_fts USING fts5("
+    "title, description, tags, category, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+)
+
+WORDS = (
+    'star wars return empire night river city dark light blue ocean storm king queen '
+    'lost road home summer winter song dance live concert tour guide lesson maths '
+    'science history africa nairobi kenya football final season episode part chapter '
+    'science fiction drama comedy family kids cartoon nature wildlife documentary music '
+    'gospel jazz classic rock news report interview story legend island mountain desert'
+).split()
+CATEGORIES = ('Movies', 'Series', 'Music', 'Documentaries', 'Education', 'Kids', 'Sports', 'Podcasts')
+QUERIES = ('star', 'star wa', 'nairobi football', 'documentary wildlife', 'jazz live concert')
+PAGE_SIZE = 24
+# Made-up words padding the vocabulary, so a query term matches a realistic share of rows
+VOCABULARY_SIZE = 5000
+SYLLABLES = 'ka ri mo tu le sa ne po vi da ko me lu ba zi ro fa te'.split()
+
+
+def _vocabulary(rng):
+    words = set(WORDS)
+    while len(words) < VOCABULARY_SIZE:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def _setup(path, rows):
+    rng = random.Random(rows)
+    vocabulary = _vocabulary(rng)
+
+    def words(n):
+        return ' '.join(rng.choice(vocabulary) for _ in range(n))
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('PRAGMA journal_mode = wal')
+    conn.execute('CREATE TABLE item (id INTEGER PRIMARY KEY, category TEXT, title TEXT, '
+                 'description TEXT, tags TEXT, created_at INTEGER)')
+    conn.execute('BEGIN')
+    conn.executemany(
+        'INSERT INTO item (category, title, description, tags, created_at) VALUES (?, ?, ?, ?, ?)',
+        ((rng.choice(CATEGORIES), words(4).title(), words(30), ', '.join(rng.sample(vocabulary, 3)), i)
+         for i in range(rows)),
+    )
+    conn.execute('COMMIT')
+    return conn
+
+
+def _rebuild(conn):
+    """What `manage.py rebuild_search_index` does: one INSERT ... SELECT, then optimize."""
+    conn.execute('DROP TABLE IF EXISTS item_fts')
+    conn.execute(FTS_DDL)
+    conn.execute('BEGIN')
+    conn.execute('INSERT INTO item_fts (rowid, title, description, tags, category) '
+                 'SELECT id, title, description, tags, category FROM item')
+    conn.execute('COMMIT')
+    conn.execute("INSERT INTO item_fts (item_fts) VALUES ('optimize')")
+
+
+def _search_like(conn, q):
+    """The search view before FTS: icontains over three columns, newest first."""
+    like = f'%{q}%'
+    where = 'title LIKE ? OR description LIKE ? OR tags LIKE ?'
+    conn.execute(f'SELECT COUNT(*) FROM item WHERE {where}', (like, like, like)).fetchone()
+    conn.execute(f'SELECT id, title FROM item WHERE {where} ORDER BY created_at DESC LIMIT {PAGE_SIZE}',
+                 (like, like, like)).fetchall()
+
+
+def _search_fts(conn, q):
+    """search_items(): prefix terms, ranked by bm25() (the same SQL, with sqlite3 placeholders)."""
+    expr = fts_query(q)
+    match = 'id IN (SELECT rowid FROM item_fts WHERE item_fts MATCH ?)'
+    rank = _rank_sql('item').replace(FTS_TABLE, 'item_fts').replace('%s', '?')
+    conn.execute(f'SELECT COUNT(*) FROM item WHERE {match}', (expr,)).fetchone()
+    conn.execute(
+        f'SELECT id, title, ({rank}) AS search_rank FROM item WHERE {match} '
+        f'ORDER BY search_rank LIMIT {PAGE_SIZE}',
+        (expr, expr),
+    ).fetchall()
+
+
+def _time(fn, conn, repeat):
+    """Median ms per query across QUERIES, each run `repeat` times."""
+    timings = []
+    for q in QUERIES:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            fn(conn, q)
+            timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark search on a scratch SQLite database: the old LIKE filter versus the FTS5 '
+        'index, plus the time to rebuild the index, at several library sizes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', default='10000,100000,500000', help='Comma-separated library sizes')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs of each query')
+
+    def handle(self, *args, **options):
+        sizes = [int(n) for n in options['rows'].split(',')]
+        self.stdout.write(f"Queries: {', '.join(repr(q) for q in QUERIES)}; count + first page of {PAGE_SIZE}")
+        header = f"{'rows':>8} {'rebuild s':>10} {'LIKE ms':>9} {'FTS ms':>8}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for rows in sizes:
+            with tempfile.TemporaryDirectory(prefix='bench_search_') as tmp:
+                conn = _setup(os.path.join(tmp, 'bench.sqlite3'), rows)
+                try:
+                    started = time.perf_counter()
+                    _rebuild(conn)
+                    rebuild = time.perf_counter() - started
+                    like = _time(_search_like, conn, options['repeat'])
+                    fts = _time(_search_fts, conn, options['repeat'])
+                finally:
+                    conn.close()
+            self.stdout.write(f"{rows:>8} {rebuild:>10.1f} {like:>9.1f} {fts:>8.1f}")
@@ -0,0 +1,159 @@
+import multiprocessing
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from cdnnode.db.base import apply_pragmas
+
+# Stock Django: rollback journal, deferred BEGIN, sqlite3's 5 s busy timeout
+BASELINE = {'pragmas': {}, 'transaction_mode': None, 'timeout': 5.0}
+
+
+def _tuned_config():
+    options = settings.DATABASES['default'].get('OPTIONS', {})
+    return {
+        'pragmas': dict(options.get('pragmas') or {}),
+        'transaction_mode': options.get('transaction_mode'),
+        'timeout': 5.0,
+    }
+
+
+def _connect(path, config):
+    conn = sqlite3.connect(path, timeout=config['timeout'], isolation_level=None)
+    apply_pragmas(conn, config['pragmas'])
+    return conn
+
+
+def _setup(path, rows):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('CREATE TABLE item (id INTEGER PRIMARY KEY, category INTEGER, title TEXT, downloads INTEGER)')
+    conn.execute('CREATE INDEX item_category ON item (category)')
+    conn.execute('BEGIN')
+    conn.executemany(
+        'INSERT INTO item (category, title, downloads) VALUES (?, ?, 0)',
+        ((i % 20, f'Item {i}') for i in range(rows)),
+    )
+    conn.execute('COMMIT')
+    conn.close()
+
+
+def _wait_until(start):
+    time.sleep(max(0.0, start - time.monotonic()))
+
+
+def _reader(path, config, rows, start, deadline, results):
+    """Category page: a count and a page of 24 items."""
+    conn = _connect(path, config)
+    _wait_until(start)
+    latencies, errors, n = [], 0, 0
+    while time.monotonic() < deadline:
+        category = n % 20
+        started = time.monotonic()
+        try:
+            conn.execute('SELECT COUNT(*) FROM item WHERE category = ?', (category,)).fetchone()
+            conn.execute('SELECT id, title FROM item WHERE category = ? ORDER BY id DESC LIMIT 24',
+                         (category,)).fetchall()
+            latencies.append(time.monotonic() - started)
+        except sqlite3.OperationalError:
+            errors += 1
+        n += 1
+    results.put(('read', latencies, errors))
+
+
+def _writer(path, config, rows, start, deadline, results):
+    """atomic() block that reads a row then writes it, like a view counter or an admin save."""
+    conn = _connect(path, config)
+    _wait_until(start)
+    begin = f"BEGIN {config['transaction_mode']}" if config['transaction_mode'] else 'BEGIN'
+    latencies, errors, n = [], 0, 0
+    while time.monotonic() < deadline:
+        pk = (os.getpid() * 7919 + n) % rows + 1
+        started = time.monotonic()
+        try:
+            conn.execute(begin)
+            (downloads,) = conn.execute('SELECT downloads FROM item WHERE id = ?', (pk,)).fetchone()
+            conn.execute('UPDATE item SET downloads = ? WHERE id = ?', (downloads + 1, pk))
+            conn.execute('COMMIT')
+            latencies.append(time.monotonic() - started)
+        except sqlite3.OperationalError:
+            errors += 1
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+        n += 1
+    results.put(('write', latencies, errors))
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark concurrent SQLite reads and writes with stock settings versus the '
+        'pragmas/transaction mode configured in DATABASES. Runs on a scratch database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--rows', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        configs = [('stock', BASELINE), ('tuned', _tuned_config())]
+        self.stdout.write(
+            f"{options['readers']} reader and {options['writers']} writer processes, "
+            f"{options['seconds']:g}s each run, {options['rows']} rows"
+        )
+        self.stdout.write(f"tuned: {configs[1][1]['pragmas']} transaction_mode={configs[1][1]['transaction_mode']}")
+        header = f"{'config':<7} {'kind':<6} {'ops/s':>9} {'errors':>7} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'wait/op ms':>10}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for name, config in configs:
+            for kind, ops, errors, lat in self._run(config, options):
+                # Time above the fastest (uncontended) op is time spent waiting on locks
+                floor = min(lat) if lat else 0
+                wait = sum(v - floor for v in lat) / len(lat) if lat else 0
+                self.stdout.write(
+                    f"{name:<7} {kind:<6} {ops / options['seconds']:>9.0f} {errors:>7} "
+                    f"{statistics.median(lat) * 1000 if lat else 0:>8.2f} "
+                    f"{_percentile(lat, 99) * 1000:>8.2f} {max(lat, default=0) * 1000:>8.1f} {wait * 1000:>10.3f}"
+                )
+
+    def _run(self, config, options):
+        ctx = multiprocessing.get_context('spawn')
+        with tempfile.TemporaryDirectory(prefix='bench_sqlite_') as tmp:
+            path = os.path.join(tmp, 'bench.sqlite3')
+            _setup(path, options['rows'])
+            # Switch journal mode once up front, as the first connection would in production
+            conn = _connect(path, config)
+            conn.close()
+
+            results = ctx.Queue()
+            start = time.monotonic() + 1  # Time for every process to start and connect
+            deadline = start + options['seconds']
+            procs = [
+                ctx.Process(target=_reader, args=(path, config, options['rows'], start, deadline, results))
+                for _ in range(options['readers'])
+            ] + [
+                ctx.Process(target=_writer, args=(path, config, options['rows'], start, deadline, results))
+                for _ in range(options['writers'])
+            ]
+            for p in procs:
+                p.start()
+            collected = {'read': ([], 0), 'write': ([], 0)}
+            for _ in procs:
+                kind, latencies, errors = results.get()
+                lat, err = collected[kind]
+                collected[kind] = (lat + latencies, err + errors)
+            for p in procs:
+                p.join()
+        return [(kind, len(lat), err, lat) for kind, (lat, err) in collected.items()]
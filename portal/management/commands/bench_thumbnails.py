@@ -0,0 +1,138 @@
+import io
+import os
+import random
+import re
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from PIL import Image, ImageFilter
+
+from portal import storage, thumbs
+from portal.models import Announcement, Category, ContentItem
+
+PICTURE_RE = re.compile(r'<picture>(.*?)</picture>', re.S)
+SOURCE_RE = re.compile(r'<source type="image/\w+" srcset="([^"]+)" sizes="([^"]+)">')
+SLOT_RE = re.compile(r'\(max-width: (\d+)px\) (\d+)vw')
+
+# (label, viewport width in CSS px, device pixel ratio)
+CLIENTS = (('phone 360px @2x', 360, 2), ('desktop 1366px @1x', 1366, 1))
+REPEAT = 200
+
+
+def _photo(rng, width, height):
+    """A JPEG that compresses like a photo: a fractal with noise, slightly blurred."""
+    x = -2.2 + rng.random()
+    img = Image.effect_mandelbrot((width, height), (x, -1.2, x + 3, 1.2), 60).convert('RGB')
+    noise = Image.effect_noise((width, height), 40).convert('RGB')
+    img = Image.blend(img, noise, 0.25).filter(ImageFilter.GaussianBlur(1))
+    output = io.BytesIO()
+    img.save(output, 'JPEG', quality=88)
+    return ContentFile(output.getvalue())
+
+
+def _slot(sizes, viewport):
+    """Rendered width in CSS px that `sizes` gives at this viewport width."""
+    for part in sizes.split(', '):
+        match = SLOT_RE.match(part)
+        if match:
+            if viewport <= int(match.group(1)):
+                return viewport * int(match.group(2)) / 100
+            continue
+        return float(part.removesuffix('px').removesuffix('vw'))
+
+
+def _pick(srcset, pixels):
+    """The candidate a browser takes: the narrowest at least `pixels` wide, else the widest."""
+    candidates = sorted((int(w[:-1]), url) for url, w in (entry.rsplit(' ', 1) for entry in srcset.split(', ')))
+    for width, url in candidates:
+        if width >= pixels:
+            return url
+    return candidates[-1][1]
+
+
+class Command(BaseCommand):
+    help = (
+        'Bytes of card images a page costs with the resized variants versus the stored '
+        'originals, on a scratch database with generated photos. Variants are created on '
+        'their first request, as in production.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=12, help='Categories with a 1920x1080 cover')
+        parser.add_argument('--items', type=int, default=40, help='Items with a 300x300 thumbnail in the first category')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory(prefix='bench_thumbnails_') as tmp, override_settings(
+            MEDIA_ROOT=os.path.join(tmp, 'media'),
+            CDN_STATE_DIR=os.path.join(tmp, 'state'),
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+        ):
+            setup_test_environment()
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                storage.invalidate_media_root()
+                self._run(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                teardown_test_environment()
+                storage.invalidate_media_root()
+
+    def _run(self, options):
+        rng = random.Random(2)
+        categories = []
+        for i in range(options['categories']):
+            category = Category(name=f'Category {i}')
+            category.cover_image.save(f'cover{i}.jpg', _photo(rng, 1920, 1080), save=False)
+            category.save()
+            categories.append(category)
+        announcement = Announcement(title='News', content='Bench')
+        announcement.media_image.save('poster.jpg', _photo(rng, 1600, 900), save=False)
+        announcement.save()
+        for i in range(options['items']):
+            item = ContentItem(title=f'Song {i}', category=categories[0],
+                               file=ContentFile(b'x' * 100, name=f'song{i}.bin'))
+            item.thumbnail.save(f'{i}_thumb.jpg', _photo(rng, 300, 300), save=False)
+            item.save()
+
+        client = Client()
+        media_root = storage._get_media_root()
+        header = f"{'page':<24} {'client':<19} {'images':>6} {'before KiB':>11} {'after KiB':>10} {'saved':>6}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for url in ('/', f'/category/{categories[0].slug}/'):
+            html = client.get(url).content.decode()
+            pictures = [SOURCE_RE.search(block).groups() for block in PICTURE_RE.findall(html)]
+            for label, viewport, ratio in CLIENTS:
+                before = after = 0
+                for srcset, sizes in pictures:
+                    variant = _pick(srcset, _slot(sizes, viewport) * ratio)
+                    name = urlsplit(variant).path.removeprefix('/media/')
+                    # Before: the card linked the stored image itself
+                    before += os.path.getsize(os.path.join(media_root, thumbs.parse(name)[0]))
+                    response = client.get(variant)
+                    after += sum(len(chunk) for chunk in response.streaming_content)
+                    response.close()
+                self.stdout.write(
+                    f'{url:<24} {label:<19} {len(pictures):>6} {before / 1024:>11.1f} '
+                    f'{after / 1024:>10.1f} {100 * (1 - after / before):>5.0f}%'
+                )
+
+        # Cost of the lazy generation: first request versus later hits
+        name = thumbs.variant_name(categories[-1].cover_image.name, thumbs.WIDTHS[2], (thumbs.formats() or ['jpeg'])[0])
+        path = os.path.join(media_root, name)
+        if os.path.exists(path):
+            os.unlink(path)
+        started = time.perf_counter()
+        client.get(f'/media/{name}').close()
+        first = time.perf_counter() - started
+        started = time.perf_counter()
+        for _ in range(REPEAT):
+            client.get(f'/media/{name}').close()
+        hit = (time.perf_counter() - started) / REPEAT
+        self.stdout.write(f'{name}: first request {first * 1000:.1f} ms, later {hit * 1000:.2f} ms')
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from portal import dedup
+
+
+class Command(BaseCommand):
+    help = (
+        'Hash every item file not yet deduplicated and make identical files share one copy '
+        'on the media drive. The worker also runs this daily; use this to do it now.'
+    )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        linked, freed = dedup.dedupe_library()
+        shared = dedup.stats()
+        self.stdout.write(self.style.SUCCESS(
+            f'Linked {linked} item(s) in {time.monotonic() - started:.1f}s, freed {freed} bytes now; '
+            f"{shared['references']} item(s) share {shared['blobs']} file(s), "
+            f"{shared['reclaimed_bytes']} bytes reclaimed in total"
+        ))
@@ -0,0 +1,321 @@
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.utils import timezone
+
+from portal import audiometa, pagecache, search, storage_index
+from portal.models import (
+    Category, ContentItem, Job, extract_audio_thumbnail, extract_image_thumbnail,
+)
+from portal.storage import _get_media_root
+
+
+# A registered file as _load_existing() reads it
+_Known = namedtuple('_Known', 'pk size mtime updated file_type has_thumbnail has_duration')
+
+
+def _thumbnail_bytes(task):
+    """Runs in a pool process: return (pk, jpeg bytes or None) for one file."""
+    pk, file_type, path = task
+    try:
+        if file_type == 'audio':
+            thumb = extract_audio_thumbnail(SimpleNamespace(path=path))
+        else:
+            thumb = extract_image_thumbnail(path)
+        return pk, thumb.read() if thumb else None
+    except Exception:
+        return pk, None
+
+
+def _title_from_filename(filename):
+    stem = os.path.splitext(filename)[0]
+    return ' '.join(stem.replace('_', ' ').replace('.', ' ').split())[:255] or filename[:255]
+
+
+class Command(BaseCommand):
+    help = (
+        'Register an existing directory tree (e.g. a USB drive) as content in place, '
+        'without copying. Top-level folders become categories. Safe to re-run: only '
+        'new or changed files (by size and mtime) are touched, and thumbnails or metadata '
+        'an interrupted run did not get to are made.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Directory to import')
+        parser.add_argument('--category', help='Put every file in this category instead of one per top-level folder')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Processes used for thumbnailing')
+        parser.add_argument('--defer-thumbnails', action='store_true',
+                            help='Queue thumbnail and audio metadata jobs for run_worker instead of doing them now')
+
+    def handle(self, *args, **options):
+        source = os.path.abspath(options['path'])
+        if not os.path.isdir(source):
+            raise CommandError(f'Not a directory: {source}')
+
+        self.media_root = os.path.abspath(_get_media_root())
+        self.base = self._link_into_media_root(source)
+        self.batch_size = options['batch_size']
+        self.forced_category = options['category']
+        self.root_category_name = os.path.basename(source.rstrip(os.sep)) or 'Library'
+        self.categories = {}
+        self.touched_categories = set()
+        self.stats = {'scanned': 0, 'new': 0, 'changed': 0, 'unchanged': 0, 'unfinished': 0}
+        self.thumb_tasks = []
+        self.video_pks = []
+        self.audio_pks = []
+
+        started = time.monotonic()
+        self.existing = self._load_existing()
+        # Work already waiting for run_worker isn't queued twice
+        self.queued = set(
+            Job.objects.filter(status__in=[Job.PENDING, Job.RUNNING], item__isnull=False)
+            .values_list('kind', 'item_id')
+        )
+        self.stdout.write(f'Importing {source} ({len(self.existing)} files already registered)')
+
+        pending_new, pending_changed, pending_mtimes = [], [], []
+        for rel_dir, entry in self._walk(self.base):
+            self.stats['scanned'] += 1
+            name = os.path.relpath(entry.path, self.media_root)
+            stat = entry.stat()
+            known = self.existing.get(name)
+            if known is None:
+                pending_new.append(self._new_item(rel_dir, entry, name, stat))
+            elif self._changed(known, stat):
+                pending_changed.append((known, name, stat))
+            else:
+                self.stats['unchanged'] += 1
+                if known.mtime is None:
+                    pending_mtimes.append(ContentItem(pk=known.pk, file_mtime=stat.st_mtime))
+                self._queue_unfinished(known, name)
+
+            if len(pending_new) >= self.batch_size:
+                self._flush_new(pending_new)
+                pending_new = []
+            if len(pending_changed) >= self.batch_size:
+                self._flush_changed(pending_changed)
+                pending_changed = []
+            if len(pending_mtimes) >= self.batch_size:
+                ContentItem.objects.bulk_update(pending_mtimes, ['file_mtime'])
+                pending_mtimes = []
+        self._flush_new(pending_new)
+        self._flush_changed(pending_changed)
+        if pending_mtimes:
+            ContentItem.objects.bulk_update(pending_mtimes, ['file_mtime'])
+
+        if self.touched_categories:
+            Category.refresh_aggregates(self.touched_categories)
+            pagecache.bump('content')
+        scan_elapsed = time.monotonic() - started
+
+        if options['defer_thumbnails']:
+            Job.objects.bulk_create(
+                [Job(kind='thumbnail', item_id=pk) for pk, _, _ in self.thumb_tasks] +
+                [Job(kind='audio_metadata', item_id=pk) for pk in self.audio_pks],
+                batch_size=self.batch_size,
+            )
+            thumbs = f'{len(self.thumb_tasks)} thumbnail and {len(self.audio_pks)} audio metadata jobs queued'
+        else:
+            made = self._make_thumbnails(options['workers'])
+            tagged = self._read_audio_metadata(options['workers'])
+            thumbs = f'{made}/{len(self.thumb_tasks)} thumbnails generated, {tagged}/{len(self.audio_pks)} tracks tagged'
+        # Video posters need ffmpeg, which only the worker runs
+        if self.video_pks:
+            Job.objects.bulk_create(
+                [Job(kind='video_preview', item_id=pk) for pk in self.video_pks],
+                batch_size=self.batch_size,
+            )
+            thumbs += f', {len(self.video_pks)} video preview jobs queued'
+
+        s = self.stats
+        rate = s['scanned'] / scan_elapsed if scan_elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Scanned {s['scanned']} files in {scan_elapsed:.1f}s ({rate:.0f} files/s): "
+            f"{s['new']} new, {s['changed']} changed, {s['unchanged']} unchanged "
+            f"({s['unfinished']} unfinished); {thumbs}"
+        ))
+
+    # ── Setup ─────────────────────────────────────────────────────────────────
+
+    def _link_into_media_root(self, source):
+        """
+        Files are referenced relative to the media root, so a tree outside it is
+        exposed through a symlink at <media_root>/library/<name> — nothing is copied.
+        """
+        if source == self.media_root or source.startswith(self.media_root + os.sep):
+            return source
+        link = os.path.join(self.media_root, storage_index.LIBRARY_DIR, os.path.basename(source.rstrip(os.sep)))
+        if os.path.islink(link):
+            if os.path.realpath(link) != os.path.realpath(source):
+                raise CommandError(f'{link} already links to {os.readlink(link)}')
+        elif os.path.exists(link):
+            raise CommandError(f'{link} exists and is not a link to {source}')
+        else:
+            os.makedirs(os.path.dirname(link), exist_ok=True)
+            os.symlink(source, link)
+            self.stdout.write(f'Linked {link} -> {source}')
+        return link
+
+    def _load_existing(self):
+        prefix = os.path.relpath(self.base, self.media_root)
+        rows = ContentItem.objects.all()
+        if prefix != os.curdir:
+            rows = rows.filter(file__startswith=prefix + '/')
+        rows = rows.values_list('pk', 'file', 'file_size', 'file_mtime', 'updated_at', 'file_type',
+                                'thumbnail', 'duration')
+        return {
+            name: _Known(pk, size, mtime, updated.timestamp(), file_type, bool(thumbnail), bool(duration))
+            for pk, name, size, mtime, updated, file_type, thumbnail, duration in rows.iterator()
+        }
+
+    @staticmethod
+    def _changed(known, stat):
+        if known.size != stat.st_size:
+            return True
+        if known.mtime is None:
+            # Registered before file mtimes were stored: the row's timestamp is all there is
+            return stat.st_mtime > known.updated
+        return stat.st_mtime != known.mtime
+
+    def _walk(self, top):
+        """Yield (directory relative to the import root, DirEntry) for every visible file."""
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            try:
+                with os.scandir(os.path.join(top, rel)) as it:
+                    for entry in it:
+                        if entry.name.startswith('.'):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(os.path.join(rel, entry.name))
+                        elif entry.is_file():
+                            yield rel, entry
+            except OSError as e:
+                self.stderr.write(f'Skipping {os.path.join(top, rel)}: {e}')
+
+    def _category_for(self, rel_dir):
+        if self.forced_category:
+            name = self.forced_category
+        else:
+            name = rel_dir.split(os.sep, 1)[0] if rel_dir else self.root_category_name
+        if name not in self.categories:
+            self.categories[name], _ = Category.objects.get_or_create(name=name[:100])
+        return self.categories[name]
+
+    # ── Batches ───────────────────────────────────────────────────────────────
+
+    def _new_item(self, rel_dir, entry, name, stat):
+        file_type = ContentItem._detect_type(os.path.splitext(entry.name)[1].lower())
+        category = self._category_for(rel_dir)
+        # Folders below the category folder become tags, e.g. "Season 1"
+        sub_dirs = rel_dir.split(os.sep) if rel_dir else []
+        if not self.forced_category:
+            sub_dirs = sub_dirs[1:]
+        return ContentItem(
+            title=_title_from_filename(entry.name),
+            category=category,
+            file=name,
+            file_type=file_type,
+            file_size=stat.st_size,
+            file_mtime=stat.st_mtime,
+            tags=', '.join(sub_dirs)[:500],
+        )
+
+    def _queue(self, pk, file_type, name, thumbnail=True, metadata=True):
+        """Schedule the thumbnail, audio metadata or video preview work for one item."""
+        if thumbnail and file_type in ('audio', 'image') and ('thumbnail', pk) not in self.queued:
+            self.thumb_tasks.append((pk, file_type, os.path.join(self.media_root, name)))
+        if metadata and file_type == 'audio' and ('audio_metadata', pk) not in self.queued:
+            self.audio_pks.append(pk)
+        if (thumbnail or metadata) and file_type == 'video' and ('video_preview', pk) not in self.queued:
+            self.video_pks.append(pk)
+
+    def _queue_unfinished(self, known, name):
+        """Redo what an interrupted run (or a deleted job) left undone for an unchanged file."""
+        thumbnail = not known.has_thumbnail
+        metadata = not known.has_duration and known.file_type in ('audio', 'video')
+        if metadata or (thumbnail and known.file_type in ('audio', 'image', 'video')):
+            self.stats['unfinished'] += 1
+            self._queue(known.pk, known.file_type, name, thumbnail, metadata)
+
+    def _flush_new(self, items):
+        if not items:
+            return
+        with transaction.atomic():
+            created = ContentItem.objects.bulk_create(items)
+            search.index_items(created)
+        for item in created:
+            self.touched_categories.add(item.category_id)
+            self._queue(item.pk, item.file_type, item.file.name)
+        self.stats['new'] += len(created)
+
+    def _flush_changed(self, changes):
+        """
+        New size and mtime for files replaced since they were registered. What
+        was read from the old file (thumbnail, duration, sprite) is cleared so
+        it is made again from the new one.
+        """
+        if not changes:
+            return
+        now = timezone.now()
+        items = [
+            ContentItem(pk=known.pk, file_size=stat.st_size, file_mtime=stat.st_mtime, updated_at=now,
+                        thumbnail='', duration='', preview_sprite='')
+            for known, _, stat in changes
+        ]
+        with transaction.atomic():
+            ContentItem.objects.bulk_update(
+                items, ['file_size', 'file_mtime', 'updated_at', 'thumbnail', 'duration', 'preview_sprite'],
+            )
+            self.touched_categories.update(
+                ContentItem.objects.filter(pk__in=[known.pk for known, _, _ in changes])
+                .values_list('category_id', flat=True).distinct()
+            )
+        for known, name, _ in changes:
+            self._queue(known.pk, known.file_type, name)
+        self.stats['changed'] += len(changes)
+
+    # ── Thumbnails ────────────────────────────────────────────────────────────
+
+    def _make_thumbnails(self, workers):
+        if not self.thumb_tasks:
+            return 0
+        storage = ContentItem._meta.get_field('thumbnail').storage
+        connections.close_all()  # Don't share the SQLite handle with forked workers
+        made, updates = 0, []
+        with ProcessPoolExecutor(max_workers=max(1, workers)) as pool:
+            for pk, data in pool.map(_thumbnail_bytes, self.thumb_tasks, chunksize=16):
+                if not data:
+                    continue
+                saved = storage.save(f'thumbnails/{pk}_thumb.jpg', ContentFile(data))
+                updates.append(ContentItem(pk=pk, thumbnail=saved))
+                made += 1
+                if len(updates) >= self.batch_size:
+                    ContentItem.objects.bulk_update(updates, ['thumbnail'])
+                    updates = []
+        if updates:
+            ContentItem.objects.bulk_update(updates, ['thumbnail'])
+        if made:
+            pagecache.bump('content')
+        return made
+
+    # ── Audio metadata ────────────────────────────────────────────────────────
+
+    def _read_audio_metadata(self, workers):
+        """Duration, year and artist/album tags for the new, changed and unfinished tracks (portal/audiometa.py)."""
+        updated = 0
+        # In slices, to stay under SQLite's limit on query parameters
+        for start in range(0, len(self.audio_pks), 10000):
+            pks = self.audio_pks[start:start + 10000]
+            stats = audiometa.backfill(ContentItem.objects.filter(pk__in=pks), workers, self.batch_size)
+            updated += stats['updated']
+        return updated
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from portal import related
+
+
+class Command(BaseCommand):
+    help = 'Recompute the related-items table now (the worker also does this periodically).'
+
+    def handle(self, *args, **options):
+        stats = related.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Related items for {stats['items']} items: load {stats['load_seconds']}s, "
+            f"compute {stats['compute_seconds']}s, write {stats['write_seconds']}s"
+        ))
@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from portal import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for all content items.'
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        total = search.rebuild()
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {total} items in {elapsed:.1f}s'
+        ))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q, Sum
+
+from portal.models import Category
+
+
+class Command(BaseCommand):
+    help = 'Verify the stored per-category item counts and sizes against the items table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help='Rewrite the stored totals for categories that are off')
+
+    def handle(self, *args, **options):
+        actual = Category.objects.annotate(
+            real_count=Count('items', filter=Q(items__is_active=True)),
+            real_size=Sum('items__file_size', filter=Q(items__is_active=True)),
+        )
+        drifted = []
+        for cat in actual:
+            real_size = cat.real_size or 0
+            if cat.active_item_count != cat.real_count or cat.active_total_size != real_size:
+                drifted.append(cat.pk)
+                self.stdout.write(self.style.WARNING(
+                    f'{cat.name}: stored {cat.active_item_count} items / {cat.active_total_size} B, '
+                    f'actual {cat.real_count} items / {real_size} B'
+                ))
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('All category totals are correct'))
+            return
+        if options['fix']:
+            Category.refresh_aggregates(drifted)
+            self.stdout.write(self.style.SUCCESS(f'Fixed {len(drifted)} categor{"y" if len(drifted) == 1 else "ies"}'))
+        else:
+            self.stdout.write(f'{len(drifted)} categories differ — run again with --fix to repair')
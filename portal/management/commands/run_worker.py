@@ -0,0 +1,33 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from portal import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run the background job worker (thumbnails, metadata extraction).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Worker threads (default: CDN_WORKER_CONCURRENCY)')
+        parser.add_argument('--once', action='store_true',
+                            help='Run all pending jobs and exit')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            from portal import tasks  # noqa: F401 — register handlers
+            # With a worker running, 'running' jobs are its own and must not be requeued
+            try:
+                if jobs.acquire_worker_lock():
+                    jobs.recover()
+                count = jobs.run_pending()
+            finally:
+                jobs.release_worker_lock()
+            self.stdout.write(self.style.SUCCESS(f'Ran {count} job(s)'))
+            return
+
+        stop_event = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+        jobs.run_worker(concurrency=options['concurrency'], stop_event=stop_event)
@@ -0,0 +1,32 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from portal import storage_index
+from portal.storage import _get_media_root
+
+
+class Command(BaseCommand):
+    help = 'Build or refresh the storage usage index for the media root(s).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Re-list every directory instead of only those whose mtime changed')
+
+    def handle(self, *args, **options):
+        for root in sorted({_get_media_root(), str(settings.MEDIA_ROOT)}):
+            started = time.monotonic()
+            relisted = storage_index.scan(root, full=options['full'])
+            usage = storage_index.totals(root)
+            if usage is None:
+                self.stdout.write(f'{root}: not found, skipped')
+                continue
+            self.stdout.write(self.style.SUCCESS(
+                f"{root}: {usage['files']} files, {usage['bytes']} bytes "
+                f"({relisted} directories re-listed in {time.monotonic() - started:.1f}s)"
+            ))
+            for top, size in sorted(storage_index.usage_by_top_dir(root).items()):
+                if top.startswith(storage_index.LIBRARY_DIR + os.sep):
+                    self.stdout.write(f'  {top}: {size} bytes')
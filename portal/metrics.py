@@ -0,0 +1,193 @@
+"""
+Prometheus text exposition for /metrics.
+
+A scrape returns a pre-rendered string and does no work: no database query,
+no file read, no stat. A background thread in each gunicorn worker (started
+by the first scrape that worker answers) rebuilds the text every
+REFRESH_INTERVAL seconds from:
+
+  * telemetry.totals() — request, latency, SQL, bytes and page cache
+    counters summed over all workers, live and exited (portal/telemetry.py)
+  * gauges read from the database every GAUGE_INTERVAL seconds — jobs by
+    kind and status, items and bytes per category, the storage index
+  * the disk usage sampler's last sample of the media root
+
+The very first scrape a worker answers renders this process's in-memory
+counters only.
+"""
+import threading
+import time
+
+from portal import telemetry
+
+REFRESH_INTERVAL = 5
+GAUGE_INTERVAL = 30
+
+_lock = threading.Lock()
+_text = None
+_thread = None
+_gauges = {}
+_gauges_at = 0.0
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Writer:
+    def __init__(self):
+        self.lines = []
+
+    def family(self, name, kind, help_text):
+        self.lines.append(f'# HELP {name} {help_text}')
+        self.lines.append(f'# TYPE {name} {kind}')
+
+    def sample(self, name, value, **labels):
+        if labels:
+            inner = ','.join(f'{k}="{_label(v)}"' for k, v in labels.items())
+            self.lines.append(f'{name}{{{inner}}} {value}')
+        else:
+            self.lines.append(f'{name} {value}')
+
+    def histogram(self, name, bounds, buckets, total, **labels):
+        cumulative = 0
+        for bound, n in zip(bounds, buckets):
+            cumulative += n
+            self.sample(f'{name}_bucket', cumulative, le=bound, **labels)
+        cumulative += buckets[len(bounds)]
+        self.sample(f'{name}_bucket', cumulative, le='+Inf', **labels)
+        self.sample(f'{name}_sum', total, **labels)
+        self.sample(f'{name}_count', cumulative, **labels)
+
+    def text(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+# ── Collection (background thread only) ───────────────────────────────────────
+
+def _collect_gauges():
+    from django.db import close_old_connections
+    from django.db.models import Count
+    from portal import diskusage, storage_index
+    from portal.models import Category, Job
+    from portal.storage import _get_media_root
+
+    close_old_connections()
+    gauges = {
+        'jobs': list(Job.objects.values_list('kind', 'status').annotate(n=Count('pk')).order_by()),
+        'categories': list(Category.objects.values_list('slug', 'active_item_count', 'active_total_size')),
+    }
+    media_root = _get_media_root()
+    gauges['indexed'] = storage_index.totals(media_root)
+    disk = diskusage.usage(media_root, wait=False)
+    gauges['disk'] = disk._asdict() if disk else None
+    return gauges
+
+
+def _render(totals, active_streams, workers, gauges):
+    w = _Writer()
+
+    w.family('portal_requests_total', 'counter', 'HTTP requests handled, by view and status class.')
+    for view, by_status in sorted(totals.get('requests', {}).items()):
+        for status, n in sorted(by_status.items()):
+            w.sample('portal_requests_total', n, view=view, status=status)
+
+    w.family('portal_request_duration_seconds', 'histogram', 'Request latency by view.')
+    bounds = [ms / 1000 for ms in telemetry.BUCKETS_MS]
+    for view, latency in sorted(totals.get('latency', {}).items()):
+        w.histogram('portal_request_duration_seconds', bounds, latency['buckets'],
+                    round(latency['sum_ms'] / 1000, 6), view=view)
+
+    sql = totals.get('sql')
+    if sql:
+        w.family('portal_db_queries_per_request', 'histogram', 'SQL queries run per request.')
+        w.histogram('portal_db_queries_per_request', telemetry.SQL_BUCKETS, sql['buckets'], sql['queries'])
+        w.family('portal_db_query_seconds_total', 'counter', 'Time spent in SQL queries.')
+        w.sample('portal_db_query_seconds_total', round(sql['ms'] / 1000, 6))
+
+    w.family('portal_media_bytes_sent_total', 'counter', 'Bytes of media streamed by Django.')
+    w.sample('portal_media_bytes_sent_total', totals.get('bytes', 0))
+    w.family('portal_media_responses_total', 'counter', 'Media responses started.')
+    w.sample('portal_media_responses_total', totals.get('media_responses', 0))
+    w.family('portal_media_active_streams', 'gauge', 'Media responses currently streaming.')
+    w.sample('portal_media_active_streams', active_streams)
+
+    w.family('portal_page_cache_requests_total', 'counter', 'Page cache lookups by view and result.')
+    for view, results in sorted(totals.get('cache', {}).items()):
+        for result, n in sorted(results.items()):
+            w.sample('portal_page_cache_requests_total', n, view=view, result=result)
+
+    w.family('portal_workers', 'gauge', 'Web worker processes reporting telemetry.')
+    w.sample('portal_workers', workers)
+
+    if gauges:
+        w.family('portal_jobs', 'gauge', 'Background jobs by kind and status.')
+        for kind, status, n in sorted(gauges.get('jobs', [])):
+            w.sample('portal_jobs', n, kind=kind, status=status)
+
+        w.family('portal_category_items', 'gauge', 'Active items per category.')
+        for slug, count, _ in gauges.get('categories', []):
+            w.sample('portal_category_items', count, category=slug)
+        w.family('portal_category_bytes', 'gauge', 'Total size of active items per category.')
+        for slug, _, size in gauges.get('categories', []):
+            w.sample('portal_category_bytes', size, category=slug)
+
+        indexed = gauges.get('indexed')
+        if indexed:
+            w.family('portal_storage_files', 'gauge', 'Files under the media root (storage index).')
+            w.sample('portal_storage_files', indexed['files'])
+            w.family('portal_storage_file_bytes', 'gauge', 'Bytes of files under the media root (storage index).')
+            w.sample('portal_storage_file_bytes', indexed['bytes'])
+        disk = gauges.get('disk')
+        if disk:
+            w.family('portal_storage_disk_bytes', 'gauge', 'Media root filesystem size.')
+            for kind in ('total', 'used', 'free'):
+                w.sample('portal_storage_disk_bytes', disk[kind], kind=kind)
+            w.family('portal_storage_disk_stale', 'gauge', '1 if the last disk usage sample is stale.')
+            w.sample('portal_storage_disk_stale', int(disk['stale']))
+    return w.text()
+
+
+def refresh():
+    """Rebuild the exposition text (touches the DB and CDN_STATE_DIR)."""
+    global _text, _gauges, _gauges_at
+    if time.monotonic() - _gauges_at >= GAUGE_INTERVAL:
+        try:
+            _gauges = _collect_gauges()
+        except Exception:
+            pass  # Keep the previous gauges; counters still refresh
+        _gauges_at = time.monotonic()
+    snaps = telemetry.snapshots()
+    text = _render(
+        telemetry.totals(snaps),
+        sum(s.get('active_streams', 0) for s in snaps),
+        len(snaps),
+        _gauges,
+    )
+    with _lock:
+        _text = text
+
+
+def _refresh_loop():
+    while True:
+        try:
+            refresh()
+        except Exception:
+            pass
+        time.sleep(REFRESH_INTERVAL)
+
+
+def exposition():
+    """Return the current /metrics text without touching the DB or filesystem."""
+    global _thread
+    if _thread is None:
+        with _lock:
+            if _thread is None:
+                _thread = threading.Thread(target=_refresh_loop, daemon=True, name='metrics')
+                _thread.start()
+    with _lock:
+        text = _text
+    if text is None:
+        local = telemetry._local_snapshot()
+        text = _render(local['totals'], local['active_streams'], 1, None)
+    return text
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0006_sitesettings_media_root'),
+    ]
+
+    operations = [
+        # FTS5 index over title, description, tags and category name (rowid = item id)
+        migrations.RunSQL(
+            sql=[
+                "CREATE VIRTUAL TABLE portal_contentitem_fts USING fts5("
+                "title, description, tags, category, "
+                "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+                "INSERT INTO portal_contentitem_fts (rowid, title, description, tags, category) "
+                "SELECT i.id, i.title, i.description, i.tags, c.name "
+                "FROM portal_contentitem i JOIN portal_category c ON c.id = i.category_id",
+            ],
+            reverse_sql="DROP TABLE IF EXISTS portal_contentitem_fts",
+        ),
+    ]
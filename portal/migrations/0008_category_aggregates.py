@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:05
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_aggregates(apps, schema_editor):
+    Category = apps.get_model('portal', 'Category')
+    ContentItem = apps.get_model('portal', 'ContentItem')
+    active = ContentItem.objects.filter(category=OuterRef('pk'), is_active=True) \
+        .order_by().values('category')
+    Category.objects.update(
+        active_item_count=Coalesce(Subquery(active.annotate(n=Count('pk')).values('n')), Value(0)),
+        active_total_size=Coalesce(Subquery(active.annotate(s=Sum('file_size')).values('s')), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0007_contentitem_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='active_item_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='active_total_size',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_aggregates, migrations.RunPython.noop),
+    ]
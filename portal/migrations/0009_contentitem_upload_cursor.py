@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0008_category_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contentitem',
+            index=models.Index(fields=['uploaded_at', 'id'], name='contentitem_upload_cursor'),
+        ),
+    ]
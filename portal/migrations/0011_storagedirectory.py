@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0010_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageDirectory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('root', models.CharField(max_length=500)),
+                ('path', models.CharField(blank=True, help_text='Relative to root; empty for the root itself', max_length=1000)),
+                ('file_count', models.IntegerField(default=0)),
+                ('total_bytes', models.BigIntegerField(default=0)),
+                ('mtime_ns', models.BigIntegerField(default=0)),
+                ('scanned_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('root', 'path'), name='storagedirectory_root_path')],
+            },
+        ),
+    ]
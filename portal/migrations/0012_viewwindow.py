@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0011_storagedirectory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ViewWindow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day')], max_length=4)),
+                ('start', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='view_windows', to='portal.contentitem')),
+            ],
+            options={
+                'ordering': ['-start'],
+                'indexes': [models.Index(fields=['period', 'start'], name='viewwindow_period_start')],
+                'constraints': [models.UniqueConstraint(fields=('item', 'period', 'start'), name='viewwindow_item_period_start')],
+            },
+        ),
+    ]
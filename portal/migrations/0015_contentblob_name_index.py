@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0014_contentblob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='contentblob',
+            name='name',
+            field=models.CharField(db_index=True, help_text='Storage name relative to the media root', max_length=500),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0015_contentblob_name_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedItems',
+            fields=[
+                ('item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='portal.contentitem')),
+                ('ids', models.BinaryField()),
+            ],
+            options={
+                'verbose_name_plural': 'Related items',
+            },
+        ),
+        migrations.CreateModel(
+            name='CoView',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('last_viewed', models.DateField()),
+                ('item_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='portal.contentitem')),
+                ('item_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='portal.contentitem')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('item_a', 'item_b'), name='coview_pair')],
+            },
+        ),
+    ]
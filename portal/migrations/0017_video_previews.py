@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:51
+
+import portal.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0016_related_items'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contentitem',
+            name='preview_interval',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='contentitem',
+            name='preview_sprite',
+            field=models.ImageField(blank=True, editable=False, null=True, storage=portal.storage.DynamicMediaStorage(), upload_to='previews/'),
+        ),
+    ]
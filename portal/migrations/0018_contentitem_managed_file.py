@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:30
+
+from django.db import migrations, models
+
+
+def forget_blobs(apps, schema_editor):
+    # Existing rows can't tell an upload from a file import_library registered
+    # inside the media root, and a blob deletes its file with its last
+    # reference. Drop the shared-file bookkeeping so no user file is ever
+    # deleted; items keep pointing at the files they use now.
+    ContentBlob = apps.get_model('portal', 'ContentBlob')
+    ContentItem = apps.get_model('portal', 'ContentItem')
+    ContentItem.objects.filter(blob__isnull=False).update(blob=None)
+    ContentBlob.objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0017_video_previews'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contentitem',
+            name='managed_file',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(forget_blobs, migrations.RunPython.noop),
+    ]
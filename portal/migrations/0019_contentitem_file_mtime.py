@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 04:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0018_contentitem_managed_file'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contentitem',
+            name='file_mtime',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+    ]
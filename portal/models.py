@@ -1,10 +1,15 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.utils.text import slugify
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
-from portal.storage import DynamicMediaStorage
+from portal.storage import DynamicMediaStorage, invalidate_media_root
+from portal import conditional, dedup, imaging, pagecache, video
 import os
-from PIL import Image
+import uuid
 import io
 from mutagen import File as MutagenFile
 from mutagen.mp3 import MP3
@@ -19,16 +24,11 @@ def extract_colors_from_image(image_file):
     Returns a dict with 'primary', 'accent', and 'sidebar' hex colors.
     """
     try:
-        # Open image
-        img = Image.open(image_file)
-
-        # Convert to RGB if needed (handles RGBA, grayscale, etc.)
+        # Decode at reduced size where possible (see portal/imaging.py), shrink, then convert
+        img = imaging.shrink(imaging.open_image(image_file, (150, 150)), (150, 150))
         if img.mode != 'RGB':
             img = img.convert('RGB')
 
-        # Resize for faster processing
-        img.thumbnail((150, 150))
-
         # Get color palette (quantize to 5 colors)
         img = img.quantize(colors=5)
         palette = img.getpalette()
@@ -124,21 +124,9 @@ def extract_audio_thumbnail(audio_file):
             image_data = audio.pictures[0].data
 
         if image_data:
-            # Create thumbnail from the extracted image
-            img = Image.open(io.BytesIO(image_data))
-
-            # Convert to RGB if needed
-            if img.mode in ('RGBA', 'LA', 'P'):
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                if img.mode == 'P':
-                    img = img.convert('RGBA')
-                background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-                img = background
-            elif img.mode != 'RGB':
-                img = img.convert('RGB')
-
-            # Create square thumbnail (300x300)
-            img.thumbnail((300, 300), Image.Resampling.LANCZOS)
+            # Create thumbnail (within 300x300) from the extracted image
+            img = imaging.open_image(io.BytesIO(image_data), (300, 300))
+            img = imaging.flatten(imaging.shrink(img, (300, 300)))
 
             # Save to BytesIO
             output = io.BytesIO()
@@ -159,20 +147,10 @@ def extract_image_thumbnail(image_file):
     Returns a ContentFile with the thumbnail data.
     """
     try:
-        img = Image.open(image_file)
-
-        # Convert to RGB if needed
-        if img.mode in ('RGBA', 'LA', 'P'):
-            background = Image.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-            img = background
-        elif img.mode != 'RGB':
-            img = img.convert('RGB')
-
-        # Create square thumbnail (300x300)
-        img.thumbnail((300, 300), Image.Resampling.LANCZOS)
+        # Decode at reduced size where possible and within the pixel budget
+        # (portal/imaging.py); shrink before converting so the copy is small
+        img = imaging.open_image(image_file, (300, 300))
+        img = imaging.flatten(imaging.shrink(img, (300, 300)))
 
         # Save to BytesIO
         output = io.BytesIO()
@@ -185,6 +163,18 @@ def extract_image_thumbnail(image_file):
         return None
 
 
+def format_duration(seconds):
+    """Running time in the style of the `duration` field: '1h 23m', '4m 05s', '42s'."""
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f'{hours}h {minutes:02d}m'
+    if minutes:
+        return f'{minutes}m {secs:02d}s'
+    return f'{secs}s'
+
+
 # ── Icon choices ───────────────────────────────────────────────────────────────
 ICON_CHOICES = [
     ('📁', '📁 Folder'),
@@ -248,6 +238,7 @@ class SiteSettings(models.Model):
 
     def save(self, *args, **kwargs):
         self.pk = 1
+        old_media_root = SiteSettings.objects.filter(pk=1).values_list('media_root', flat=True).first()
 
         # Auto-create the media directory when a custom path is configured
         if self.media_root and self.media_root.strip():
@@ -281,6 +272,11 @@ class SiteSettings(models.Model):
 
         super().save(*args, **kwargs)
 
+        # Let every worker's cached storage pick up the new path — once it is committed,
+        # or a worker could reload the old row under the new generation and keep it
+        if (old_media_root or '') != (self.media_root or ''):
+            transaction.on_commit(invalidate_media_root)
+
     def delete(self, *args, **kwargs):
         pass  # Singleton cannot be deleted
 
@@ -302,6 +298,10 @@ class Category(models.Model):
     icon = models.CharField(max_length=10, default='📁', choices=ICON_CHOICES)
     order = models.PositiveIntegerField(default=0, help_text='Display order')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Denormalized totals over active items — maintained by ContentItem.save(),
+    # the post_delete signal and the admin bulk actions (see adjust/refresh_aggregates)
+    active_item_count = models.IntegerField(default=0, editable=False)
+    active_total_size = models.BigIntegerField(default=0, editable=False)
 
     class Meta:
         verbose_name_plural = 'Categories'
@@ -315,15 +315,40 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def cover_url(self):
+        return conditional.versioned_url(self.cover_image) if self.cover_image else None
+
     @property
     def item_count(self):
-        return self.items.filter(is_active=True).count()
+        return self.active_item_count
 
     @property
     def total_size(self):
-        return sum(
-            item.file_size for item in self.items.filter(is_active=True) if item.file_size
+        return self.active_total_size
+
+    @classmethod
+    def adjust_aggregates(cls, pk, count, size):
+        """Add a delta to one category's stored item count and total size."""
+        if not count and not size:
+            return
+        cls.objects.filter(pk=pk).update(
+            active_item_count=F('active_item_count') + count,
+            active_total_size=F('active_total_size') + size,
+        )
+        pagecache.bump('categories')
+
+    @classmethod
+    def refresh_aggregates(cls, pks=None):
+        """Recompute stored totals from the items table (all categories, or just `pks`)."""
+        active = ContentItem.objects.filter(category=OuterRef('pk'), is_active=True) \
+            .order_by().values('category')
+        categories = cls.objects.all() if pks is None else cls.objects.filter(pk__in=pks)
+        categories.update(
+            active_item_count=Coalesce(Subquery(active.annotate(n=Count('pk')).values('n')), Value(0)),
+            active_total_size=Coalesce(Subquery(active.annotate(s=Sum('file_size')).values('s')), Value(0)),
         )
+        pagecache.bump('categories')
 
     def formatted_total_size(self):
         size = self.total_size
@@ -334,6 +359,31 @@ class Category(models.Model):
         return f"{size:.1f} TB"
 
 
+class ContentBlob(models.Model):
+    """
+    One file on the media drive holding content that several ContentItems
+    may share. Items with identical bytes point at the same file and the blob
+    counts them; the file is deleted when the count reaches zero. See
+    portal/dedup.py.
+    """
+    hash = models.CharField(max_length=64, unique=True, help_text='BLAKE2b-256, hex')
+    name = models.CharField(max_length=500, db_index=True, help_text='Storage name relative to the media root')
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def reclaimed_bytes(self):
+        """Bytes not written to disk because other items share this file."""
+        return self.size * max(self.ref_count - 1, 0)
+
+
 def content_upload_path(instance, filename):
     """Store files under media/<category-slug>/<filename>"""
     return f"{instance.category.slug}/{filename}"
@@ -355,6 +405,10 @@ class ContentItem(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='items')
     file = models.FileField(upload_to=content_upload_path, storage=DynamicMediaStorage())
     thumbnail = models.ImageField(upload_to='thumbnails/', storage=DynamicMediaStorage(), blank=True, null=True)
+    # Scrub-preview sprite sheet for videos and the seconds between its tiles (portal/video.py)
+    preview_sprite = models.ImageField(upload_to='previews/', storage=DynamicMediaStorage(),
+                                       blank=True, null=True, editable=False)
+    preview_interval = models.FloatField(default=0, editable=False)
     file_type = models.CharField(max_length=20, choices=FILE_TYPE_CHOICES, default='other')
     file_size = models.BigIntegerField(default=0, editable=False)
     duration = models.CharField(max_length=20, blank=True, help_text='e.g. 1h 23m')
@@ -364,9 +418,25 @@ class ContentItem(models.Model):
     downloads = models.PositiveIntegerField(default=0, editable=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # True when the portal wrote `file` itself (an upload). Only such files are
+    # deduplicated or ever deleted; files registered in place by import_library
+    # belong to the user's own folders
+    managed_file = models.BooleanField(default=False, editable=False)
+    # The file's own mtime when import_library registered it: a later change
+    # to the file is told apart from edits to this row (updated_at)
+    file_mtime = models.FloatField(blank=True, null=True, editable=False)
+    # Set by the upload handlers or the 'content_hash' job; `blob` is the shared
+    # file this item counts as a reference to (none for files the portal doesn't manage)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True, editable=False)
+    blob = models.ForeignKey(ContentBlob, on_delete=models.SET_NULL, related_name='items',
+                             blank=True, null=True, editable=False)
 
     class Meta:
         ordering = ['-uploaded_at']
+        indexes = [
+            # Keyset pagination in /api/files/
+            models.Index(fields=['uploaded_at', 'id'], name='contentitem_upload_cursor'),
+        ]
 
     def __str__(self):
         return self.title
@@ -379,40 +449,89 @@ class ContentItem(models.Model):
             ext = os.path.splitext(self.file.name)[1].lower()
             self.file_type = self._detect_type(ext)
 
-        super().save(*args, **kwargs)
-
-        # Store file size after save (file is committed at this point)
-        if self.file:
-            try:
-                self.file_size = self.file.size
-                ContentItem.objects.filter(pk=self.pk).update(file_size=self.file_size)
-            except Exception:
-                pass
+        # Write an upload to the drive before the transaction below: its BEGIN
+        # IMMEDIATE holds the database write lock until commit. A new upload
+        # identical to a stored file reuses that file instead of writing a copy
+        uploaded = bool(self.file) and not self.file._committed
+        if uploaded:
+            dedup.prepare(self)
+            if not self.file._committed:
+                self.file.save(self.file.name, self.file.file, save=False)
+
+        # The old row is read in the same transaction as the aggregate delta,
+        # so two concurrent saves of one item can't both apply theirs to it
+        with transaction.atomic():
+            before = old_file = None
+            if not is_new:
+                row = ContentItem.objects.filter(pk=self.pk) \
+                    .values_list('category_id', 'is_active', 'file_size', 'file', 'blob_id').first()
+                if row:
+                    before, old_file = row[:3], row[3:]
+
+            file_changed = bool(self.file) and (uploaded or is_new or
+                                                (old_file is not None and old_file[0] != self.file.name))
+            if uploaded:
+                self.managed_file = True
+            elif file_changed and not is_new:
+                self.managed_file = False  # Pointed at a file the portal didn't write
+            if file_changed and not uploaded:
+                dedup.prepare(self)
+
+            super().save(*args, **kwargs)
+
+            if file_changed:
+                dedup.file_saved(self, old_blob_id=old_file[1] if old_file else None)
+
+            # Store file size after save (file is committed at this point)
+            if self.file:
+                try:
+                    self.file_size = self.file.size
+                    ContentItem.objects.filter(pk=self.pk).update(file_size=self.file_size)
+                except Exception:
+                    pass
+
+            self._update_category_aggregates(before)
+
+        # Thumbnail extraction runs in the background worker, not in the upload request
+        if is_new and self.file and not self.thumbnail and self.file_type in ('audio', 'image'):
+            Job.enqueue('thumbnail', item=self)
+        # Videos get poster, duration and scrub sprite in one job (ffmpeg, portal/video.py)
+        if is_new and self.file and self.file_type == 'video':
+            Job.enqueue('video_preview', item=self)
+        # Duration, year and artist/album tags from the file's own tags (portal/audiometa.py)
+        if is_new and self.file and self.file_type == 'audio':
+            Job.enqueue('audio_metadata', item=self)
+
+    def generate_thumbnail(self):
+        """Extract and store a thumbnail for this item. Returns True if one was saved."""
+        if not self.file or self.thumbnail:
+            return False
 
-        # Auto-generate thumbnail if not provided
-        if is_new and self.file and not self.thumbnail:
-            thumbnail_file = None
+        # Extract thumbnail based on file type
+        thumbnail_file = None
+        if self.file_type == 'audio':
+            thumbnail_file = extract_audio_thumbnail(self.file)
+        elif self.file_type == 'image':
+            thumbnail_file = extract_image_thumbnail(self.file)
+        elif self.file_type == 'video':
+            thumbnail_file = video.extract_poster(self.file.path)
 
-            try:
-                # Extract thumbnail based on file type
-                if self.file_type == 'audio':
-                    thumbnail_file = extract_audio_thumbnail(self.file)
-                elif self.file_type == 'image':
-                    thumbnail_file = extract_image_thumbnail(self.file)
-                # Add video thumbnail extraction here in the future
-
-                # Save thumbnail if generated
-                if thumbnail_file:
-                    self.thumbnail.save(
-                        f'{self.pk}_thumb.jpg',
-                        thumbnail_file,
-                        save=False
-                    )
-                    ContentItem.objects.filter(pk=self.pk).update(thumbnail=self.thumbnail)
-
-            except Exception as e:
-                # Silently fail - thumbnail generation is optional
-                pass
+        if not thumbnail_file:
+            return False
+        self.thumbnail.save(f'{self.pk}_thumb.jpg', thumbnail_file, save=False)
+        ContentItem.objects.filter(pk=self.pk).update(thumbnail=self.thumbnail)
+        pagecache.bump('content')
+        return True
+
+    def _update_category_aggregates(self, before):
+        """Move this item's contribution to the stored category totals after a save."""
+        after = (self.category_id, self.is_active, self.file_size)
+        if before == after:
+            return
+        if before and before[1]:
+            Category.adjust_aggregates(before[0], -1, -before[2])
+        if self.is_active:
+            Category.adjust_aggregates(self.category_id, 1, self.file_size)
 
     @staticmethod
     def _detect_type(ext):
@@ -428,6 +547,28 @@ class ContentItem(models.Model):
             return 'software'
         return 'other'
 
+    @property
+    def file_url(self):
+        """Versioned (immutable) URL once the file has been hashed — see portal/conditional.py."""
+        return conditional.versioned_url(self.file, self.content_hash) if self.file else None
+
+    @property
+    def thumbnail_url(self):
+        return conditional.versioned_url(self.thumbnail) if self.thumbnail else None
+
+    @property
+    def scrub_preview(self):
+        """Sprite sheet geometry for the player's scrub bar, or None (see portal/video.py)."""
+        if not self.preview_sprite or not self.preview_interval:
+            return None
+        return {
+            'url': conditional.versioned_url(self.preview_sprite),
+            'interval': self.preview_interval,
+            'tile_width': video.SPRITE_TILE[0],
+            'tile_height': video.SPRITE_TILE[1],
+            'columns': video.SPRITE_COLUMNS,
+        }
+
     @property
     def file_extension(self):
         return os.path.splitext(self.file.name)[1].lower() if self.file else ''
@@ -530,3 +671,154 @@ class Announcement(models.Model):
         if self.media_image:
             return 'image'
         return None
+
+
+class StorageDirectory(models.Model):
+    """File count and bytes directly inside one directory of a media root (see portal/storage_index.py)."""
+    root = models.CharField(max_length=500)
+    path = models.CharField(max_length=1000, blank=True, help_text='Relative to root; empty for the root itself')
+    file_count = models.IntegerField(default=0)
+    total_bytes = models.BigIntegerField(default=0)
+    mtime_ns = models.BigIntegerField(default=0)
+    scanned_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['root', 'path'], name='storagedirectory_root_path'),
+        ]
+
+    def __str__(self):
+        return os.path.join(self.root, self.path)
+
+
+class Job(models.Model):
+    """
+    A unit of background work (thumbnail extraction, metadata, ...) stored in
+    SQLite and executed by `manage.py run_worker`. See portal/jobs.py.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50)
+    item = models.ForeignKey(ContentItem, on_delete=models.CASCADE, related_name='jobs',
+                             blank=True, null=True)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    last_error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_queue'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} #{self.pk} ({self.status})'
+
+    @classmethod
+    def enqueue(cls, kind, item=None, **payload):
+        return cls.objects.create(kind=kind, item=item, payload=payload)
+
+
+class ViewWindow(models.Model):
+    """
+    Views of one item within one hour or one day, written in batches by
+    portal/counters.py. Old hourly rows are pruned by the worker.
+    """
+    HOUR = 'hour'
+    DAY = 'day'
+    PERIOD_CHOICES = [(HOUR, 'Hour'), (DAY, 'Day')]
+
+    item = models.ForeignKey(ContentItem, on_delete=models.CASCADE, related_name='view_windows')
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES)
+    start = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-start']
+        constraints = [
+            models.UniqueConstraint(fields=['item', 'period', 'start'], name='viewwindow_item_period_start'),
+        ]
+        indexes = [
+            models.Index(fields=['period', 'start'], name='viewwindow_period_start'),
+        ]
+
+    def __str__(self):
+        return f'{self.item_id} {self.period} {self.start:%Y-%m-%d %H:00}: {self.count}'
+
+
+class CoView(models.Model):
+    """
+    How often visitors went straight from one item's page to the other's, in
+    either direction (item_a < item_b). Written by portal/counters.py, read
+    by the related-items recommender.
+    """
+    item_a = models.ForeignKey(ContentItem, on_delete=models.CASCADE, related_name='+')
+    item_b = models.ForeignKey(ContentItem, on_delete=models.CASCADE, related_name='+')
+    count = models.PositiveIntegerField(default=0)
+    last_viewed = models.DateField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['item_a', 'item_b'], name='coview_pair'),
+        ]
+
+    def __str__(self):
+        return f'{self.item_a_id} <-> {self.item_b_id}: {self.count}'
+
+
+class RelatedItems(models.Model):
+    """
+    Precomputed "related" list for one item, best first, packed as
+    little-endian uint32 ids. Rebuilt by the worker (portal/related.py).
+    """
+    item = models.OneToOneField(ContentItem, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    ids = models.BinaryField()
+
+    class Meta:
+        verbose_name_plural = 'Related items'
+
+    def __str__(self):
+        return f'Related to {self.item_id}'
+
+
+class Upload(models.Model):
+    """
+    A resumable (chunked) upload of one file. Chunks are appended to
+    temp_path on the media drive; when the last byte arrives the file is
+    moved into place and `item` is set. See portal/uploads.py.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    filename = models.CharField(max_length=255)
+    title = models.CharField(max_length=255)
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='uploads')
+    size = models.BigIntegerField()
+    temp_path = models.CharField(max_length=1024)
+    item = models.ForeignKey(ContentItem, on_delete=models.SET_NULL, related_name='+', blank=True, null=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f'{self.filename} ({self.size} bytes)'
+
+    @property
+    def is_complete(self):
+        return self.item_id is not None
@@ -0,0 +1,169 @@
+"""
+Rendered page and fragment caching for the public portal.
+
+Whole pages for anonymous visitors are stored in the default cache (a
+file-based cache under CDN_STATE_DIR, so every gunicorn worker shares it) by
+the @cache_page(...) decorator. The sidebar and the home page category cards
+are cached as template fragments with {% cache %}, which also helps pages
+that are rendered every time (item pages, logged-in users).
+
+Invalidation is by version rather than by deleting keys: each kind of data a
+page depends on has a generation stamp file in CDN_STATE_DIR, and its mtime
+is part of every cache key that depends on it. Signals (portal/signals.py)
+and the bulk update paths call bump() when the data changes, so stale entries
+are simply never read again and age out by timeout. Inside a transaction the
+bump waits for the commit: before it, another worker could render the old
+rows and cache them under the new version. Reading a version is one
+stat() — the same scheme storage.py uses for the media root.
+
+    content        items added, changed, (de)activated or removed
+    categories     categories and their stored item counts/sizes
+    announcements  announcements
+    settings       SiteSettings (branding, media root)
+    storage        files on the media drive (storage index rescans)
+"""
+import functools
+import hashlib
+import os
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+
+GENERATIONS = ('content', 'categories', 'announcements', 'settings', 'storage')
+
+# Every portal page has the sidebar and the branding, so they depend on these
+_ALWAYS = ('categories', 'settings')
+
+
+# ── Versions ──────────────────────────────────────────────────────────────────
+
+def _generation_file(name):
+    return os.path.join(str(settings.CDN_STATE_DIR), f'cache-{name}.generation')
+
+
+def generation(name):
+    try:
+        return os.stat(_generation_file(name)).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def bump(*names):
+    """
+    Mark the named data as changed; cached pages and fragments using it go
+    stale. Runs when the current transaction commits (at once outside one).
+    """
+    transaction.on_commit(functools.partial(_touch, names))
+
+
+def _touch(names):
+    now = time.time_ns()
+    for name in names:
+        path = _generation_file(name)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'a'):
+                pass
+            os.utime(path, ns=(now, now))
+        except OSError:
+            pass
+
+
+def versions(*names):
+    return '.'.join(str(generation(name)) for name in names)
+
+
+class Versions:
+    """Template access to versions for {% cache %} vary-on: {{ cache_version.categories }}."""
+
+    def __getitem__(self, name):
+        if name not in GENERATIONS:
+            raise KeyError(name)
+        return generation(name)
+
+
+# ── Site settings ─────────────────────────────────────────────────────────────
+# The context processor used to run SiteSettings.get() (a get_or_create) on
+# every request, admin pages included. Keep one copy per process instead.
+
+_site_lock = threading.Lock()
+_site = (None, None)  # (settings generation, SiteSettings)
+
+
+def site_settings():
+    global _site
+    gen = generation('settings')
+    cached_gen, obj = _site
+    if obj is not None and cached_gen == gen:
+        return obj
+    with _site_lock:
+        from portal.models import SiteSettings
+        _site = (gen, SiteSettings.get())
+        return _site[1]
+
+
+# ── Hit/miss stats (per process) ──────────────────────────────────────────────
+
+_stats_lock = threading.Lock()
+_stats = Counter()
+
+
+def _count(view_name, outcome):
+    with _stats_lock:
+        _stats[(view_name, outcome)] += 1
+
+
+def stats():
+    """Return {view name: {'hits', 'misses', 'bypass'}} for this process."""
+    with _stats_lock:
+        snapshot = dict(_stats)
+    result = {}
+    for (view_name, outcome), n in snapshot.items():
+        result.setdefault(view_name, {'hits': 0, 'misses': 0, 'bypass': 0})[outcome] = n
+    return result
+
+
+# ── Whole pages ───────────────────────────────────────────────────────────────
+
+def cache_page(*depends_on):
+    """
+    Cache a view's rendered 200 response for anonymous GET/HEAD requests,
+    keyed on the full path (query string included) and the versions of
+    `depends_on` plus the sidebar's own dependencies. A view can shorten the
+    lifetime of one response by setting response.cache_timeout (seconds).
+    """
+    names = tuple(dict.fromkeys(depends_on + _ALWAYS))
+
+    def decorator(view):
+        view_name = view.__name__
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+                _count(view_name, 'bypass')
+                return view(request, *args, **kwargs)
+
+            path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+            key = f'page:{view_name}:{path}:{versions(*names)}'
+            cached = cache.get(key)
+            if cached is not None:
+                _count(view_name, 'hits')
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+                response['X-Cache'] = 'HIT'
+                return response
+
+            _count(view_name, 'misses')
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming and not response.cookies:
+                timeout = getattr(response, 'cache_timeout', None) or settings.CDN_PAGE_CACHE_TIMEOUT
+                cache.set(key, (response.content, response['Content-Type']), timeout)
+            response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
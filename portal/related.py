@@ -0,0 +1,238 @@
+"""
+Precomputed "related items" for the item page.
+
+The worker rebuilds the RelatedItems table every CDN_RELATED_REBUILD_INTERVAL
+seconds ('rebuild_related' job, or `manage.py rebuild_related`). item_detail
+reads one row by primary key and fetches those items; an item added since
+the last build falls back to the newest items of its category.
+
+Each active item is scored against the others as a weighted sum of
+
+  * tag overlap    cosine of TF-IDF vectors over tag_list
+  * title overlap  cosine of TF-IDF vectors over the title's words
+  * co-views       visitors going from one item's page to the other's
+                   (CoView, recorded by portal/counters.py), log-scaled
+  * same category and same year, as small bonuses
+
+The similarity products are sparse matrix products (scipy) computed BLOCK
+rows at a time, so memory stays bounded on a Pi; the category and year
+bonuses are only added to pairs the sparse signals already link — as dense
+features they would relate every item to every other. Terms used by more
+than MAX_DF items are dropped for the same reason (and say little anyway).
+Items left with fewer than TOP_K candidates are topped up with the most
+downloaded items of their category.
+
+The best TOP_K ids are stored per item as packed uint32s.
+"""
+import logging
+import re
+import sys
+import time
+from array import array
+
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+TOP_K = 8
+
+# Score weights
+W_TAGS = 1.0
+W_TITLE = 0.6
+W_COVIEW = 1.5
+W_CATEGORY = 0.15
+W_YEAR = 0.1
+
+# Terms shared by more items than this are ignored
+MAX_DF = 1000
+
+# Rows per sparse product
+BLOCK = 512
+
+# Greater than any possible score
+_ROW_STRIDE = 2 * (W_TAGS + W_TITLE + W_COVIEW + W_CATEGORY + W_YEAR)
+
+# RelatedItems rows written per transaction
+WRITE_BATCH = 2000
+
+_WORD_RE = re.compile(r'\w\w+', re.UNICODE)
+
+
+# ── Storage ───────────────────────────────────────────────────────────────────
+
+def pack(ids):
+    a = array('I', ids)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a.tobytes()
+
+
+def unpack(data):
+    a = array('I')
+    a.frombytes(bytes(data))
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a.tolist()
+
+
+def related_ids(pk):
+    """Stored related ids for item `pk`, best first ([] if not built yet)."""
+    from portal.models import RelatedItems
+    data = RelatedItems.objects.filter(item_id=pk).values_list('ids', flat=True).first()
+    return unpack(data) if data else []
+
+
+# ── Features ──────────────────────────────────────────────────────────────────
+
+def _tfidf(docs, n):
+    """L2-normalised binary TF-IDF rows (CSR, n × terms) for a list of token lists."""
+    import numpy as np
+    from scipy import sparse
+
+    vocab = {}
+    rows, cols = array('i'), array('i')
+    for i, tokens in enumerate(docs):
+        for token in set(tokens):
+            rows.append(i)
+            cols.append(vocab.setdefault(token, len(vocab)))
+    rows = np.frombuffer(rows, dtype=np.int32)
+    cols = np.frombuffer(cols, dtype=np.int32)
+    df = np.bincount(cols, minlength=len(vocab))
+    # A term on one item links nothing; one on thousands links everything
+    keep = (df[cols] > 1) & (df[cols] <= MAX_DF)
+    rows, cols = rows[keep], cols[keep]
+    idf = (np.log((1 + n) / (1 + df)) + 1).astype(np.float32)
+    m = sparse.csr_matrix((idf[cols], (rows, cols)), shape=(n, len(vocab)), dtype=np.float32)
+    norms = np.sqrt(np.asarray(m.multiply(m).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms).dot(m).tocsr()
+
+
+def _coviews(index, n):
+    """Symmetric CSR of log-scaled co-view counts between active items, max 1."""
+    import numpy as np
+    from scipy import sparse
+    from portal.models import CoView
+
+    a, b, counts = array('i'), array('i'), array('f')
+    for item_a, item_b, count in CoView.objects.values_list('item_a_id', 'item_b_id', 'count').iterator(chunk_size=5000):
+        i, j = index.get(item_a), index.get(item_b)
+        if i is not None and j is not None:
+            a.append(i)
+            b.append(j)
+            counts.append(count)
+    if not counts:
+        return None
+    a, b = np.frombuffer(a, dtype=np.int32), np.frombuffer(b, dtype=np.int32)
+    weight = np.log1p(np.frombuffer(counts, dtype=np.float32))
+    weight /= weight.max()
+    return sparse.csr_matrix(
+        (np.concatenate([weight, weight]), (np.concatenate([a, b]), np.concatenate([b, a]))),
+        shape=(n, n), dtype=np.float32,
+    )
+
+
+# ── Build ─────────────────────────────────────────────────────────────────────
+
+def compute(items, coviews=None):
+    """
+    `items` is a list of (pk, title, tags, year, category_id, downloads) for
+    the active items. Returns {pk: [related pks, best first]}.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    n = len(items)
+    if n < 2:
+        return {}
+    pks = np.array([row[0] for row in items], dtype=np.int64)
+    years = np.array([row[3] or 0 for row in items], dtype=np.int32)
+    categories = np.array([row[4] for row in items], dtype=np.int64)
+    downloads = np.array([row[5] for row in items], dtype=np.int64)
+
+    tags = _tfidf([[t.strip().lower() for t in (row[2] or '').split(',') if t.strip()] for row in items], n)
+    titles = _tfidf([_WORD_RE.findall(row[1].lower()) for row in items], n)
+    # Stacking sqrt-weighted blocks makes X·Xᵀ the weighted sum of both cosines
+    x = sparse.hstack([tags * np.float32(W_TAGS ** 0.5), titles * np.float32(W_TITLE ** 0.5)]).tocsr()
+    xt = x.T.tocsr()
+
+    related = {}
+    for start in range(0, n, BLOCK):
+        stop = min(start + BLOCK, n)
+        scores = x[start:stop] @ xt
+        if coviews is not None:
+            scores = scores + coviews[start:stop] * np.float32(W_COVIEW)
+        scores = scores.tocoo()
+        row, col, value = scores.row, scores.col, scores.data
+        this = row + start
+        mask = (col != this) & (value > 0)
+        row, col, value, this = row[mask], col[mask], value[mask], this[mask]
+        value = value \
+            + W_CATEGORY * (categories[this] == categories[col]) \
+            + W_YEAR * ((years[this] == years[col]) & (years[col] > 0))
+
+        # Best first within each row (scores are < _ROW_STRIDE, so one argsort
+        # of row·stride − score does it — a two-key lexsort is ~10x slower),
+        # then keep the first TOP_K of every row
+        order = np.argsort(row * _ROW_STRIDE - value)
+        row, col = row[order], col[order]
+        first = np.searchsorted(row, np.arange(stop - start))
+        keep = np.arange(len(row)) - first[row] < TOP_K
+        row, col = row[keep], col[keep]
+        bounds = np.searchsorted(row, np.arange(stop - start + 1))
+        col_pks = pks[col]
+        for r in range(stop - start):
+            related[int(pks[start + r])] = col_pks[bounds[r]:bounds[r + 1]].tolist()
+
+    # Top up sparse rows with the category's most downloaded items
+    order = np.lexsort((-downloads, categories))
+    popular = {}
+    for i in order:
+        bucket = popular.setdefault(int(categories[i]), [])
+        if len(bucket) <= TOP_K:
+            bucket.append(int(pks[i]))
+    for i in range(n):
+        pk = int(pks[i])
+        ids = related[pk]
+        if len(ids) < TOP_K:
+            for other in popular[int(categories[i])]:
+                if other != pk and other not in ids:
+                    ids.append(other)
+                    if len(ids) == TOP_K:
+                        break
+    return related
+
+
+def rebuild():
+    """Recompute and store related items for every active item. Returns a stats dict."""
+    from portal.models import ContentItem, RelatedItems
+
+    started = time.monotonic()
+    items = list(
+        ContentItem.objects.filter(is_active=True).order_by('pk')
+        .values_list('pk', 'title', 'tags', 'year', 'category_id', 'downloads')
+    )
+    index = {row[0]: i for i, row in enumerate(items)}
+    loaded = time.monotonic()
+    related = compute(items, _coviews(index, len(items)))
+    computed = time.monotonic()
+
+    rows = [RelatedItems(item_id=pk, ids=pack(ids)) for pk, ids in related.items()]
+    for i in range(0, len(rows), WRITE_BATCH):
+        # One short transaction per batch so web requests aren't kept waiting on the write lock
+        with transaction.atomic():
+            RelatedItems.objects.bulk_create(
+                rows[i:i + WRITE_BATCH], update_conflicts=True,
+                unique_fields=['item'], update_fields=['ids'],
+            )
+    RelatedItems.objects.filter(item__is_active=False).delete()
+    finished = time.monotonic()
+
+    stats = {
+        'items': len(items),
+        'load_seconds': round(loaded - started, 2),
+        'compute_seconds': round(computed - loaded, 2),
+        'write_seconds': round(finished - computed, 2),
+    }
+    logger.info('Related items rebuilt: %s', stats)
+    return stats
@@ -0,0 +1,73 @@
+"""
+Model signal handlers — keep derived data (search index, category totals,
+shared file references, page cache versions) in sync with content.
+Connected from PortalConfig.ready().
+"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import dedup, pagecache, search
+from .models import Announcement, Category, ContentItem, SiteSettings
+
+
+@receiver(post_save, sender=ContentItem)
+def _index_content_item(sender, instance, raw=False, **kwargs):
+    if raw:
+        return  # loaddata — run rebuild_search_index afterwards
+    search.index_items([instance])
+
+
+@receiver(post_delete, sender=ContentItem)
+def _unindex_content_item(sender, instance, **kwargs):
+    search.remove_item(instance.pk)
+
+
+@receiver(post_delete, sender=ContentItem)
+def _subtract_from_category(sender, instance, **kwargs):
+    if instance.is_active:
+        Category.adjust_aggregates(instance.category_id, -1, -instance.file_size)
+
+
+@receiver(post_delete, sender=ContentItem)
+def _release_blob(sender, instance, **kwargs):
+    if instance.blob_id:
+        dedup.release(instance.blob_id)
+
+
+@receiver(pre_save, sender=Category)
+def _remember_category_name(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Reordering or a new cover saves the category too; only a rename touches the index
+    instance._indexed_name = None
+    if raw or instance._state.adding or (update_fields is not None and 'name' not in update_fields):
+        return
+    instance._indexed_name = Category.objects.filter(pk=instance.pk).values_list('name', flat=True).first()
+
+
+@receiver(post_save, sender=Category)
+def _reindex_category(sender, instance, created=False, raw=False, **kwargs):
+    if created or raw:
+        return
+    if getattr(instance, '_indexed_name', None) not in (None, instance.name):
+        search.rename_category(instance)
+
+
+# ── Page cache invalidation ───────────────────────────────────────────────────
+
+@receiver([post_save, post_delete], sender=ContentItem)
+def _bump_content(sender, **kwargs):
+    pagecache.bump('content')
+
+
+@receiver([post_save, post_delete], sender=Category)
+def _bump_categories(sender, **kwargs):
+    pagecache.bump('categories')
+
+
+@receiver([post_save, post_delete], sender=Announcement)
+def _bump_announcements(sender, **kwargs):
+    pagecache.bump('announcements')
+
+
+@receiver(post_save, sender=SiteSettings)
+def _bump_settings(sender, **kwargs):
+    pagecache.bump('settings')
@@ -1,20 +1,99 @@
 import os
+import threading
 from django.core.files.storage import FileSystemStorage
 from django.conf import settings
 
+from portal import storage_index
 
-def _get_media_root():
-    """Read the configured media root from SiteSettings, falling back to settings.MEDIA_ROOT."""
+
+# ── Media root resolution ─────────────────────────────────────────────────────
+# The configured media root is cached per process so that rendering a grid of
+# thumbnails does not cost one SiteSettings query per file.  Other gunicorn
+# workers learn about a change through a generation stamp file: saving a new
+# media_root touches it, and every lookup compares its mtime (a single stat).
+
+def _generation_file():
+    return os.path.join(str(settings.CDN_STATE_DIR), 'media_root.generation')
+
+
+def _read_generation():
+    try:
+        return os.stat(_generation_file()).st_mtime_ns
+    except OSError:
+        return 0
+
+
+def _query_media_root():
+    """Read the configured media root from SiteSettings, or None if unavailable."""
     try:
         from portal.models import SiteSettings
         row = SiteSettings.objects.filter(pk=1).values_list('media_root', flat=True).first()
-        if row and row.strip():
-            return row.strip()
     except Exception:
-        pass
+        return None
+    if row and row.strip():
+        return row.strip()
     return str(settings.MEDIA_ROOT)
 
 
+class _MediaRootResolver:
+    """Process-wide cache holding the current media root and its FileSystemStorage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._root = None
+        self._storage = None
+        self._generation = None
+
+    def _refresh(self):
+        generation = _read_generation()
+        if self._root is not None and generation == self._generation:
+            return self._root, self._storage
+        with self._lock:
+            if self._root is not None and generation == self._generation:
+                return self._root, self._storage
+            root = _query_media_root()
+            if root is None:
+                # DB not ready (e.g. before migrate) — don't cache the fallback
+                fallback = str(settings.MEDIA_ROOT)
+                return fallback, FileSystemStorage(location=fallback, base_url=settings.MEDIA_URL)
+            self._root = root
+            self._storage = FileSystemStorage(location=root, base_url=settings.MEDIA_URL)
+            self._generation = generation
+            return self._root, self._storage
+
+    def root(self):
+        return self._refresh()[0]
+
+    def storage(self):
+        return self._refresh()[1]
+
+    def invalidate(self):
+        """Drop the cached root here and bump the stamp so other workers reload too."""
+        with self._lock:
+            self._root = None
+            self._storage = None
+        try:
+            os.makedirs(str(settings.CDN_STATE_DIR), exist_ok=True)
+            with open(_generation_file(), 'a'):
+                pass
+            os.utime(_generation_file())
+        except OSError:
+            pass  # Other workers will pick the change up on restart
+
+
+_resolver = _MediaRootResolver()
+
+
+def _get_media_root():
+    """Return the configured media root, falling back to settings.MEDIA_ROOT."""
+    return _resolver.root()
+
+
+def invalidate_media_root():
+    """Called once a SiteSettings.save() that changes media_root has committed."""
+    _resolver.invalidate()
+
+
 class DynamicMediaStorage(FileSystemStorage):
     """
     Storage backend that resolves the upload path from SiteSettings at runtime.
@@ -31,13 +110,19 @@ class DynamicMediaStorage(FileSystemStorage):
         return ('portal.storage.DynamicMediaStorage', [], {})
 
     def _storage(self):
-        return FileSystemStorage(location=_get_media_root(), base_url=settings.MEDIA_URL)
+        return _resolver.storage()
 
     def _open(self, name, mode='rb'):
         return self._storage()._open(name, mode)
 
     def _save(self, name, content):
-        return self._storage()._save(name, content)
+        storage = self._storage()
+        name = storage._save(name, content)
+        try:
+            storage_index.record_file(storage.location, name, storage.size(name))
+        except Exception:
+            pass  # Index is advisory; the background scan corrects it
+        return name
 
     def path(self, name):
         return self._storage().path(name)
@@ -55,4 +140,14 @@ class DynamicMediaStorage(FileSystemStorage):
         return self._storage().listdir(path)
 
     def delete(self, name):
-        return self._storage().delete(name)
+        storage = self._storage()
+        try:
+            size = storage.size(name)
+        except OSError:
+            size = None
+        storage.delete(name)
+        if size is not None:
+            try:
+                storage_index.record_file(storage.location, name, -size, count=-1)
+            except Exception:
+                pass
@@ -0,0 +1,197 @@
+"""
+Persisted storage usage index — file counts and bytes per directory under the
+media root, so the admin and /api/stats/ don't os.walk a multi-TB drive.
+
+Rows are kept current in two ways:
+  * DynamicMediaStorage._save()/delete() apply the change to the file's
+    directory row as it happens (record_file).
+  * The background worker periodically runs scan(), which only re-lists
+    directories whose mtime changed since the last scan and walks the rest
+    from the stored tree without touching the disk beyond one stat each.
+
+Each row counts the files directly inside its directory (not recursive);
+totals are a single aggregate query over the rows for one root. A file
+rewritten in place with a new size doesn't change its directory's mtime, so
+that case is only caught by a full rescan (`manage.py scan_storage --full`).
+
+Symlinks are not followed, except the links import_library makes in
+library/: each is walked once as library/<name>, so a tree registered in
+place counts toward the totals and usage_by_top_dir() reports it by link.
+"""
+import os
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.utils import timezone
+
+# Where import_library links trees that live outside the media root
+LIBRARY_DIR = 'library'
+
+
+def _parent(path):
+    return os.path.dirname(path) if path else None
+
+
+def record_file(root, name, size, count=1):
+    """Apply one file added (count=1) or removed (count=-1) to its directory row."""
+    from portal.models import StorageDirectory
+    root = os.path.abspath(root)
+    directory = os.path.dirname(name)
+    updated = StorageDirectory.objects.filter(root=root, path=directory).update(
+        file_count=F('file_count') + count, total_bytes=F('total_bytes') + size,
+    )
+    if not updated and count > 0 and StorageDirectory.objects.filter(root=root).exists():
+        # New directory in an already-indexed root; the next scan fills in mtime
+        StorageDirectory.objects.get_or_create(
+            root=root, path=directory, defaults={'file_count': count, 'total_bytes': size},
+        )
+
+
+def totals(root):
+    """Return {'files', 'bytes', 'scanned_at'} for a root, or None if never scanned."""
+    from portal.models import StorageDirectory
+    result = StorageDirectory.objects.filter(root=os.path.abspath(root)).aggregate(
+        dirs=Count('pk'), files=Sum('file_count'), bytes=Sum('total_bytes'), scanned_at=Max('scanned_at'),
+    )
+    if not result['dirs']:
+        return None
+    return {'files': result['files'] or 0, 'bytes': result['bytes'] or 0, 'scanned_at': result['scanned_at']}
+
+
+def usage_by_top_dir(root):
+    """
+    Return {top-level directory name: bytes} — category folders are named by
+    slug. Trees linked by import_library are reported as 'library/<name>'.
+    """
+    from portal.models import StorageDirectory
+    usage = {}
+    rows = StorageDirectory.objects.filter(root=os.path.abspath(root)).exclude(path='') \
+        .values_list('path', 'total_bytes')
+    for path, size in rows:
+        parts = path.split(os.sep, 2)
+        if parts[0] == LIBRARY_DIR and len(parts) > 1:
+            top = os.path.join(*parts[:2])
+        else:
+            top = parts[0]
+        usage[top] = usage.get(top, 0) + size
+    return usage
+
+
+def _list_dir(full, follow_links=False):
+    """
+    Return (file_count, bytes, [subdir names]) for the direct contents of a
+    directory. follow_links=True also lists symlinks to directories as subdirs.
+    """
+    count, size, subdirs = 0, 0, []
+    with os.scandir(full) as it:
+        for entry in it:
+            if entry.name.startswith('.'):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif follow_links and entry.is_symlink() and entry.is_dir():
+                    subdirs.append(entry.name)
+                elif entry.is_file(follow_symlinks=False):
+                    size += entry.stat(follow_symlinks=False).st_size
+                    count += 1
+            except OSError:
+                pass
+    return count, size, subdirs
+
+
+def _nested(a, b):
+    """Whether one of two real paths is inside the other."""
+    return a == b or a.startswith(b + os.sep) or b.startswith(a + os.sep)
+
+
+def _linked_subdirs(root, path, subdirs, followed):
+    """
+    The library/ entries to descend into: skips links to a tree already
+    followed or overlapping the media root itself (counted there, or a loop).
+    """
+    real_root = os.path.realpath(root)
+    keep = []
+    for name in sorted(subdirs):
+        link = os.path.join(root, path, name)
+        if not os.path.islink(link):
+            keep.append(name)
+            continue
+        real = os.path.realpath(link)
+        if _nested(real, real_root) or any(_nested(real, other) for other in followed):
+            continue
+        followed.add(real)
+        keep.append(name)
+    return keep
+
+
+def scan(root, full=False):
+    """
+    Bring the index for `root` up to date. Directories whose mtime is unchanged
+    keep their stored counts; their children come from the stored tree.
+    full=True re-lists every directory. Returns the number re-listed.
+    """
+    from portal.models import StorageDirectory
+    root = os.path.abspath(root)
+    if not os.path.isdir(root):
+        return 0
+
+    known = {row.path: row for row in StorageDirectory.objects.filter(root=root)}
+    children = {}
+    for path in known:
+        parent = _parent(path)
+        if parent is not None:
+            children.setdefault(parent, []).append(path)
+
+    now = timezone.now()
+    seen, to_create, to_update, relisted = set(), [], [], 0
+    followed = set()  # Real paths of the library/ links walked so far
+    stack = ['']
+    while stack:
+        path = stack.pop()
+        abs_path = os.path.join(root, path)
+        try:
+            mtime_ns = os.stat(abs_path).st_mtime_ns
+        except OSError:
+            continue  # Vanished — dropped below with its subtree
+        seen.add(path)
+        row = known.get(path)
+        if row is not None and row.mtime_ns == mtime_ns and not full:
+            stored = children.get(path, [])
+            if path == LIBRARY_DIR:
+                stored = [os.path.join(path, name) for name in
+                          _linked_subdirs(root, path, [os.path.basename(p) for p in stored], followed)]
+            stack.extend(stored)
+            continue
+
+        try:
+            count, size, subdirs = _list_dir(abs_path, follow_links=path == LIBRARY_DIR)
+        except OSError:
+            continue
+        if path == LIBRARY_DIR:
+            subdirs = _linked_subdirs(root, path, subdirs, followed)
+        relisted += 1
+        stack.extend(os.path.join(path, d) for d in subdirs)
+        if row is None:
+            to_create.append(StorageDirectory(
+                root=root, path=path, file_count=count, total_bytes=size,
+                mtime_ns=mtime_ns, scanned_at=now,
+            ))
+        else:
+            row.file_count, row.total_bytes, row.mtime_ns, row.scanned_at = count, size, mtime_ns, now
+            to_update.append(row)
+
+    with transaction.atomic():
+        StorageDirectory.objects.bulk_create(to_create, batch_size=500)
+        StorageDirectory.objects.bulk_update(
+            to_update, ['file_count', 'total_bytes', 'mtime_ns', 'scanned_at'], batch_size=500,
+        )
+        gone = [known[p].pk for p in known if p not in seen]
+        if gone:
+            StorageDirectory.objects.filter(pk__in=gone).delete()
+        # Stamp the root so totals() reports when the index was last verified
+        StorageDirectory.objects.filter(root=root, path='').update(scanned_at=now)
+    if relisted:
+        from portal import pagecache
+        pagecache.bump('storage')
+    return relisted
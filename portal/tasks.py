@@ -0,0 +1,94 @@
+"""
+Job handlers executed by the background worker (see portal/jobs.py).
+"""
+from django.conf import settings
+
+from portal.jobs import every, handler
+
+
+@handler('thumbnail')
+def _generate_thumbnail(job):
+    """Extract album art / image thumbnail for a newly uploaded item."""
+    if job.item is None:
+        return  # Item deleted before the job ran
+    job.item.generate_thumbnail()
+
+
+@handler('video_preview')
+def _video_preview(job):
+    """Poster frame, duration and scrub sprite for a video item (no-op without ffmpeg)."""
+    if job.item is None:
+        return
+    from portal import video
+    video.process(job.item)
+
+
+@handler('audio_metadata')
+def _audio_metadata(job):
+    """Duration, year and artist/album/genre tags from an audio item's embedded tags."""
+    if job.item is None:
+        return
+    from portal import audiometa
+    audiometa.process(job.item)
+
+
+@handler('storage_scan')
+def _scan_storage(job):
+    """Refresh the storage usage index for the current and default media roots."""
+    from portal import storage_index
+    from portal.storage import _get_media_root
+    roots = {_get_media_root(), str(settings.MEDIA_ROOT)}
+    for root in roots:
+        storage_index.scan(root, full=job.payload.get('full', False))
+
+
+@handler('prune_view_windows')
+def _prune_view_windows(job):
+    """Drop hourly/daily view counts past their retention."""
+    from portal import counters
+    counters.prune()
+
+
+@handler('content_hash')
+def _content_hash(job):
+    """Hash a newly stored item file and share it with identical items."""
+    if job.item is None:
+        return
+    from portal import dedup
+    dedup.hash_item(job.item)
+
+
+@handler('dedupe_library')
+def _dedupe_library(job):
+    """Hash and dedupe every item not yet linked to a shared file."""
+    from portal import dedup
+    dedup.dedupe_library()
+
+
+@handler('rebuild_related')
+def _rebuild_related(job):
+    """Recompute the related-items table."""
+    from portal import related
+    related.rebuild()
+
+
+@handler('prune_uploads')
+def _prune_uploads(job):
+    """Delete resumable uploads abandoned for CDN_UPLOAD_EXPIRY_HOURS."""
+    from portal import uploads
+    uploads.prune()
+
+
+@handler('prune_hls')
+def _prune_hls(job):
+    """Evict least recently played HLS streams past CDN_HLS_CACHE_MAX_BYTES."""
+    from portal import hls
+    hls.prune()
+
+
+every('storage_scan', settings.CDN_STORAGE_SCAN_INTERVAL)
+every('prune_view_windows', 6 * 3600)
+every('prune_uploads', 3600)
+every('prune_hls', 3600)
+every('dedupe_library', 24 * 3600)
+every('rebuild_related', settings.CDN_RELATED_REBUILD_INTERVAL)
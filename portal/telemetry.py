@@ -0,0 +1,478 @@
+"""
+Request telemetry — rolling latency histograms, throughput, active media
+streams, page cache hit rates and SQLite query time, summarised for the
+heartbeat and for /api/metrics/.
+
+Recording is in memory and cheap: TelemetryMiddleware times each request and
+its SQL queries (via connection.execute_wrapper) and adds one sample to a
+fixed-bucket histogram for the view; serve_media() calls track_media() so
+bytes sent and concurrently open streams are counted. Samples go into
+one-minute slots and a summary covers the last WINDOW_MINUTES of them.
+
+Each gunicorn worker only sees its own requests, so a thread in every
+process writes a snapshot of its slots to CDN_STATE_DIR/metrics/<pid>.json
+every SNAPSHOT_INTERVAL seconds. summary() merges this process's live data
+with the other workers' snapshots (histograms with fixed buckets add up), so
+whichever worker answers /api/metrics/ or sends the heartbeat reports the
+whole node. Page cache hit/miss counts are cumulative since each worker
+started (see pagecache.stats()).
+
+Alongside the windowed slots each process keeps cumulative totals (for the
+Prometheus counters in portal/metrics.py). When a worker exits, the first
+process to notice folds its last totals into metrics/retired.json and
+removes its snapshot, so node-wide counters don't go backwards on a
+worker restart.
+
+Bytes are counted as they are sent, not from Content-Length, so a client
+that stops after the first megabyte counts a megabyte: streamed chunks as
+they are yielded, files (which gunicorn may sendfile() without Python
+seeing them) from delivery's file-like when the response is closed. With
+the x-accel / x-sendfile backends the web server sends the file and no
+bytes are counted.
+
+A worker writes its snapshot only when something was recorded since the
+last one, so an idle node doesn't rewrite the files every few seconds.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection
+
+# Histogram bucket upper bounds in milliseconds; the last bucket is open-ended
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+# Histogram bucket upper bounds for SQL queries per request
+SQL_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+WINDOW_MINUTES = 5
+SNAPSHOT_INTERVAL = 5
+
+_lock = threading.Lock()
+_slots = {}            # minute -> slot dict (see _new_slot)
+_active_streams = 0
+_thread = None
+# Bumped by every recording; the snapshot thread skips writes while it stands still
+_changes = 0
+
+# Cumulative since this process started; merged with _add()
+_totals = {
+    'requests': {},    # view -> {status class ('2xx', ...) -> count}
+    'latency': {},     # view -> {'buckets': [...], 'sum_ms': float}
+    'sql': {'buckets': [0] * (len(SQL_BUCKETS) + 1), 'queries': 0, 'ms': 0.0},
+    'bytes': 0,
+    'media_responses': 0,
+}
+
+
+def _new_slot():
+    return {
+        'views': defaultdict(lambda: [0] * (len(BUCKETS_MS) + 1)),
+        'errors': defaultdict(int),   # view -> 5xx responses
+        'requests': 0,
+        'bytes': 0,
+        'sql_count': 0,
+        'sql_ms': 0.0,
+    }
+
+
+def _slot(now):
+    """Return the current minute's slot, dropping ones outside the window. Lock held."""
+    minute = int(now // 60)
+    slot = _slots.get(minute)
+    if slot is None:
+        slot = _slots[minute] = _new_slot()
+        for old in [m for m in _slots if m <= minute - WINDOW_MINUTES]:
+            del _slots[old]
+    return slot
+
+
+# ── Recording ─────────────────────────────────────────────────────────────────
+
+def record_request(view, elapsed_ms, status, sql_count, sql_ms):
+    global _changes
+    bucket = bisect.bisect_left(BUCKETS_MS, elapsed_ms)
+    status_class = f'{status // 100}xx'
+    with _lock:
+        _changes += 1
+        slot = _slot(time.time())
+        slot['views'][view][bucket] += 1
+        slot['requests'] += 1
+        slot['sql_count'] += sql_count
+        slot['sql_ms'] += sql_ms
+        if status >= 500:
+            slot['errors'][view] += 1
+
+        by_status = _totals['requests'].setdefault(view, {})
+        by_status[status_class] = by_status.get(status_class, 0) + 1
+        latency = _totals['latency'].setdefault(view, {'buckets': [0] * (len(BUCKETS_MS) + 1), 'sum_ms': 0.0})
+        latency['buckets'][bucket] += 1
+        latency['sum_ms'] += elapsed_ms
+        sql = _totals['sql']
+        sql['buckets'][bisect.bisect_left(SQL_BUCKETS, sql_count)] += 1
+        sql['queries'] += sql_count
+        sql['ms'] += sql_ms
+    _ensure_thread()
+
+
+def record_bytes(n):
+    global _changes
+    with _lock:
+        _changes += 1
+        _slot(time.time())['bytes'] += n
+        _totals['bytes'] += n
+
+
+def track_media(response):
+    """
+    Count a media response's bytes as they are sent and keep it in
+    active_streams until it is closed.
+    """
+    global _active_streams, _changes
+    with _lock:
+        _totals['media_responses'] += 1
+        _changes += 1
+    if not response.streaming:
+        if response.content:
+            record_bytes(len(response.content))
+        return response
+
+    # A file goes to the server whole (wsgi.file_wrapper and sendfile, so no
+    # chunks pass through here): delivery's file-like reports what was sent
+    filelike = getattr(response, 'file_to_stream', None)
+    if filelike is None:
+        response.streaming_content = _counted(response.streaming_content)
+    with _lock:
+        _active_streams += 1
+    close = response.close
+    done = []
+
+    def closed():
+        global _active_streams, _changes
+        try:
+            close()
+        finally:
+            # close() may be called more than once (test client, file_wrapper)
+            with _lock:
+                if done:
+                    return
+                done.append(True)
+                _active_streams -= 1
+                _changes += 1
+            if getattr(filelike, 'sent', 0):
+                record_bytes(filelike.sent)
+    # Django's WSGI handler (and any file_wrapper) ends by calling response.close()
+    response.close = closed
+    return response
+
+
+def _counted(chunks):
+    for chunk in chunks:
+        record_bytes(len(chunk))
+        yield chunk
+
+
+class TelemetryMiddleware:
+    """Time every request and its SQL queries into the rolling histograms."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sql = [0, 0.0]
+
+        def time_query(execute, query, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(query, params, many, context)
+            finally:
+                sql[0] += 1
+                sql[1] += (time.perf_counter() - started) * 1000
+
+        started = time.perf_counter()
+        with connection.execute_wrapper(time_query):
+            response = self.get_response(request)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+
+        match = request.resolver_match
+        view = (match.view_name or match.url_name or 'unnamed') if match else 'unresolved'
+        record_request(view, elapsed_ms, response.status_code, sql[0], sql[1])
+        return response
+
+
+# ── Snapshots shared between workers ──────────────────────────────────────────
+
+def _metrics_dir():
+    return os.path.join(str(settings.CDN_STATE_DIR), 'metrics')
+
+
+def _local_snapshot():
+    with _lock:
+        _slot(time.time())
+        slots = {
+            str(minute): {
+                'views': {v: list(b) for v, b in slot['views'].items()},
+                'errors': dict(slot['errors']),
+                'requests': slot['requests'],
+                'bytes': slot['bytes'],
+                'sql_count': slot['sql_count'],
+                'sql_ms': slot['sql_ms'],
+            }
+            for minute, slot in _slots.items()
+        }
+        active = _active_streams
+        totals = json.loads(json.dumps(_totals))
+    from portal import pagecache
+    cache = pagecache.stats()
+    totals['cache'] = cache
+    return {
+        'pid': os.getpid(),
+        'written_at': time.time(),
+        'active_streams': active,
+        'cache': cache,
+        'slots': slots,
+        'totals': totals,
+    }
+
+
+def write_snapshot():
+    directory = _metrics_dir()
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    tmp = path + '.tmp'
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(tmp, 'w') as f:
+            json.dump(_local_snapshot(), f, separators=(',', ':'))
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # Exists but owned by someone else
+    return True
+
+
+def snapshots():
+    """This process's live snapshot plus every other live worker's last snapshot."""
+    result = [_local_snapshot()]
+    me = os.getpid()
+    try:
+        names = os.listdir(_metrics_dir())
+    except OSError:
+        return result
+    for name in names:
+        if not name.endswith('.json'):
+            continue
+        try:
+            pid = int(name[:-5])
+        except ValueError:
+            continue
+        if pid == me:
+            continue
+        path = os.path.join(_metrics_dir(), name)
+        if not _pid_alive(pid):
+            _retire(path)
+            continue
+        try:
+            with open(path) as f:
+                result.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return result
+
+
+def _add(target, source):
+    """Add nested dicts/lists of numbers from `source` into `target` in place."""
+    for key, value in source.items():
+        if isinstance(value, dict):
+            _add(target.setdefault(key, {}), value)
+        elif isinstance(value, list):
+            current = target.setdefault(key, [0] * len(value))
+            for i, n in enumerate(value):
+                current[i] += n
+        else:
+            target[key] = target.get(key, 0) + value
+
+
+def _retired_path():
+    return os.path.join(_metrics_dir(), 'retired.json')
+
+
+def _read_retired():
+    try:
+        with open(_retired_path()) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _retire(path):
+    """Fold an exited worker's totals into retired.json, exactly once."""
+    import fcntl
+    claimed = f'{path}.retiring-{os.getpid()}'
+    try:
+        os.rename(path, claimed)  # Only one process can win this
+    except OSError:
+        return
+    try:
+        with open(claimed) as f:
+            totals = json.load(f).get('totals', {})
+        with open(os.path.join(_metrics_dir(), 'retired.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            retired = _read_retired()
+            _add(retired, totals)
+            tmp = _retired_path() + f'.{os.getpid()}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(retired, f, separators=(',', ':'))
+            os.replace(tmp, _retired_path())
+    except (OSError, ValueError):
+        pass
+    finally:
+        try:
+            os.remove(claimed)
+        except OSError:
+            pass
+
+
+def totals(snaps=None):
+    """Cumulative totals for the node: live workers plus every exited one."""
+    merged = _read_retired()
+    for snap in snaps if snaps is not None else snapshots():
+        _add(merged, snap.get('totals', {}))
+    return merged
+
+
+def _snapshot_if_changed(written):
+    """
+    Write a snapshot if anything was recorded since the one written at
+    `written` (a _changes value). Returns the value for the next call.
+    """
+    changes = _changes
+    if changes != written:
+        write_snapshot()
+    return changes
+
+
+def _snapshot_loop():
+    written = None
+    while True:
+        time.sleep(SNAPSHOT_INTERVAL)
+        # An idle worker's snapshot is already on disk; don't rewrite it every few seconds
+        written = _snapshot_if_changed(written)
+
+
+def _ensure_thread():
+    global _thread
+    if _thread is not None:
+        return
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_snapshot_loop, daemon=True, name='telemetry')
+            _thread.start()
+
+
+# ── Summary ───────────────────────────────────────────────────────────────────
+
+def _percentile(counts, pct):
+    """Estimate a percentile in ms from bucket counts, interpolating inside the bucket."""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = total * pct / 100
+    seen = 0
+    for i, n in enumerate(counts):
+        if n and seen + n >= rank:
+            low = BUCKETS_MS[i - 1] if i else 0
+            high = BUCKETS_MS[i] if i < len(BUCKETS_MS) else BUCKETS_MS[-1] * 2
+            return round(low + (high - low) * (rank - seen) / n, 1)
+        seen += n
+    return float(BUCKETS_MS[-1])
+
+
+def _merge(snaps):
+    now = time.time()
+    first_minute = int(now // 60) - WINDOW_MINUTES + 1
+    merged = {
+        'views': defaultdict(lambda: [0] * (len(BUCKETS_MS) + 1)),
+        'errors': defaultdict(int),
+        'requests': 0, 'bytes': 0, 'sql_count': 0, 'sql_ms': 0.0,
+        'oldest': now, 'active_streams': 0,
+        'cache_hits': 0, 'cache_misses': 0, 'workers': len(snaps),
+    }
+    for snap in snaps:
+        merged['active_streams'] += snap.get('active_streams', 0)
+        for counts in snap.get('cache', {}).values():
+            merged['cache_hits'] += counts.get('hits', 0)
+            merged['cache_misses'] += counts.get('misses', 0)
+        for minute, slot in snap.get('slots', {}).items():
+            minute = int(minute)
+            if minute < first_minute:
+                continue
+            merged['oldest'] = min(merged['oldest'], minute * 60)
+            for view, counts in slot['views'].items():
+                target = merged['views'][view]
+                for i, n in enumerate(counts):
+                    target[i] += n
+            for view, n in slot['errors'].items():
+                merged['errors'][view] += n
+            for key in ('requests', 'bytes', 'sql_count', 'sql_ms'):
+                merged[key] += slot[key]
+    return merged
+
+
+def summary(views=True):
+    """Node-wide figures over the last WINDOW_MINUTES (or since the first request)."""
+    m = _merge(snapshots())
+    seconds = max(time.time() - m['oldest'], 1.0)
+    overall = [0] * (len(BUCKETS_MS) + 1)
+    for counts in m['views'].values():
+        for i, n in enumerate(counts):
+            overall[i] += n
+    lookups = m['cache_hits'] + m['cache_misses']
+    result = {
+        'window_seconds': round(seconds),
+        'workers': m['workers'],
+        'requests': m['requests'],
+        'requests_per_sec': round(m['requests'] / seconds, 2),
+        'bytes_per_sec': round(m['bytes'] / seconds),
+        'active_streams': m['active_streams'],
+        'latency_ms': {
+            'p50': _percentile(overall, 50),
+            'p95': _percentile(overall, 95),
+            'p99': _percentile(overall, 99),
+        },
+        'errors': sum(m['errors'].values()),
+        'cache': {
+            'hits': m['cache_hits'],
+            'misses': m['cache_misses'],
+            'hit_ratio': round(m['cache_hits'] / lookups, 3) if lookups else None,
+        },
+        'sql': {
+            'queries': m['sql_count'],
+            'total_ms': round(m['sql_ms'], 1),
+            'avg_ms': round(m['sql_ms'] / m['sql_count'], 3) if m['sql_count'] else None,
+            'per_request': round(m['sql_count'] / m['requests'], 2) if m['requests'] else None,
+        },
+    }
+    if views:
+        result['views'] = {
+            view: {
+                'count': sum(counts),
+                'errors': m['errors'].get(view, 0),
+                'p50': _percentile(counts, 50),
+                'p95': _percentile(counts, 95),
+                'p99': _percentile(counts, 99),
+            }
+            for view, counts in sorted(m['views'].items(), key=lambda kv: -sum(kv[1]))
+        }
+    return result
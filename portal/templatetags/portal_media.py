@@ -0,0 +1,24 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from portal import thumbs
+
+register = template.Library()
+
+
+@register.simple_tag
+def picture(field_file, alt='', sizes='100vw'):
+    """
+    <picture> for a card image: a srcset of resized variants per modern
+    format, then JPEG for the <img> itself. `sizes` is the rendered width
+    of the card (a CSS length or media-condition list), which is what lets
+    the browser pick the smallest variant that fills it.
+    """
+    sources = format_html_join(
+        '', '<source type="image/{}" srcset="{}" sizes="{}">',
+        ((fmt, thumbs.srcset(field_file, fmt), sizes) for fmt in thumbs.formats()),
+    )
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" alt="{}" loading="lazy"></picture>',
+        sources, thumbs.default_url(field_file), thumbs.srcset(field_file, 'jpeg'), sizes, alt,
+    )
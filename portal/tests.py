@@ -1,3 +1,847 @@
-from django.test import TestCase
+import fcntl
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib.admin.sites import site
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+
+from portal import conditional, dedup, delivery, heartbeat, hls, jobs, pagecache, search, storage, storage_index, telemetry, uploads
+from portal.models import Category, ContentBlob, ContentItem, Job, SiteSettings, Upload
+
+
+class TempMediaMixin:
+    """Point MEDIA_ROOT and CDN_STATE_DIR at throwaway directories for one test class."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls._tmp = tempfile.mkdtemp(prefix='portal_tests_')
+        cls.media_root = os.path.join(cls._tmp, 'media')
+        os.makedirs(cls.media_root)
+        cls._settings = override_settings(MEDIA_ROOT=cls.media_root,
+                                          CDN_STATE_DIR=os.path.join(cls._tmp, 'state'))
+        cls._settings.enable()
+        storage.invalidate_media_root()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._settings.disable()
+        storage.invalidate_media_root()
+        shutil.rmtree(cls._tmp, ignore_errors=True)
+
+
+# ── Media root ────────────────────────────────────────────────────────────────
+
+class MediaRootTests(TempMediaMixin, TestCase):
+    def test_generation_bumped_only_on_commit(self):
+        # Back-date the stamp: mtimes only move in clock ticks of a few ms
+        os.utime(storage._generation_file(), ns=(0, 0))
+        before = storage._read_generation()
+        new_root = os.path.join(self._tmp, 'drive')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            site = SiteSettings.get()
+            site.media_root = new_root
+            site.save()
+            # Other workers must not reload before the new row is visible to them
+            self.assertEqual(storage._read_generation(), before)
+        self.assertTrue(callbacks)
+        self.assertNotEqual(storage._read_generation(), before)
+        self.assertEqual(storage._get_media_root(), new_root)
+
+
+# ── Page cache ────────────────────────────────────────────────────────────────
+
+class PageCacheTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        # Each test runs in a transaction that never commits, so bump() only queues
+        path = pagecache._generation_file('content')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'a').close()
+        os.utime(path, ns=(0, 0))
+
+    def test_bump_waits_for_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Films')  # Bumps 'categories' from post_save
+            pagecache.bump('content')
+            self.assertEqual(pagecache.generation('content'), 0)
+        self.assertNotEqual(pagecache.generation('content'), 0)
+
+    def test_admin_action_bumps_on_commit(self):
+        films = Category.objects.create(name='Films')
+        ContentItem.objects.create(title='Clip', category=films,
+                                   file=SimpleUploadedFile('clip.mp4', b'x' * 10))
+        admin = site._registry[ContentItem]
+        with self.captureOnCommitCallbacks() as callbacks:
+            admin.make_inactive(None, ContentItem.objects.all())
+        self.assertEqual(pagecache.generation('content'), 0)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(pagecache.generation('content'), 0)
+
+
+# ── Category aggregates ───────────────────────────────────────────────────────
+
+class CategoryAggregateTests(TempMediaMixin, TestCase):
+    def totals(self, category):
+        category.refresh_from_db()
+        return category.active_item_count, category.active_total_size
+
+    def test_save_moves_item_between_totals(self):
+        films = Category.objects.create(name='Films')
+        music = Category.objects.create(name='Music')
+        item = ContentItem.objects.create(title='Clip', category=films,
+                                          file=SimpleUploadedFile('clip.mp4', b'x' * 1000))
+        self.assertEqual(self.totals(films), (1, 1000))
+
+        item.category = music
+        item.save()
+        self.assertEqual(self.totals(films), (0, 0))
+        self.assertEqual(self.totals(music), (1, 1000))
+
+        item.is_active = False
+        item.save()
+        self.assertEqual(self.totals(music), (0, 0))
+
+    def test_stale_instance_applies_delta_from_stored_row(self):
+        films = Category.objects.create(name='Films')
+        music = Category.objects.create(name='Music')
+        item = ContentItem.objects.create(title='Clip', category=films,
+                                          file=SimpleUploadedFile('clip.mp4', b'x' * 1000))
+        # Another request deactivated the item after this copy was loaded
+        stale = ContentItem.objects.get(pk=item.pk)
+        item.is_active = False
+        item.save()
+        stale.category = music
+        stale.save()
+        self.assertEqual(self.totals(films), (0, 0))
+        self.assertEqual(self.totals(music), (1, 1000))
+
+
+# ── Search ────────────────────────────────────────────────────────────────────
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+class SearchTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        self.films = Category.objects.create(name='Films')
+        self.music = Category.objects.create(name='Music')
+        self.wars = self.item('Star Wars', self.films)
+        self.sky = self.item('Night Sky', self.films, description='A guide to the stars')
+        self.song = self.item('Starlight', self.music)
+        self.item('River City', self.films)
+
+    def item(self, title, category, description=''):
+        return ContentItem.objects.create(title=title, category=category, description=description,
+                                          file=SimpleUploadedFile(f'{title}.mp4', b'x'))
+
+    def titles(self, queryset):
+        return [item.title for item in queryset]
+
+    def test_prefix_terms_ranked_with_title_matches_first(self):
+        items = ContentItem.objects.filter(category=self.films)
+        self.assertEqual(self.titles(search.search_items(items, 'sta')), ['Star Wars', 'Night Sky'])
+        self.assertEqual(self.titles(search.search_items(items, 'star wa')), ['Star Wars'])
+        self.assertEqual(self.titles(search.search_items(items, 'nothing')), [])
+
+    def test_category_page_searches_its_own_items(self):
+        response = self.client.get(f'/category/{self.films.slug}/?q=star')
+        self.assertEqual(self.titles(response.context['items']), ['Star Wars', 'Night Sky'])
+
+    def test_api_files_filters_by_query(self):
+        response = self.client.get('/api/files/?q=star&fields=id')
+        self.assertEqual(sorted(row['id'] for row in response.json()['items']),
+                         sorted([self.wars.pk, self.sky.pk, self.song.pk]))
+
+    def test_only_a_rename_rewrites_the_category_column(self):
+        self.films.order = 5
+        with CaptureQueriesContext(connection) as queries:
+            self.films.save()
+        self.assertFalse([q for q in queries if search.FTS_TABLE in q['sql']])
+
+        self.films.name = 'Cinema'
+        self.films.save()
+        self.assertEqual(self.titles(search.search_items(ContentItem.objects.all(), 'cinema river')), ['River City'])
+
+
+# ── Deduplication ─────────────────────────────────────────────────────────────
+
+class DedupTests(TempMediaMixin, TestCase):
+    DATA = b'same bytes' * 1000
+
+    def setUp(self):
+        self.films = Category.objects.create(name='Films')
+
+    def upload(self, name):
+        return ContentItem.objects.create(title=name, category=self.films,
+                                          file=SimpleUploadedFile(name, self.DATA))
+
+    def dedupe(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return dedup.dedupe_library()
+
+    def test_identical_uploads_share_one_file(self):
+        first, second = self.upload('a.mp4'), self.upload('b.mp4')
+        self.assertTrue(first.managed_file)
+        second_path = second.file.path
+        self.assertEqual(self.dedupe(), (2, len(self.DATA)))
+        second.refresh_from_db()
+        self.assertEqual(second.file.name, ContentItem.objects.get(pk=first.pk).file.name)
+        self.assertFalse(os.path.exists(second_path))
+
+    def test_files_registered_in_place_are_never_touched(self):
+        # What import_library does for a tree already inside the media root
+        path = os.path.join(self.media_root, 'My Films', 'copy.mp4')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'wb') as f:
+            f.write(self.DATA)
+        (imported,) = ContentItem.objects.bulk_create([
+            ContentItem(title='Copy', category=self.films, file='My Films/copy.mp4', file_size=len(self.DATA)),
+        ])
+        self.upload('a.mp4')
+        self.dedupe()
+        imported.refresh_from_db()
+        self.assertFalse(imported.managed_file)
+        self.assertIsNone(imported.blob_id)
+        self.assertEqual(imported.file.name, 'My Films/copy.mp4')
+        self.assertTrue(os.path.exists(path))
+
+        # Nor deleted when the last item using it goes
+        with self.captureOnCommitCallbacks(execute=True):
+            imported.delete()
+        self.assertTrue(os.path.exists(path))
+
+
+# ── Library import ────────────────────────────────────────────────────────────
+
+class ImportLibraryTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        self.source = tempfile.mkdtemp(prefix='usb_', dir=self._tmp)
+        self.addCleanup(shutil.rmtree, os.path.join(self.media_root, 'library'), ignore_errors=True)
+        self.film = self.write('Films/film.mp4', b'f' * 100)
+        self.write('Music/song.mp3', b's' * 100)
+
+    def write(self, name, data, mtime=1_000_000):
+        path = os.path.join(self.source, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def run_import(self):
+        call_command('import_library', self.source, '--defer-thumbnails', stdout=io.StringIO())
+
+    def jobs(self):
+        return sorted(Job.objects.values_list('kind', 'item__title'))
+
+    def test_rerun_queues_what_an_interrupted_run_left(self):
+        self.run_import()
+        expected = [('audio_metadata', 'song'), ('thumbnail', 'song'), ('video_preview', 'film')]
+        self.assertEqual(self.jobs(), expected)
+
+        # Queued again while pending would run twice
+        self.run_import()
+        self.assertEqual(self.jobs(), expected)
+
+        # The worker never got to them
+        Job.objects.all().delete()
+        self.run_import()
+        self.assertEqual(self.jobs(), expected)
+
+        # Done: nothing left to queue
+        Job.objects.all().delete()
+        ContentItem.objects.update(thumbnail='thumbnails/x.jpg', duration='1:00')
+        self.run_import()
+        self.assertEqual(self.jobs(), [])
+
+    def test_changed_file_is_found_after_an_admin_edit(self):
+        self.run_import()
+        Job.objects.all().delete()
+        ContentItem.objects.update(thumbnail='thumbnails/x.jpg', duration='1:00')
+        film = ContentItem.objects.get(title='film')
+        # Edited in the admin after the import: updated_at is later than any file time below
+        ContentItem.objects.filter(pk=film.pk).update(
+            updated_at=timezone.now(), thumbnail='thumbnails/old.jpg', duration='1:00',
+        )
+
+        # Replaced by a file of the same size
+        self.write('Films/film.mp4', b'g' * 100, mtime=2_000_000)
+        self.run_import()
+        film.refresh_from_db()
+        self.assertEqual(film.file_mtime, 2_000_000)
+        self.assertEqual((film.thumbnail.name, film.duration), ('', ''))
+        self.assertEqual(self.jobs(), [('video_preview', 'film')])
+
+    def test_storage_index_counts_the_linked_tree(self):
+        self.run_import()
+        link = os.path.join('library', os.path.basename(self.source))
+        # A link back into the media root would count its files twice, or loop
+        os.symlink(self.media_root, os.path.join(self.media_root, 'library', 'loop'))
+        storage_index.scan(self.media_root, full=True)
+        self.assertEqual(storage_index.totals(self.media_root)['files'], 2)
+        self.assertEqual(storage_index.usage_by_top_dir(self.media_root), {'library': 0, link: 200})
+
+        # Incremental: a new file in the linked tree is found through the link
+        self.write('Films/other.mp4', b'o' * 50, mtime=time.time() + 10)
+        os.utime(os.path.join(self.source, 'Films'), (time.time() + 10,) * 2)
+        storage_index.scan(self.media_root)
+        self.assertEqual(storage_index.usage_by_top_dir(self.media_root), {'library': 0, link: 250})
+
+
+# ── Job worker ────────────────────────────────────────────────────────────────
+
+class RunWorkerOnceTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        self.job = Job.enqueue('no_such_handler')
+        Job.objects.filter(pk=self.job.pk).update(status=Job.RUNNING)
+
+    def run_once(self):
+        call_command('run_worker', '--once', stdout=io.StringIO())
+        self.job.refresh_from_db()
+
+    def hold_worker_lock(self):
+        path = os.path.join(self._tmp, 'state', 'worker.lock')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        worker = open(path, 'a+')
+        fcntl.flock(worker, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return worker
+
+    def test_leaves_jobs_of_a_running_worker_alone(self):
+        with self.hold_worker_lock():
+            self.run_once()
+        self.assertEqual(self.job.status, Job.RUNNING)
+        self.assertEqual(self.job.attempts, 0)
+
+    def test_requeues_jobs_when_no_worker_is_running(self):
+        self.run_once()
+        # Requeued, then claimed: it has no handler, so it waits for a retry
+        self.assertEqual(self.job.status, Job.PENDING)
+        self.assertEqual(self.job.attempts, 1)
+
+    def test_second_daemon_waits_for_the_lock(self):
+        started, stop = threading.Event(), threading.Event()
+        with mock.patch.object(jobs, 'LOCK_RETRY', 0.05), \
+                mock.patch.object(jobs, '_run_threads', lambda *args: started.set()):
+            with self.hold_worker_lock(), self.assertLogs('portal.jobs', 'WARNING'):
+                daemon = threading.Thread(target=jobs.run_worker, kwargs={'stop_event': stop})
+                daemon.start()
+                self.assertFalse(started.wait(0.3))  # No threads, no recover() while the other runs
+            # The other worker exited: this one takes over
+            self.assertTrue(started.wait(5))
+            daemon.join(5)
+        self.assertFalse(daemon.is_alive())
+
+
+# ── Heartbeat ─────────────────────────────────────────────────────────────────
+
+class _StubPlatform(BaseHTTPRequestHandler):
+    """Records heartbeat POSTs and answers with the server's current `status`."""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.received.append((self.headers['X-CDN-API-Key'], json.loads(body)))
+        self.send_response(self.server.status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def _contend_for_heartbeat(barrier):
+    """Runs in a forked process: send one heartbeat if this process wins the lock."""
+    heartbeat._lock_file = None  # Forked from the test process, which may hold its own
+    leader = heartbeat._acquire_leadership()
+    barrier.wait()  # Every process has tried while the leader still holds the lock
+    if leader:
+        sender = heartbeat._Sender()
+        sender.push({'pid': os.getpid()})
+        sender.flush()
+    os._exit(0)
+
+
+@override_settings(CDN_API_KEY='secret', CDN_HEARTBEAT_INTERVAL=60, CDN_HEARTBEAT_QUEUE_SIZE=3)
+class HeartbeatTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _StubPlatform)
+        self.server.received = []
+        self.server.status = 200
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        settings = override_settings(CDN_PLATFORM_URL=f'http://127.0.0.1:{self.server.server_port}/')
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def sender(self):
+        sender = heartbeat._Sender()
+        self.addCleanup(sender.session.close)
+        return sender
+
+    def test_one_process_per_node_sends(self):
+        ctx = multiprocessing.get_context('fork')
+        barrier = ctx.Barrier(3)
+        procs = [ctx.Process(target=_contend_for_heartbeat, args=(barrier,)) for _ in range(3)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join(10)
+        self.assertEqual(len(self.server.received), 1)
+        key, payload = self.server.received[0]
+        self.assertEqual(key, 'secret')
+        self.assertIn(payload['pid'], [p.pid for p in procs])
+
+    def test_started_only_by_the_wsgi_entry_point(self):
+        with mock.patch('portal.heartbeat.start') as start, mock.patch('portal.apps._auto_configure_storage'):
+            apps.get_app_config('portal').ready()  # As in every management command
+            start.assert_not_called()
+            sys.modules.pop('cdnnode.wsgi', None)
+            importlib.import_module('cdnnode.wsgi')  # As gunicorn and runserver do
+        start.assert_called_once_with()
+
+    def test_backs_off_after_server_error(self):
+        self.server.status = 503
+        sender = self.sender()
+        sender.push({'seq': 0})
+        with self.assertLogs('portal.heartbeat', 'ERROR'):
+            sender.flush()
+        self.assertEqual(sender.failures, 1)
+        self.assertGreater(sender.next_attempt - time.monotonic(), 55)
+        sender.flush()  # Inside the backoff window: nothing is sent
+        self.assertEqual(len(self.server.received), 1)
+        self.assertEqual(len(sender.queue), 1)
+
+        sender.next_attempt = 0
+        with self.assertLogs('portal.heartbeat', 'ERROR'):
+            sender.flush()
+        self.assertEqual(sender.failures, 2)
+        self.assertGreater(sender.next_attempt - time.monotonic(), 115)  # Doubled
+
+    def test_backs_off_when_connection_refused(self):
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            port = s.getsockname()[1]  # Nothing listens here once closed
+        sender = self.sender()
+        sender.push({'seq': 0})
+        with override_settings(CDN_PLATFORM_URL=f'http://127.0.0.1:{port}'), \
+                self.assertLogs('portal.heartbeat', 'ERROR') as logs:
+            sender.flush()
+        self.assertIn('cannot reach platform', logs.output[0])
+        self.assertEqual(sender.failures, 1)
+        self.assertGreater(sender.next_attempt, time.monotonic())
+        self.assertEqual(list(sender.queue), [{'seq': 0}])
+
+    def test_queue_keeps_newest_and_drains_in_order(self):
+        self.server.status = 500
+        sender = self.sender()
+        with self.assertLogs('portal.heartbeat', 'ERROR'):
+            for seq in range(5):
+                sender.push({'seq': seq})
+                sender.next_attempt = 0
+                sender.flush()
+        self.assertEqual([p['seq'] for p in sender.queue], [2, 3, 4])
+
+        self.server.status = 200
+        self.server.received.clear()
+        sender.next_attempt = 0
+        sender.flush()
+        self.assertEqual([payload['seq'] for _, payload in self.server.received], [2, 3, 4])
+        self.assertFalse(sender.queue)
+        self.assertEqual(sender.failures, 0)
+
+
+# ── Versioned media URLs ──────────────────────────────────────────────────────
+
+class MediaVersionTests(TempMediaMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for name in ('thumbnails/1_thumb.jpg', 'films/clip.mp4'):
+            os.makedirs(os.path.join(cls.media_root, os.path.dirname(name)), exist_ok=True)
+            with open(os.path.join(cls.media_root, name), 'wb') as f:
+                f.write(b'x' * 100)
+
+    def get(self, name, version):
+        return self.client.get(f'/media/{name}?v={version}', HTTP_IF_NONE_MATCH=f'"{version}"')
+
+    def test_current_version_revalidates_as_immutable(self):
+        name = 'thumbnails/1_thumb.jpg'
+        response = self.get(name, conditional.media_version(name))
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['Cache-Control'], conditional.IMMUTABLE)
+
+    def test_signed_version_revalidates_without_query_or_disk_read(self):
+        name = 'films/clip.mp4'
+        version = conditional.media_version(name, 'b' * 64)
+        with CaptureQueriesContext(connection) as queries, \
+                mock.patch('portal.delivery.resolve_media_path', side_effect=AssertionError('disk read')):
+            response = self.get(name, version)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['Cache-Control'], conditional.IMMUTABLE)
+        self.assertEqual(len(queries), 0)
+
+        # Signed for another name, or not by this server: the file's own validators
+        other = conditional.media_version('films/other.mp4', 'b' * 64)
+        forged = 'b' * conditional.VERSION_LENGTH + 'c' * conditional.VERSION_LENGTH
+        for version in (other, forged):
+            response = self.get(name, version)
+            self.addCleanup(response.close)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('immutable', response['Cache-Control'])
+
+    def test_current_item_version_is_served_immutable(self):
+        name = 'films/clip.mp4'
+        ContentBlob.objects.create(hash='b' * 64, name=name, size=100)
+        response = self.client.get(f"/media/{name}?v={conditional.media_version(name, 'b' * 64)}")
+        self.addCleanup(response.close)
+        self.assertEqual(response['Cache-Control'], conditional.IMMUTABLE)
+
+        # Signed, but for content the file no longer holds
+        response = self.client.get(f"/media/{name}?v={conditional.media_version(name, 'd' * 64)}")
+        self.addCleanup(response.close)
+        self.assertNotIn('immutable', response['Cache-Control'])
+
+    def test_missing_file_is_404_whatever_the_version(self):
+        response = self.get('films/gone.mp4', 'a' * conditional.VERSION_LENGTH)
+        self.assertEqual(response.status_code, 404)
+
+    def test_unknown_version_gets_the_files_own_validators(self):
+        response = self.get('films/clip.mp4', 'a' * conditional.VERSION_LENGTH)
+        self.addCleanup(response.close)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('immutable', response['Cache-Control'])
+        self.assertNotEqual(response['ETag'], f'"{"a" * conditional.VERSION_LENGTH}"')
+
+
+# ── HLS ───────────────────────────────────────────────────────────────────────
+
+@override_settings(CDN_FFMPEG=sys.executable)  # Never run: the stream below is already being packaged
+class HlsTests(TempMediaMixin, TestCase):
+    def setUp(self):
+        films = Category.objects.create(name='Films')
+        self.item = ContentItem.objects.create(title='Clip', category=films, file='films/clip.mp4')
+        self.stream = os.path.join(hls.cache_root(), hls.stream_key(self.item))
+        os.makedirs(self.stream, exist_ok=True)
+        self.addCleanup(shutil.rmtree, hls.cache_root(), True)
+        # Another worker's ffmpeg: a live pid holds the packaging lock
+        with open(os.path.join(self.stream, hls._LOCK), 'w') as f:
+            f.write(str(os.getpid()))
+
+    def test_playlist_answers_503_without_holding_the_worker(self):
+        started = time.monotonic()
+        with self.assertLogs('django.request', 'ERROR'):
+            response = self.client.get(f'/item/{self.item.pk}/hls/index.m3u8')
+        self.assertLess(time.monotonic() - started, hls.WAIT_SECONDS + 1)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_unreadable_file_is_probed_once_off_the_request(self):
+        os.unlink(os.path.join(self.stream, hls._LOCK))
+        probed = []
+
+        def probe(path):
+            probed.append(threading.current_thread())
+            return None
+
+        with mock.patch.object(hls.video, 'available', return_value=True), \
+                mock.patch.object(hls.video, 'probe', side_effect=probe), \
+                mock.patch.object(hls, 'prune') as prune, self.assertLogs('portal.hls', 'WARNING'):
+            with self.assertRaisesMessage(hls.Unavailable, 'Packaging failed'):
+                hls.playlist(self.item)
+            self.assertTrue(os.path.exists(os.path.join(self.stream, hls._FAILED)))
+            for thread in threading.enumerate():
+                if thread.name == f'hls-{self.item.pk}':
+                    thread.join()
+            self.assertFalse(hls._running(self.stream))
+            # Later requests see the marker and don't probe again
+            with self.assertRaisesMessage(hls.Unavailable, 'Packaging failed recently'):
+                hls.playlist(self.item)
+        self.assertEqual(len(probed), 1)
+        self.assertIsNot(probed[0], threading.current_thread())
+        prune.assert_not_called()
+
+    def test_only_segments_are_served(self):
+        for name in ('seg00000.ts', 'ffmpeg.log', hls._FAILED, 'seg00001.ts.tmp'):
+            with open(os.path.join(self.stream, name), 'wb') as f:
+                f.write(b'x')
+        base = f'/media/{hls.CACHE_DIR}/{hls.stream_key(self.item)}/'
+        for name, status in (('seg00000.ts', 200), ('ffmpeg.log', 404), (hls._LOCK, 404),
+                             (hls._FAILED, 404), ('seg00001.ts.tmp', 404)):
+            with self.subTest(name=name):
+                response = self.client.get(base + name)
+                self.addCleanup(response.close)
+                self.assertEqual(response.status_code, status)
+
+    def test_upload_parts_are_not_served(self):
+        os.makedirs(os.path.join(self.media_root, '.uploads'), exist_ok=True)
+        with open(os.path.join(self.media_root, '.uploads', 'abc.part'), 'wb') as f:
+            f.write(b'x')
+        self.assertEqual(self.client.get('/media/.uploads/abc.part').status_code, 404)
+
+
+# ── Byte ranges on /media/ ────────────────────────────────────────────────────
+
+class MediaRangeTests(TempMediaMixin, TestCase):
+    """Seeking around a multi-GB file, created sparse so it costs no disk."""
+
+    SIZE = 6 * 1024 ** 3 + 12345
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.path = os.path.join(cls.media_root, 'films', 'big.mkv')
+        os.makedirs(os.path.dirname(cls.path))
+        with open(cls.path, 'wb') as f:
+            f.truncate(cls.SIZE)
+            # Recognisable bytes at a few offsets; the rest reads as zeros
+            for offset in (0, 4 * 1024 ** 3, cls.SIZE - 16):
+                f.seek(offset)
+                f.write(f'@{offset:015d}'.encode())
+        st = os.stat(cls.path)
+        cls.etag = '"%x-%x"' % (int(st.st_mtime), st.st_size)
+        cls.last_modified = http_date(st.st_mtime)
+
+    def get(self, method='get', **headers):
+        response = getattr(self.client, method)('/media/films/big.mkv', **headers)
+        self.addCleanup(response.close)
+        return response
+
+    def body(self, response):
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_single_range(self):
+        start = 4 * 1024 ** 3
+        response = self.get(HTTP_RANGE=f'bytes={start}-{start + 15}')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes {start}-{start + 15}/{self.SIZE}')
+        self.assertEqual(response['Content-Length'], '16')
+        self.assertEqual(self.body(response), f'@{start:015d}'.encode())
+
+    def test_open_ended_range(self):
+        start = self.SIZE - 16
+        response = self.get(HTTP_RANGE=f'bytes={start}-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.body(response), f'@{start:015d}'.encode())
+
+    def test_suffix_range(self):
+        response = self.get(HTTP_RANGE='bytes=-16')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes {self.SIZE - 16}-{self.SIZE - 1}/{self.SIZE}')
+        self.assertEqual(self.body(response), f'@{self.SIZE - 16:015d}'.encode())
+
+    def test_multipart_ranges_are_merged(self):
+        far = 4 * 1024 ** 3
+        # 0-9 and 5-15 overlap, 16-19 is adjacent: one part for 0-19, one for the far range
+        response = self.get(HTTP_RANGE=f'bytes=0-9,5-15,16-19,{far}-{far + 15}')
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges; boundary='))
+        body = self.body(response)
+        self.assertEqual(int(response['Content-Length']), len(body))
+        self.assertEqual(body.count(b'Content-Range: '), 2)
+        self.assertIn(f'Content-Range: bytes 0-19/{self.SIZE}'.encode(), body)
+        self.assertIn(f'Content-Range: bytes {far}-{far + 15}/{self.SIZE}\r\n\r\n@{far:015d}\r\n'.encode(), body)
+
+    def test_unsatisfiable_range(self):
+        response = self.get(HTTP_RANGE=f'bytes={self.SIZE}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{self.SIZE}')
+
+    def test_malformed_range_is_ignored(self):
+        response = self.get(HTTP_RANGE='bytes=abc')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(response['Content-Length']), self.SIZE)
+
+    def test_if_range(self):
+        cases = [
+            (self.etag, 206),
+            (self.last_modified, 206),
+            ('"0-0"', 200),  # Stale ETag: the file changed, send all of it
+            (http_date(0), 200),
+        ]
+        for validator, status in cases:
+            with self.subTest(validator=validator):
+                response = self.get(HTTP_RANGE='bytes=0-15', HTTP_IF_RANGE=validator)
+                self.assertEqual(response.status_code, status)
+                if status == 200:
+                    self.assertEqual(int(response['Content-Length']), self.SIZE)
+
+    def test_head_with_range(self):
+        response = self.get('head', HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{self.SIZE}')
+        self.assertEqual(response['Content-Length'], '100')
+
+    def test_too_many_ranges_send_whole_file(self):
+        spec = ','.join(f'{i * 1000}-{i * 1000 + 9}' for i in range(delivery.MAX_RANGES + 1))
+        response = self.get(HTTP_RANGE=f'bytes={spec}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(int(response['Content-Length']), self.SIZE)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+
+# ── Media telemetry ───────────────────────────────────────────────────────────
+
+class MediaBytesTests(TempMediaMixin, TestCase):
+    """Bytes sent are counted as they go out, not from Content-Length."""
+
+    SIZE = 1024 * 1024
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        with open(os.path.join(cls.media_root, 'song.mp3'), 'wb') as f:
+            f.write(os.urandom(cls.SIZE))
+
+    def sent_by(self, response, consume):
+        before = telemetry._totals['bytes']
+        consume(response)
+        response.close()
+        return telemetry._totals['bytes'] - before
+
+    def test_client_stopping_early_counts_what_was_read(self):
+        response = self.client.get('/media/song.mp3')
+        sent = self.sent_by(response, lambda r: next(iter(r.streaming_content)))
+        self.assertEqual(sent, response.block_size)
+
+    def test_sendfile_counts_what_the_socket_sent(self):
+        # Called directly: the test client would replace file_to_stream with an iterator
+        request = RequestFactory().get('/media/song.mp3', HTTP_RANGE='bytes=1000-')
+        response = delivery.serve_media(request, 'song.mp3')
+        filelike = response.file_to_stream
+        count = self.SIZE - 1000 - 4096  # As if the client went away before the end
+
+        def sendfile(response):
+            # What gunicorn's wsgi.file_wrapper does with a file that has fileno()
+            server, client = socket.socketpair()
+            with server, client:
+                drain = threading.Thread(target=lambda: [None for _ in iter(lambda: client.recv(65536), b'')])
+                drain.start()
+                offset = os.lseek(filelike.fileno(), 0, os.SEEK_CUR)
+                server.sendfile(filelike, offset=offset, count=count)
+                os.lseek(filelike.fileno(), offset, os.SEEK_SET)
+                server.shutdown(socket.SHUT_WR)
+                drain.join()
+
+        self.assertEqual(self.sent_by(response, sendfile), count)
+
+    def test_multipart_counts_chunks_yielded(self):
+        response = self.client.get('/media/song.mp3', HTTP_RANGE='bytes=0-99,5000-5099')
+        sent = self.sent_by(response, lambda r: b''.join(r.streaming_content))
+        self.assertEqual(sent, int(response['Content-Length']))
+
+    def test_closing_twice_counts_once(self):
+        response = self.client.get('/media/song.mp3')
+        self.assertEqual(self.sent_by(response, lambda r: b''.join(r.streaming_content)), self.SIZE)
+        before = telemetry._totals['bytes']
+        response.close()
+        self.assertEqual(telemetry._totals['bytes'], before)
+
+    def test_idle_worker_skips_snapshot(self):
+        path = os.path.join(telemetry._metrics_dir(), f'{os.getpid()}.json')
+        written = telemetry._snapshot_if_changed(None)
+        self.assertTrue(os.path.exists(path))
+        os.remove(path)
+        self.assertEqual(telemetry._snapshot_if_changed(written), written)
+        self.assertFalse(os.path.exists(path))
+        telemetry.record_bytes(1)
+        telemetry._snapshot_if_changed(written)
+        self.assertTrue(os.path.exists(path))
+
+
+# ── Resumable uploads ─────────────────────────────────────────────────────────
+
+@override_settings(CDN_UPLOAD_MAX_SIZE=100, CDN_UPLOAD_MAX_CHUNK=8)
+class UploadTests(TempMediaMixin, TestCase):
+    DATA = b'0123456789abcdef'
+
+    def setUp(self):
+        self.films = Category.objects.create(name='Films')
+        self.staff = get_user_model().objects.create_user('staff', password='x', is_staff=True)
+        self.client.force_login(self.staff)
+
+    def start(self, size=len(DATA), **data):
+        return self.client.post('/api/uploads/', json.dumps({'filename': 'clip.mp4', 'size': size,
+                                                             'category': 'films', **data}),
+                                content_type='application/json')
+
+    def send(self, upload_id, offset, chunk):
+        return self.client.patch(f'/api/uploads/{upload_id}/', chunk,
+                                 content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_chunks_complete_into_an_item(self):
+        response = self.start()
+        self.assertEqual(response.status_code, 201)
+        upload = Upload.objects.get(pk=response.json()['id'])
+        self.assertTrue(os.path.exists(upload.temp_path))
+
+        self.assertEqual(self.send(upload.id, 0, self.DATA[:8])['Upload-Offset'], '8')
+        self.assertEqual(self.client.head(f'/api/uploads/{upload.id}/')['Upload-Offset'], '8')
+        self.assertEqual(self.send(upload.id, 8, self.DATA[8:]).status_code, 204)
+
+        upload.refresh_from_db()
+        item = upload.item
+        self.assertEqual((item.title, item.category, item.file_size), ('clip', self.films, len(self.DATA)))
+        self.assertTrue(item.managed_file)
+        with open(item.file.path, 'rb') as f:
+            self.assertEqual(f.read(), self.DATA)
+        # Moved into place, not copied
+        self.assertFalse(os.path.exists(upload.temp_path))
+        self.assertEqual(self.send(upload.id, 16, b'x').status_code, 409)
+
+    def test_offset_mismatch_is_409(self):
+        upload_id = self.start().json()['id']
+        self.send(upload_id, 0, self.DATA[:4])
+        # A retried chunk that already arrived, and one that skips ahead
+        for offset in (0, 6):
+            response = self.send(upload_id, offset, self.DATA[offset:offset + 2])
+            self.assertEqual(response.status_code, 409)
+            self.assertIn('upload is at 4', response.json()['error'])
+
+    def test_size_and_chunk_limits_are_413(self):
+        self.assertEqual(self.start(size=101).status_code, 413)
+        self.assertFalse(Upload.objects.exists())
+        upload_id = self.start().json()['id']
+        self.assertEqual(self.send(upload_id, 0, self.DATA[:9]).status_code, 413)
+        self.assertEqual(self.client.head(f'/api/uploads/{upload_id}/')['Upload-Offset'], '0')
+
+    def test_delete_and_prune_remove_the_part_file(self):
+        deleted = Upload.objects.get(pk=self.start().json()['id'])
+        self.assertEqual(self.client.delete(f'/api/uploads/{deleted.id}/').status_code, 204)
+        self.assertFalse(os.path.exists(deleted.temp_path))
+        self.assertFalse(Upload.objects.filter(pk=deleted.pk).exists())
+
+        stale = Upload.objects.get(pk=self.start().json()['id'])
+        fresh = Upload.objects.get(pk=self.start().json()['id'])
+        Upload.objects.filter(pk=stale.pk).update(updated_at=timezone.now() - timedelta(hours=49))
+        self.assertEqual(uploads.prune(), 1)
+        self.assertFalse(os.path.exists(stale.temp_path))
+        self.assertTrue(os.path.exists(fresh.temp_path))
+        self.assertEqual(list(Upload.objects.values_list('pk', flat=True)), [fresh.pk])
+
+    def test_anonymous_requests_are_403(self):
+        upload_id = self.start().json()['id']
+        self.client.logout()
+        self.assertEqual(self.start().status_code, 403)
+        self.assertEqual(self.send(upload_id, 0, self.DATA[:4]).status_code, 403)
+        self.assertEqual(self.client.delete(f'/api/uploads/{upload_id}/').status_code, 403)
+        self.assertTrue(Upload.objects.filter(pk=upload_id).exists())
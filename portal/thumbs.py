@@ -0,0 +1,134 @@
+"""
+Responsive variants of card images.
+
+Category covers, announcement images and item thumbnails used to be linked
+at their stored size in every grid: a phone on a slow link fetched a full
+cover photo for a 148 px card. Templates now render them with {% picture %}
+(portal/templatetags/portal_media.py). That tag lists resized copies at
+WIDTHS in a srcset, in CDN_THUMB_FORMATS (WebP by default) with a JPEG
+fallback, so the browser picks the smallest one that fills the card.
+
+A variant's name is derived from its source, so nothing has to be recorded:
+
+    variants/<width>/<source name>.<format>
+
+Nothing is generated up front. The first request for a variant that isn't
+on disk yet makes serve_media() call generate(), which resizes the source
+into the media root. Every later request is an ordinary file hit. Sources
+are write-once (a replaced image always gets a new name), so variants
+never go stale and are served immutable like the sources.
+"""
+import io
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from django.http import Http404
+from PIL import features
+
+from portal import imaging
+
+logger = logging.getLogger(__name__)
+
+VARIANT_DIR = 'variants/'
+WIDTHS = (96, 192, 384, 768)
+
+# Only these are resized on request, so a URL can't make us decode arbitrary files
+SOURCE_DIRS = ('thumbnails/', 'covers/', 'announcements/')
+
+# Encoder quality per format; WebP and AVIF hold up at lower settings than JPEG
+QUALITY = {'jpeg': 80, 'webp': 75, 'avif': 55}
+_PIL_FORMATS = {'jpeg': 'JPEG', 'webp': 'WEBP', 'avif': 'AVIF'}
+
+
+def formats():
+    """Modern formats to offer before the JPEG fallback, best first (the ones this Pillow can encode)."""
+    return [fmt for fmt in settings.CDN_THUMB_FORMATS if fmt in QUALITY and fmt != 'jpeg' and features.check(fmt)]
+
+
+def variant_name(source, width, fmt):
+    return f'{VARIANT_DIR}{width}/{source}.{fmt}'
+
+
+def parse(name):
+    """(source, width, format) for a variant name, or None if `name` isn't one we make."""
+    if not name.startswith(VARIANT_DIR):
+        return None
+    width, _, rest = name[len(VARIANT_DIR):].partition('/')
+    source, _, fmt = rest.rpartition('.')
+    if not width.isdigit() or int(width) not in WIDTHS or fmt not in QUALITY:
+        return None
+    if not source.startswith(SOURCE_DIRS) or '..' in source.split('/'):
+        return None
+    if fmt != 'jpeg' and fmt not in formats():
+        return None
+    return source, int(width), fmt
+
+
+def srcset(field_file, fmt):
+    """srcset attribute value listing every width of `field_file` in `fmt`."""
+    from portal import conditional
+    storage = field_file.storage
+    entries = []
+    for width in WIDTHS:
+        name = variant_name(field_file.name, width, fmt)
+        entries.append(f'{storage.url(name)}?v={conditional.media_version(name)} {width}w')
+    return ', '.join(entries)
+
+
+def default_url(field_file, width=WIDTHS[2]):
+    """URL of the JPEG variant used as <img src> by browsers that ignore srcset."""
+    from portal import conditional
+    name = variant_name(field_file.name, width, 'jpeg')
+    return f'{field_file.storage.url(name)}?v={conditional.media_version(name)}'
+
+
+# ── Generation ────────────────────────────────────────────────────────────────
+
+def _render(source_path, width, fmt):
+    # Reduced, budget-checked decode (portal/imaging.py); never upscaled
+    with imaging.open_image(source_path, (width, 1)) as img:
+        img = imaging.shrink(img, (width, img.height))
+        if fmt == 'jpeg':
+            img = imaging.flatten(img)
+        elif img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if img.mode in ('LA', 'PA') else 'RGB')
+        output = io.BytesIO()
+        img.save(output, format=_PIL_FORMATS[fmt], quality=QUALITY[fmt])
+        return output.getvalue()
+
+
+def generate(name):
+    """
+    Create the variant `name` in the media root from its source. Returns its
+    filesystem path; raises Http404 if `name` isn't a variant or the source
+    is missing, unreadable or too large to decode.
+    """
+    from portal.delivery import resolve_media_path
+    from portal.storage import _get_media_root
+
+    parsed = parse(name)
+    if parsed is None:
+        raise Http404('Not a thumbnail variant')
+    source, width, fmt = parsed
+    source_path = resolve_media_path(source)
+    try:
+        data = _render(source_path, width, fmt)
+    except Exception as e:
+        logger.warning('Could not make %s from %s: %s', name, source, e)
+        raise Http404('Source image unreadable')
+
+    path = os.path.join(_get_media_root(), name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Concurrent requests for the same variant each write a temp file; the rename is atomic
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.variant-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return path
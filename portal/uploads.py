@@ -0,0 +1,160 @@
+"""
+Resumable chunked uploads, modelled on the tus protocol.
+
+A large file is sent as a series of PATCH requests, each carrying the next
+chunk and the offset it starts at. Chunks are streamed straight into
+<media root>/.uploads/<id>.part on the media drive in CHUNK_SIZE pieces, so
+memory use doesn't depend on the file or chunk size, and a dropped
+connection only loses the chunk in flight: the client asks for the current
+offset (HEAD) and carries on from there.
+
+When the last byte arrives the part file is handed to ContentItem.file.save()
+as an already-on-disk file; FileSystemStorage moves it into place with
+file_move_safe (a rename, since it's on the same drive) and picks a free
+name, and ContentItem.save() does the usual bookkeeping (file type, size,
+category totals, thumbnail job).
+
+The offset is the size of the part file on disk, never a stored counter, so
+it is always what was actually written. Abandoned uploads are removed by the
+worker after CDN_UPLOAD_EXPIRY_HOURS.
+"""
+import fcntl
+import os
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+
+from portal.storage import _get_media_root
+
+# Bytes copied from the request per read
+CHUNK_SIZE = 1024 * 1024
+
+TEMP_DIR = '.uploads'
+
+
+class UploadError(Exception):
+    """A request that can't be applied; status is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class _PartFile(File):
+    # FileSystemStorage moves files that have a temporary_file_path() instead of copying them
+    def temporary_file_path(self):
+        return self.name
+
+
+def create(category, filename, size, title='', user=None):
+    from portal.models import Upload
+    filename = os.path.basename(filename or '').strip()
+    if not filename:
+        raise UploadError('filename is required')
+    if size < 0:
+        raise UploadError('size must not be negative')
+    if size > settings.CDN_UPLOAD_MAX_SIZE:
+        raise UploadError(f'File is larger than the {settings.CDN_UPLOAD_MAX_SIZE} byte limit', status=413)
+
+    directory = os.path.join(_get_media_root(), TEMP_DIR)
+    os.makedirs(directory, exist_ok=True)
+    upload = Upload(
+        filename=filename[:255],
+        title=(title or os.path.splitext(filename)[0])[:255],
+        category=category,
+        size=size,
+        created_by=user if user is not None and user.is_authenticated else None,
+    )
+    upload.temp_path = os.path.join(directory, f'{upload.id}.part')
+    open(upload.temp_path, 'xb').close()
+    upload.save()
+    if size == 0:
+        _finish(upload)
+    return upload
+
+
+def offset(upload):
+    if upload.is_complete:
+        return upload.size
+    try:
+        return os.path.getsize(upload.temp_path)
+    except OSError:
+        raise UploadError('Upload data is missing; start again', status=410)
+
+
+def append(upload, stream, start, length):
+    """
+    Write `length` bytes from `stream` at `start`, which must equal the
+    current offset. Returns the new offset; finishes the upload at the end.
+    """
+    if upload.is_complete:
+        raise UploadError('Upload already complete', status=409)
+    if length is None:
+        raise UploadError('Content-Length is required', status=411)
+    if length > settings.CDN_UPLOAD_MAX_CHUNK:
+        raise UploadError(f'Chunks may be at most {settings.CDN_UPLOAD_MAX_CHUNK} bytes', status=413)
+    if start + length > upload.size:
+        raise UploadError('Chunk runs past the declared upload size')
+
+    try:
+        f = open(upload.temp_path, 'r+b')
+    except OSError:
+        raise UploadError('Upload data is missing; start again', status=410)
+    with f:
+        # One writer per upload; a retried chunk racing the original waits here
+        fcntl.flock(f, fcntl.LOCK_EX)
+        current = os.fstat(f.fileno()).st_size
+        if start != current:
+            raise UploadError(f'Offset mismatch: upload is at {current}', status=409)
+        f.seek(start)
+        remaining = length
+        try:
+            while remaining:
+                data = stream.read(min(CHUNK_SIZE, remaining))
+                if not data:
+                    break
+                f.write(data)
+                remaining -= len(data)
+        finally:
+            # Keep whatever arrived before the connection dropped; the client resumes from it
+            f.flush()
+            os.fsync(f.fileno())
+        new_offset = start + length - remaining
+
+    upload.save(update_fields=['updated_at'])
+    if new_offset == upload.size:
+        _finish(upload)
+    return new_offset
+
+
+def _finish(upload):
+    from portal.models import ContentItem
+    item = ContentItem(title=upload.title, category=upload.category)
+    with _PartFile(open(upload.temp_path, 'rb')) as part:
+        item.file.save(upload.filename, part, save=False)
+    item.managed_file = True
+    item.save()
+    upload.item = item
+    upload.save(update_fields=['item', 'updated_at'])
+    return item
+
+
+def abort(upload):
+    if not upload.is_complete:
+        try:
+            os.remove(upload.temp_path)
+        except OSError:
+            pass
+    upload.delete()
+
+
+def prune():
+    """Remove uploads untouched for CDN_UPLOAD_EXPIRY_HOURS. Returns the number removed."""
+    from portal.models import Upload
+    cutoff = timezone.now() - timedelta(hours=settings.CDN_UPLOAD_EXPIRY_HOURS)
+    stale = list(Upload.objects.filter(updated_at__lt=cutoff))
+    for upload in stale:
+        abort(upload)
+    return len(stale)
@@ -9,7 +9,13 @@ urlpatterns = [
     path('search/', views.search, name='search'),
     path('category/<slug:slug>/', views.category_detail, name='category'),
     path('item/<int:pk>/', views.item_detail, name='item_detail'),
+    path('item/<int:pk>/hls/index.m3u8', views.item_hls, name='item_hls'),
     # API
     path('api/stats/', views.api_stats, name='api_stats'),
     path('api/files/', views.api_files, name='api_files'),
+    path('api/popular/', views.api_popular, name='api_popular'),
+    path('api/cache/', views.api_cache, name='api_cache'),
+    path('api/metrics/', views.api_metrics, name='api_metrics'),
+    path('api/uploads/', views.api_upload_create, name='api_upload_create'),
+    path('api/uploads/<uuid:upload_id>/', views.api_upload, name='api_upload'),
 ]
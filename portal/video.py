@@ -0,0 +1,217 @@
+"""
+Video posters, durations and scrub previews, made with ffmpeg on the worker.
+
+A new video item gets a 'video_preview' job (ContentItem.save(), and
+import_library for the videos it registers; the admin can queue more).
+The worker runs process(item), which fills in:
+
+  duration  From the container (ffprobe, or ffmpeg's banner when only
+            ffmpeg is installed). A duration typed in by hand is kept.
+  poster    A representative frame, stored as the item's thumbnail. ffmpeg
+            seeks to POSTER_OFFSET of the running time, and its `thumbnail`
+            filter picks the frame closest to the average histogram of the
+            next POSTER_WINDOW frames. That skips black or mid-fade frames
+            without decoding the whole film, as scene detection would.
+  sprite    Optional (CDN_VIDEO_SPRITE_FRAMES, 0 = off). A grid of small
+            frames at equal intervals, one keyframe seek each, which the
+            player shows while scrubbing.
+
+Without ffmpeg (CDN_FFMPEG / CDN_FFPROBE) the job does nothing. Each ffmpeg
+run is single-threaded and killed after CDN_FFMPEG_TIMEOUT seconds, so the
+worker's CDN_WORKER_CONCURRENCY bounds how many run at once.
+"""
+import io
+import json
+import logging
+import re
+import shutil
+import subprocess
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Where the poster is looked for, as a fraction of the running time
+POSTER_OFFSET = 0.1
+# Frames the thumbnail filter compares (~4 s at 25 fps)
+POSTER_WINDOW = 100
+POSTER_MAX_WIDTH = 640
+
+# Scrub preview geometry: SPRITE_COLUMNS tiles of SPRITE_TILE per row
+SPRITE_TILE = (160, 90)
+SPRITE_COLUMNS = 10
+
+_DURATION_RE = re.compile(r'Duration: (\d+):(\d\d):(\d\d(?:\.\d+)?)')
+_STREAM_RE = re.compile(r'Stream #\d+:\d+[^:]*: (Video|Audio): (\w+)')
+
+
+def available():
+    return shutil.which(settings.CDN_FFMPEG) is not None
+
+
+def _run(args):
+    """Run ffmpeg with `args`; returns stdout bytes, or None if it failed or timed out."""
+    cmd = [settings.CDN_FFMPEG, '-hide_banner', '-loglevel', 'error', '-nostdin',
+           '-threads', '1', '-filter_threads', '1', *args]
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=settings.CDN_FFMPEG_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        logger.warning('ffmpeg timed out after %ss: %s', settings.CDN_FFMPEG_TIMEOUT, ' '.join(args))
+        return None
+    if result.returncode != 0 or not result.stdout:
+        return None
+    return result.stdout
+
+
+# ── Probing ───────────────────────────────────────────────────────────────────
+
+def probe(path):
+    """
+    {'duration': seconds, 'video_codec': name, 'audio_codec': name} for a
+    video file (any of them None if unknown or absent), or None if ffmpeg is
+    missing or can't read the file.
+    """
+    ffprobe = shutil.which(settings.CDN_FFPROBE)
+    try:
+        if ffprobe:
+            result = subprocess.run(
+                [ffprobe, '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path],
+                capture_output=True, timeout=settings.CDN_FFMPEG_TIMEOUT,
+            )
+            if result.returncode != 0:
+                return None
+            data = json.loads(result.stdout)
+            info = {'duration': None, 'video_codec': None, 'audio_codec': None}
+            for stream in data.get('streams', []):
+                key = f"{stream.get('codec_type')}_codec"
+                if key in info and info[key] is None:
+                    info[key] = stream.get('codec_name')
+            try:
+                info['duration'] = float(data.get('format', {}).get('duration'))
+            except (TypeError, ValueError):
+                pass  # Live streams and some raw formats have none
+            return info
+        if available():
+            # No ffprobe: `ffmpeg -i` prints the container duration before failing for lack of an output
+            result = subprocess.run(
+                [settings.CDN_FFMPEG, '-hide_banner', '-nostdin', '-i', path],
+                capture_output=True, timeout=settings.CDN_FFMPEG_TIMEOUT,
+            )
+            stderr = result.stderr.decode('utf-8', 'replace')
+            if 'Invalid data' in stderr or 'No such file' in stderr:
+                return None
+            info = {'duration': None, 'video_codec': None, 'audio_codec': None}
+            for kind, codec in _STREAM_RE.findall(stderr):
+                key = f'{kind.lower()}_codec'
+                if info[key] is None:
+                    info[key] = codec
+            match = _DURATION_RE.search(stderr)
+            if match:
+                h, m, s = match.groups()
+                info['duration'] = int(h) * 3600 + int(m) * 60 + float(s)
+            return info
+    except (subprocess.TimeoutExpired, ValueError) as e:
+        logger.warning('Could not probe %s: %s', path, e)
+    return None
+
+
+# ── Frames ────────────────────────────────────────────────────────────────────
+
+def extract_poster(path, duration=None):
+    """A representative frame as a JPEG ContentFile, or None."""
+    if not available():
+        return None
+    if duration is None:
+        info = probe(path)
+        duration = info and info['duration']
+    scale = f"scale='min({POSTER_MAX_WIDTH},iw)':-2"
+    # Short clips may have no frame at the offset; fall back to the start
+    offsets = [duration * POSTER_OFFSET, 0] if duration else [0]
+    for offset in offsets:
+        data = _run([
+            '-ss', f'{offset:.2f}', '-i', path, '-an', '-sn', '-dn',
+            '-vf', f'thumbnail={POSTER_WINDOW},{scale}', '-frames:v', '1',
+            '-f', 'image2pipe', '-c:v', 'mjpeg', '-q:v', '3', '-',
+        ])
+        if data:
+            return ContentFile(data, name='poster.jpg')
+    return None
+
+
+def _frame(path, offset):
+    """The frame at `offset` seconds, letterboxed to SPRITE_TILE, as a PIL image (None on failure)."""
+    w, h = SPRITE_TILE
+    data = _run([
+        '-ss', f'{offset:.2f}', '-i', path, '-an', '-sn', '-dn',
+        '-vf', f'scale={w}:{h}:force_original_aspect_ratio=decrease,pad={w}:{h}:(ow-iw)/2:(oh-ih)/2',
+        '-frames:v', '1', '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-',
+    ])
+    if not data or len(data) != w * h * 3:
+        return None
+    return Image.frombytes('RGB', SPRITE_TILE, data)
+
+
+def extract_sprite(path, duration, frames):
+    """
+    Scrub-preview sprite sheet: up to `frames` tiles at equal intervals.
+    Returns (JPEG ContentFile, seconds between tiles) or (None, 0).
+    """
+    frames = min(frames, int(duration or 0))  # At most one tile per second
+    if frames < 2:
+        return None, 0
+    interval = duration / frames
+    w, h = SPRITE_TILE
+    rows = -(-frames // SPRITE_COLUMNS)
+    sheet = Image.new('RGB', (w * min(frames, SPRITE_COLUMNS), h * rows))
+    got = 0
+    for i in range(frames):
+        # Middle of each interval, so the first tile isn't a title card
+        tile = _frame(path, (i + 0.5) * interval)
+        if tile is not None:
+            sheet.paste(tile, ((i % SPRITE_COLUMNS) * w, (i // SPRITE_COLUMNS) * h))
+            got += 1
+    if got < frames // 2:
+        return None, 0
+    output = io.BytesIO()
+    sheet.save(output, format='JPEG', quality=70, optimize=True)
+    return ContentFile(output.getvalue(), name='sprite.jpg'), interval
+
+
+# ── Pipeline ──────────────────────────────────────────────────────────────────
+
+def process(item):
+    """Fill in duration, poster and scrub sprite for a video item. Returns the fields updated."""
+    from portal import pagecache
+    from portal.models import ContentItem, format_duration
+
+    if item.file_type != 'video' or not item.file or not available():
+        return []
+    path = item.file.path
+    info = probe(path)
+    if info is None:
+        logger.info('Not a readable video, skipping previews: %s', item.file.name)
+        return []
+    duration = info['duration']
+
+    updates = {}
+    if duration and not item.duration:
+        updates['duration'] = format_duration(duration)
+    if not item.thumbnail:
+        poster = extract_poster(path, duration)
+        if poster:
+            item.thumbnail.save(f'{item.pk}_thumb.jpg', poster, save=False)
+            updates['thumbnail'] = item.thumbnail.name
+    if settings.CDN_VIDEO_SPRITE_FRAMES and not item.preview_sprite:
+        sprite, interval = extract_sprite(path, duration, settings.CDN_VIDEO_SPRITE_FRAMES)
+        if sprite:
+            item.preview_sprite.save(f'{item.pk}_sprite.jpg', sprite, save=False)
+            updates['preview_sprite'] = item.preview_sprite.name
+            updates['preview_interval'] = interval
+
+    if updates:
+        # A plain UPDATE: save() would re-run upload-side work (hashing, aggregates)
+        ContentItem.objects.filter(pk=item.pk).update(**updates)
+        pagecache.bump('content')
+    return list(updates)
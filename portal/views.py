@@ -1,11 +1,24 @@
 from django.shortcuts import render, get_object_or_404
-from django.http import JsonResponse, FileResponse, Http404
+from django.urls import Resolver404, resolve, reverse
+from django.http import HttpResponse, JsonResponse, FileResponse, Http404, StreamingHttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
 from django.conf import settings
 from django.db.models import Q
-from django.views.decorators.http import require_GET
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_GET, require_http_methods
 from django.utils import timezone
-from .models import Category, ContentItem, Announcement
+from django.utils.dateparse import parse_datetime
+from .models import Category, ContentItem, Announcement, Upload
+from .search import search_items
+from . import counters, diskusage, hls, uploads
+from .conditional import conditional
+from .pagecache import cache_page
+from .related import related_ids
+import base64
+import functools
+import json
 import os
+from urllib.parse import urlparse
 
 
 def _node_context():
@@ -16,9 +29,10 @@ def _node_context():
     }
 
 
+@cache_page('announcements')
 def home(request):
     """Main portal page — shows all categories."""
-    categories = Category.objects.prefetch_related('items').all()
+    categories = Category.objects.all()
 
     # Get active, non-expired announcements
     now = timezone.now()
@@ -33,9 +47,15 @@ def home(request):
         'categories': categories,
         'announcements': announcements,
     }
-    return render(request, 'portal/home.html', context)
+    response = render(request, 'portal/home.html', context)
+    # Don't keep serving an announcement from cache after it expires
+    expiries = [a.expires_at for a in announcements if a.expires_at]
+    if expiries:
+        response.cache_timeout = max(1, int((min(expiries) - now).total_seconds()))
+    return response
 
 
+@cache_page('content')
 def category_detail(request, slug):
     """Browse all content in a category."""
     category = get_object_or_404(Category, slug=slug)
@@ -49,7 +69,7 @@ def category_detail(request, slug):
     # Search within category
     q = request.GET.get('q', '').strip()
     if q:
-        items = items.filter(Q(title__icontains=q) | Q(description__icontains=q) | Q(tags__icontains=q))
+        items = search_items(items, q)
 
     context = {
         **_node_context(),
@@ -62,34 +82,77 @@ def category_detail(request, slug):
     return render(request, 'portal/category.html', context)
 
 
+def _referring_item(request):
+    """The pk of the item page the visitor came from, if they followed a link on this node."""
+    referer = urlparse(request.META.get('HTTP_REFERER', ''))
+    if referer.netloc != request.get_host():
+        return None
+    try:
+        match = resolve(referer.path)
+    except Resolver404:
+        return None
+    return match.kwargs.get('pk') if match.view_name == 'portal:item_detail' else None
+
+
 def item_detail(request, pk):
     """View/play a single content item."""
     item = get_object_or_404(ContentItem, pk=pk, is_active=True)
-    # Increment download/view counter
-    ContentItem.objects.filter(pk=pk).update(downloads=item.downloads + 1)
+    # Count the view — buffered in memory and flushed in batches (portal/counters.py)
+    counters.incr(item.pk, came_from=_referring_item(request))
 
-    related = ContentItem.objects.filter(
-        category=item.category, is_active=True
-    ).exclude(pk=pk)[:8]
+    # Precomputed by the worker (portal/related.py); new items fall back to their category
+    ids = related_ids(item.pk)
+    if ids:
+        found = ContentItem.objects.filter(pk__in=ids, is_active=True).in_bulk()
+        related = [found[i] for i in ids if i in found]
+    else:
+        related = ContentItem.objects.filter(
+            category=item.category, is_active=True
+        ).exclude(pk=pk)[:8]
 
     context = {
         **_node_context(),
         'item': item,
         'related': related,
+        'hls_enabled': settings.CDN_HLS_ENABLED,
         'all_categories': Category.objects.all(),
     }
     return render(request, 'portal/item_detail.html', context)
 
 
+@require_GET
+@gzip_page  # A film's playlist is a few hundred KB of near-identical lines
+def item_hls(request, pk):
+    """
+    HLS playlist for a video, packaged on the first request (portal/hls.py).
+    Segments are served from /media/. 503 with Retry-After while the first
+    segment is being written; the player asks again after it, and falls back
+    to the file itself on any other error.
+    """
+    item = get_object_or_404(ContentItem, pk=pk, is_active=True)
+    try:
+        text = hls.playlist(item)
+    except hls.Unavailable:
+        raise Http404('No HLS stream for this item')
+    except hls.NotReady:
+        response = HttpResponse('Stream is being prepared', status=503, content_type='text/plain')
+        response['Retry-After'] = '1'
+        return response
+    response = HttpResponse(text, content_type='application/vnd.apple.mpegurl')
+    # The playlist grows while packaging is running
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+@cache_page('content')
 def search(request):
     """Search across all content."""
     q = request.GET.get('q', '').strip()
     items = ContentItem.objects.none()
     if q:
-        items = ContentItem.objects.filter(
-            Q(title__icontains=q) | Q(description__icontains=q) | Q(tags__icontains=q),
-            is_active=True
-        ).select_related('category')
+        items = search_items(
+            ContentItem.objects.filter(is_active=True).select_related('category'), q
+        )
 
     context = {
         **_node_context(),
@@ -100,6 +163,7 @@ def search(request):
     return render(request, 'portal/search.html', context)
 
 
+@cache_page('content')
 def recent(request):
     """Recently added content."""
     items = ContentItem.objects.filter(is_active=True).select_related('category')[:50]
@@ -114,18 +178,28 @@ def recent(request):
 
 # ── API endpoints (JSON) ───────────────────────────────────────────────────────
 
+def _disk_sample(request):
+    # Disk figures change without a catalogue bump; the sampler's cached value costs nothing to read
+    from portal.storage import _get_media_root
+    disk = diskusage.usage(_get_media_root(), wait=False)
+    return f'{disk.total}:{disk.used >> 20}:{disk.stale}' if disk else ''
+
+
 @require_GET
+@conditional('content', 'categories', 'settings', 'storage', extra=_disk_sample)
 def api_stats(request):
     from portal.storage import _get_media_root
-    categories = Category.objects.prefetch_related('items').all()
+    from portal import storage_index
+    categories = list(Category.objects.all())
     total_size = sum(c.total_size for c in categories)
     media_path = _get_media_root()
-    try:
-        import shutil
-        disk = shutil.disk_usage(media_path)
+    indexed = storage_index.totals(media_path)
+    disk_by_dir = storage_index.usage_by_top_dir(media_path) if indexed else {}
+    disk = diskusage.usage(media_path)
+    if disk is not None:
         disk_total = disk.total
         disk_used = disk.used
-    except Exception:
+    else:
         disk_total = 0
         disk_used = total_size
 
@@ -139,36 +213,264 @@ def api_stats(request):
                 'icon': c.icon,
                 'count': c.item_count,
                 'total_size': c.total_size,
-                'cover': c.cover_image.url if c.cover_image else None,
+                'disk_size': disk_by_dir.get(c.slug, 0),
+                'cover': c.cover_url,
             }
             for c in categories
         ],
-        'total_files': ContentItem.objects.filter(is_active=True).count(),
+        'total_files': sum(c.item_count for c in categories),
         'total_size': total_size,
         'disk_used': disk_used,
         'disk_total': disk_total,
+        'disk_stale': disk is None or disk.stale,
+        'media_files': indexed['files'] if indexed else None,
+        'media_bytes': indexed['bytes'] if indexed else None,
     })
 
 
+# Fields a client may request from /api/files/ via ?fields=id,title,...
+API_FILE_FIELDS = {
+    'id': lambda item: item.pk,
+    'title': lambda item: item.title,
+    'category': lambda item: item.category.name,
+    'file_type': lambda item: item.file_type,
+    'file_url': lambda item: item.file_url,
+    'thumbnail': lambda item: item.thumbnail_url,
+    'size': lambda item: item.file_size,
+    'year': lambda item: item.year,
+    'uploaded_at': lambda item: item.uploaded_at.isoformat(),
+}
+API_FILES_DEFAULT_FIELDS = ['id', 'title', 'category', 'file_type', 'file_url', 'thumbnail', 'size', 'year']
+API_FILES_DEFAULT_LIMIT = 200
+API_FILES_MAX_LIMIT = 1000
+API_FILES_STREAM_CHUNK = 2000
+
+
+def _encode_cursor(item):
+    raw = f'{item.uploaded_at.isoformat()}|{item.pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor):
+    """Return (uploaded_at, pk) from an opaque cursor, or raise ValueError."""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+    except Exception:
+        raise ValueError('bad cursor')
+    stamp, _, pk = raw.rpartition('|')
+    uploaded_at = parse_datetime(stamp)
+    if uploaded_at is None or not pk.isdigit():
+        raise ValueError('bad cursor')
+    return uploaded_at, int(pk)
+
+
+def _wants_ndjson(request):
+    return 'ndjson' if 'application/x-ndjson' in request.headers.get('Accept', '') else ''
+
+
 @require_GET
+@conditional('content', 'categories', extra=_wants_ndjson)
 def api_files(request):
+    """
+    List active items ordered by (uploaded_at, id).
+
+    ?limit=N (max 1000) and ?cursor=<next_cursor> page through the catalogue;
+    ?fields=id,title,... picks the keys returned; ?format=ndjson (or
+    Accept: application/x-ndjson) streams every remaining item, one JSON
+    object per line, at constant memory.
+    """
     items = ContentItem.objects.filter(is_active=True).select_related('category')
     category_slug = request.GET.get('category')
     q = request.GET.get('q', '').strip()
     if category_slug:
         items = items.filter(category__slug=category_slug)
     if q:
-        items = items.filter(Q(title__icontains=q) | Q(tags__icontains=q))
-    return JsonResponse({'items': [
-        {
-            'id': item.pk,
-            'title': item.title,
-            'category': item.category.name,
-            'file_type': item.file_type,
-            'file_url': item.file.url,
-            'thumbnail': item.thumbnail.url if item.thumbnail else None,
-            'size': item.file_size,
-            'year': item.year,
-        }
-        for item in items[:200]
-    ]})
+        items = search_items(items, q, ranked=False)
+
+    fields = request.GET.get('fields')
+    fields = [f.strip() for f in fields.split(',') if f.strip()] if fields else API_FILES_DEFAULT_FIELDS
+    unknown = [f for f in fields if f not in API_FILE_FIELDS]
+    if unknown:
+        return JsonResponse({'error': f'Unknown fields: {", ".join(unknown)}'}, status=400)
+
+    cursor = request.GET.get('cursor')
+    if cursor:
+        try:
+            after_at, after_pk = _decode_cursor(cursor)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid cursor'}, status=400)
+        items = items.filter(Q(uploaded_at__gt=after_at) | Q(uploaded_at=after_at, pk__gt=after_pk))
+    items = items.order_by('uploaded_at', 'pk')
+
+    def serialize(item):
+        return {name: API_FILE_FIELDS[name](item) for name in fields}
+
+    stream = request.GET.get('format') == 'ndjson' or \
+        'application/x-ndjson' in request.headers.get('Accept', '')
+    if stream:
+        def lines():
+            # Yield a few hundred lines at a time — one socket write per batch, not per item
+            batch = []
+            for item in items.iterator(chunk_size=API_FILES_STREAM_CHUNK):
+                batch.append(json.dumps(serialize(item), cls=DjangoJSONEncoder))
+                if len(batch) >= 500:
+                    yield '\n'.join(batch) + '\n'
+                    batch = []
+            if batch:
+                yield '\n'.join(batch) + '\n'
+        return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+
+    try:
+        limit = int(request.GET.get('limit', API_FILES_DEFAULT_LIMIT))
+    except ValueError:
+        return JsonResponse({'error': 'limit must be an integer'}, status=400)
+    limit = max(1, min(limit, API_FILES_MAX_LIMIT))
+
+    page = list(items[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    return JsonResponse({
+        'items': [serialize(item) for item in page],
+        'next_cursor': _encode_cursor(page[-1]) if has_more else None,
+    })
+
+
+@require_GET
+def api_popular(request):
+    """Most viewed items over the last N hours or days: ?period=hour|day&windows=N&limit=N"""
+    period = request.GET.get('period', 'day')
+    if period not in ('hour', 'day'):
+        return JsonResponse({'error': 'period must be "hour" or "day"'}, status=400)
+    try:
+        windows = max(1, min(int(request.GET.get('windows', 1)), 168 if period == 'hour' else 90))
+        limit = max(1, min(int(request.GET.get('limit', 10)), 100))
+    except ValueError:
+        return JsonResponse({'error': 'windows and limit must be integers'}, status=400)
+
+    ranked = counters.popular(period, windows, limit)
+    items = ContentItem.objects.filter(pk__in=[pk for pk, _ in ranked], is_active=True) \
+        .select_related('category').in_bulk()
+    return JsonResponse({
+        'period': period,
+        'windows': windows,
+        'items': [
+            {
+                'id': pk,
+                'title': items[pk].title,
+                'category': items[pk].category.name,
+                'views': views,
+            }
+            for pk, views in ranked if pk in items
+        ],
+    })
+
+
+@require_GET
+def api_cache(request):
+    """Page cache hit/miss counts for the worker process that answers."""
+    from portal import pagecache
+    per_view = pagecache.stats()
+    hits = sum(v['hits'] for v in per_view.values())
+    misses = sum(v['misses'] for v in per_view.values())
+    return JsonResponse({
+        'pid': os.getpid(),
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / (hits + misses), 3) if hits + misses else None,
+        'views': per_view,
+        'versions': {name: pagecache.generation(name) for name in pagecache.GENERATIONS},
+    })
+
+
+@require_GET
+def api_metrics(request):
+    """Request latency, throughput, streams, cache and SQL figures for the whole node."""
+    from portal import telemetry
+    return JsonResponse(telemetry.summary())
+
+
+@require_GET
+def metrics(request):
+    """Prometheus text format, pre-rendered in the background (portal/metrics.py)."""
+    from portal.metrics import exposition
+    return HttpResponse(exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# ── Resumable uploads (tus-style, see portal/uploads.py) ──────────────────────
+#
+#   POST   /api/uploads/        {"filename", "size", "category", "title"?}  → 201, Location
+#   HEAD   /api/uploads/<id>/   → Upload-Offset, Upload-Length
+#   PATCH  /api/uploads/<id>/   Upload-Offset: <n>, body = next chunk       → 204, Upload-Offset
+#   DELETE /api/uploads/<id>/   abandon the upload
+#
+# Staff only; session-authenticated, so requests need the CSRF token header.
+
+def _upload_response(upload, status=200, **body):
+    if body:
+        response = JsonResponse(body, status=status)
+    else:
+        response = HttpResponse(status=status)
+    response['Tus-Resumable'] = '1.0.0'
+    response['Upload-Length'] = str(upload.size)
+    response['Upload-Offset'] = str(uploads.offset(upload))
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+def _staff_api(view):
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not (request.user.is_active and request.user.is_staff):
+            return JsonResponse({'error': 'Staff login required'}, status=403)
+        try:
+            return view(request, *args, **kwargs)
+        except uploads.UploadError as e:
+            return JsonResponse({'error': str(e)}, status=e.status)
+    return wrapper
+
+
+@require_http_methods(['POST'])
+@_staff_api
+def api_upload_create(request):
+    """Start a resumable upload; the item is created in `category` when the last byte arrives."""
+    try:
+        data = json.loads(request.body)
+        size = int(data['size'])
+        category = Category.objects.get(slug=data['category'])
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected JSON with filename, size and category'}, status=400)
+    except Category.DoesNotExist:
+        return JsonResponse({'error': 'Unknown category'}, status=400)
+
+    upload = uploads.create(category, data.get('filename'), size, data.get('title', ''), request.user)
+    location = request.build_absolute_uri(reverse('portal:api_upload', args=[upload.id]))
+    response = _upload_response(upload, status=201, id=str(upload.id), location=location,
+                                item=upload.item_id)
+    response['Location'] = location
+    return response
+
+
+@require_http_methods(['HEAD', 'GET', 'PATCH', 'DELETE'])
+@_staff_api
+def api_upload(request, upload_id):
+    """Offset query (HEAD/GET), next chunk (PATCH) or abort (DELETE) for one upload."""
+    upload = get_object_or_404(Upload, pk=upload_id)
+
+    if request.method == 'DELETE':
+        uploads.abort(upload)
+        return HttpResponse(status=204)
+
+    if request.method == 'PATCH':
+        try:
+            start = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            return JsonResponse({'error': 'Upload-Offset header is required'}, status=400)
+        length = request.META.get('CONTENT_LENGTH')
+        uploads.append(upload, request, start, int(length) if length else None)
+        return _upload_response(upload, status=204)
+
+    if request.method == 'HEAD':
+        return _upload_response(upload)
+    return _upload_response(upload, id=str(upload.id), filename=upload.filename,
+                            size=upload.size, offset=uploads.offset(upload), item=upload.item_id)
@@ -352,9 +352,38 @@ ReadWritePaths=${EXT_DRIVE:+$EXT_DRIVE }$MEDIA_ROOT /var/log/cdn-portal $INSTALL
 WantedBy=multi-user.target
 EOF
 
+cat > /etc/systemd/system/cdn-portal-worker.service <<EOF
+[Unit]
+Description=Community CDN Portal background worker (thumbnails, metadata)
+After=cdn-portal.service
+PartOf=cdn-portal.service
+
+[Service]
+Type=simple
+User=$SERVICE_USER
+Group=$SERVICE_USER
+WorkingDirectory=$INSTALL_DIR
+EnvironmentFile=$INSTALL_DIR/.env
+ExecStart=$INSTALL_DIR/venv/bin/python $INSTALL_DIR/manage.py run_worker
+Restart=always
+RestartSec=10
+Nice=10
+
+NoNewPrivileges=true
+PrivateTmp=true
+ProtectSystem=strict
+ProtectHome=true
+ReadWritePaths=${EXT_DRIVE:+$EXT_DRIVE }$MEDIA_ROOT /var/log/cdn-portal $INSTALL_DIR
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
 systemctl daemon-reload
 systemctl enable cdn-portal.service 2>&1 > /dev/null
+systemctl enable cdn-portal-worker.service 2>&1 > /dev/null
 systemctl restart cdn-portal.service
+systemctl restart cdn-portal-worker.service
 
 sleep 3
 
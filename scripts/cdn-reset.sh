@@ -75,6 +75,12 @@ echo -e "${CYAN}${BOLD} Stopping Service${NC}"
 echo -e "${CYAN}${BOLD}────────────────────────────────────────────────────────${NC}"
 echo ""
 
+if systemctl is-active --quiet cdn-portal-worker 2>/dev/null; then
+  systemctl stop cdn-portal-worker
+fi
+systemctl disable cdn-portal-worker 2>/dev/null || true
+rm -f /etc/systemd/system/cdn-portal-worker.service
+
 if systemctl is-active --quiet cdn-portal 2>/dev/null; then
   systemctl stop cdn-portal
   log "Service stopped"
@@ -146,9 +146,38 @@ ReadWritePaths=$MEDIA_ROOT $LOG_DIR $INSTALL_DIR
 WantedBy=multi-user.target
 EOF
 
+cat > /etc/systemd/system/cdn-node-worker.service <<EOF
+[Unit]
+Description=CDN Node background worker (thumbnails, metadata)
+After=cdn-node.service
+PartOf=cdn-node.service
+
+[Service]
+Type=simple
+User=$SERVICE_USER
+Group=$SERVICE_USER
+WorkingDirectory=$INSTALL_DIR
+EnvironmentFile=$INSTALL_DIR/.env
+ExecStart=$INSTALL_DIR/venv/bin/python $INSTALL_DIR/manage.py run_worker
+Restart=always
+RestartSec=10
+Nice=10
+
+NoNewPrivileges=true
+PrivateTmp=true
+ProtectSystem=strict
+ProtectHome=true
+ReadWritePaths=$MEDIA_ROOT $LOG_DIR $INSTALL_DIR
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
 systemctl daemon-reload
 systemctl enable cdn-node.service
+systemctl enable cdn-node-worker.service
 systemctl restart cdn-node.service
+systemctl restart cdn-node-worker.service
 sleep 3
 
 if systemctl is-active --quiet cdn-node.service; then
@@ -373,9 +373,38 @@ ReadWritePaths=$MEDIA_ROOT /var/log/cdn-portal $INSTALL_DIR
 WantedBy=multi-user.target
 EOF
 
+cat > /etc/systemd/system/cdn-portal-worker.service <<EOF
+[Unit]
+Description=Community CDN Portal background worker (thumbnails, metadata)
+After=cdn-portal.service
+PartOf=cdn-portal.service
+
+[Service]
+Type=simple
+User=$SERVICE_USER
+Group=$SERVICE_USER
+WorkingDirectory=$INSTALL_DIR
+EnvironmentFile=$INSTALL_DIR/.env
+ExecStart=$INSTALL_DIR/venv/bin/python $INSTALL_DIR/manage.py run_worker
+Restart=always
+RestartSec=10
+Nice=10
+
+NoNewPrivileges=true
+PrivateTmp=true
+ProtectSystem=strict
+ProtectHome=true
+ReadWritePaths=$MEDIA_ROOT /var/log/cdn-portal $INSTALL_DIR
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
 systemctl daemon-reload
 systemctl enable cdn-portal.service
+systemctl enable cdn-portal-worker.service
 systemctl start cdn-portal.service
+systemctl start cdn-portal-worker.service
 
 sleep 3
 
@@ -47,7 +47,7 @@ echo -e "${CYAN}${BOLD} Removing Old Installation${NC}"
 echo -e "${CYAN}${BOLD}────────────────────────────────────────────────────────${NC}"
 echo ""
 
-for svc in cdn-portal content-admin athi-cn; do
+for svc in cdn-portal-worker cdn-portal content-admin athi-cn; do
     if systemctl is-active --quiet "$svc" 2>/dev/null; then
         info "Stopping service: $svc"
         systemctl stop "$svc"
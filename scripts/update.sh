@@ -137,7 +137,42 @@ echo -e "${CYAN}${BOLD} Restarting Service${NC}"
 echo -e "${CYAN}${BOLD}────────────────────────────────────────────────────────${NC}"
 echo ""
 
+# Background worker (added in a later release) — install the unit if missing
+if [ ! -f /etc/systemd/system/cdn-portal-worker.service ]; then
+    EXT_RW=$(grep -oP '(?<=^ReadWritePaths=).*' /etc/systemd/system/cdn-portal.service 2>/dev/null || echo "$MEDIA_ROOT_PATH /var/log/cdn-portal $INSTALL_DIR")
+    cat > /etc/systemd/system/cdn-portal-worker.service <<EOF
+[Unit]
+Description=Community CDN Portal background worker (thumbnails, metadata)
+After=cdn-portal.service
+PartOf=cdn-portal.service
+
+[Service]
+Type=simple
+User=$SERVICE_USER
+Group=$SERVICE_USER
+WorkingDirectory=$INSTALL_DIR
+EnvironmentFile=$INSTALL_DIR/.env
+ExecStart=$INSTALL_DIR/venv/bin/python $INSTALL_DIR/manage.py run_worker
+Restart=always
+RestartSec=10
+Nice=10
+
+NoNewPrivileges=true
+PrivateTmp=true
+ProtectSystem=strict
+ProtectHome=true
+ReadWritePaths=$EXT_RW
+
+[Install]
+WantedBy=multi-user.target
+EOF
+    systemctl daemon-reload
+    systemctl enable cdn-portal-worker.service 2>&1 > /dev/null
+    log "Installed background worker service"
+fi
+
 systemctl restart cdn-portal.service
+systemctl restart cdn-portal-worker.service
 sleep 3
 
 if systemctl is-active --quiet cdn-portal.service; then
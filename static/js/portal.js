@@ -70,3 +70,79 @@ function formatBytes(b) {
     }
   });
 })();
+
+// HLS where the browser plays it natively (Safari, iOS, Android Chrome): the first
+// segment arrives long before an MP4's index would. The server packages the stream
+// on the first request (portal/hls.py) and answers 503 until the first segment is
+// written, so we ask again after Retry-After; on any other error we play the file.
+(function() {
+  const video = document.querySelector('video[data-hls]');
+  if (!video || !video.canPlayType('application/vnd.apple.mpegurl')) return;
+  let retries = 10;
+
+  function playFile() {
+    video.removeEventListener('error', retry);
+    video.removeAttribute('src');
+    video.load();  // Picks up the <source> file
+  }
+
+  function retry() {
+    if (retries-- <= 0) return playFile();
+    fetch(video.dataset.hls).then(function(response) {
+      if (response.ok) return void (video.src = video.dataset.hls);
+      if (response.status !== 503) return playFile();
+      const wait = parseFloat(response.headers.get('Retry-After')) || 1;
+      setTimeout(function() { video.src = video.dataset.hls; }, wait * 1000);
+    }, playFile);
+  }
+
+  video.addEventListener('error', retry);
+  video.src = video.dataset.hls;
+})();
+
+// Video scrub preview: hovering the bar under the player shows the sprite-sheet
+// tile for that moment (made by the worker, portal/video.py); clicking seeks
+(function() {
+  const video = document.querySelector('video[data-sprite]');
+  if (!video) return;
+  const interval = parseFloat(video.dataset.interval);
+  const tileW = parseInt(video.dataset.tileWidth, 10);
+  const tileH = parseInt(video.dataset.tileHeight, 10);
+  const columns = parseInt(video.dataset.columns, 10);
+
+  const bar = document.createElement('div');
+  bar.className = 'scrub-bar';
+  const progress = document.createElement('div');
+  progress.className = 'scrub-progress';
+  const preview = document.createElement('div');
+  preview.className = 'scrub-preview';
+  preview.style.width = tileW + 'px';
+  preview.style.height = tileH + 'px';
+  preview.style.backgroundImage = 'url("' + video.dataset.sprite + '")';
+  bar.append(progress, preview);
+  video.closest('.player-wrap').after(bar);
+
+  function fractionAt(e) {
+    const r = bar.getBoundingClientRect();
+    return Math.max(0, Math.min(1, (e.clientX - r.left) / r.width));
+  }
+
+  bar.addEventListener('pointermove', (e) => {
+    if (!video.duration) return;
+    const f = fractionAt(e);
+    const tiles = Math.max(1, Math.round(video.duration / interval));
+    const i = Math.min(Math.floor(f * video.duration / interval), tiles - 1);
+    preview.style.backgroundPosition =
+      -(i % columns) * tileW + 'px ' + -Math.floor(i / columns) * tileH + 'px';
+    const half = tileW / 2;
+    preview.style.left = Math.max(half, Math.min(bar.clientWidth - half, f * bar.clientWidth)) + 'px';
+    preview.style.display = 'block';
+  });
+  bar.addEventListener('pointerleave', () => { preview.style.display = 'none'; });
+  bar.addEventListener('click', (e) => {
+    if (video.duration) video.currentTime = fractionAt(e) * video.duration;
+  });
+  video.addEventListener('timeupdate', () => {
+    if (video.duration) progress.style.width = (video.currentTime / video.duration * 100) + '%';
+  });
+})();